@@ -27,7 +27,7 @@
 
 __version__ = (2, 3, 0)  # Which API do we expose to our application
 
-import sys, traceback, os, inspect
+import sys, traceback, os, inspect, types
 
 # All (optional) 3rd-party modules in our libs-directory
 cwd = os.path.abspath(os.path.dirname(__file__))
@@ -184,7 +184,7 @@ def setDefaultDomainLanguage( domain, lang ):
 
 ### Multi-Language Part: END
 
-from server import session, errors
+from server import session, errors, postSave, searchQueue
 from server.tasks import TaskHandler, runStartupTasks
 
 try:
@@ -520,6 +520,8 @@ class BrowseHandler(webapp.RequestHandler):
 				bugsnag.configure_request( context=path, user_id=user, session_data=sessData )
 				bugsnag.notify( e )
 		finally:
+			postSave.flush()
+			searchQueue.flush()
 			self.saveSession( )
 
 
@@ -609,7 +611,12 @@ class BrowseHandler(webapp.RequestHandler):
 		try:
 			if (conf["viur.debug.traceExternalCallRouting"] and not self.internalRequest) or conf["viur.debug.traceInternalCallRouting"]:
 				logging.debug("Calling %s with args=%s and kwargs=%s" % (str(caller),unicode(args), unicode(kwargs)))
-			self.response.out.write( caller( *self.args, **self.kwargs ) )
+			res = caller( *self.args, **self.kwargs )
+			if isinstance( res, types.GeneratorType ): # Streamed response (like lists rendered by the json renderer)
+				for chunk in res:
+					self.response.out.write( chunk )
+			else:
+				self.response.out.write( res )
 		except TypeError as e:
 			if self.internalRequest: #We provide that "service" only for requests originating from outside
 				raise
@@ -2,6 +2,7 @@
 from google.appengine.api import search
 from server.config import conf
 from server import db
+from server.fulltext import tokenize
 import logging
 import hashlib
 import copy
@@ -222,7 +223,7 @@ class baseBone(object): # One Bone:
 		def fromShortKey( key ):
 			if isinstance(key, basestring ):
 				try:
-					key = db.Key( encoded=key )
+					key = db.decodeKey( key )
 				except:
 					key = unicode( key )
 					if key.isdigit():
@@ -334,6 +335,23 @@ class baseBone(object): # One Bone:
 		return( dbFilter )
 
 
+	def getFacetValues(self, valuesCache, name):
+		"""
+			Returns the facet-values of this bone (see :mod:`server.facets`) as strings.
+			Bones usable as facet (or as facetScope of a skeleton) override this.
+
+			:return: List of Strings
+		"""
+		return( [] )
+
+	def getFacetCandidates(self):
+		"""
+			Returns all facet-values this bone can have; used to fetch their counts at once.
+
+			:return: List of Strings
+		"""
+		return( [] )
+
 	def getSearchTags(self, valuesCache, name):
 		"""
 			Returns a list of Strings which will be included in the
@@ -345,17 +363,14 @@ class baseBone(object): # One Bone:
 				by setting a searchIndex on the skeleton, getSearchDocumentFields
 				is called instead.
 
+			Terms occurring multiple times may be returned multiple times;
+			they're counted as the term-frequency by :mod:`server.fulltext`.
+
 			:return: List of Strings
 		"""
-		res = []
 		if not valuesCache[name]:
-			return( res )
-		for line in unicode(valuesCache[name]).lower().splitlines():
-			for key in line.split(" "):
-				key = "".join( [ c for c in key if c.lower() in conf["viur.searchValidChars"] ] )
-				if key and key not in res and len(key)>3:
-					res.append( key )
-		return( res )
+			return( [] )
+		return( tokenize( valuesCache[name], minLength=4 ) )
 
 	def getSearchDocumentFields(self, valuesCache, name, prefix = ""):
 		"""
@@ -423,9 +438,25 @@ class baseBone(object): # One Bone:
 		"""
 		pass
 
-	def refresh(self, valuesCache, boneName, skel):
+	def getRefreshKeys(self, valuesCache, boneName):
+		"""
+			Returns the keys of all entities :func:`refresh` needs to read.
+
+			:func:`server.skeleton.BaseSkeleton.refresh` fetches the entities of all bones
+			in one batch and passes them to :func:`refresh` as *prefetched*.
+
+			:return: List of string-encoded keys
+			:rtype: list of str
+		"""
+		return []
+
+	def refresh(self, valuesCache, boneName, skel, prefetched=None):
 		"""
 			Refresh all values we might have cached from other entities.
+
+			:param prefetched: Mapping of string-encoded keys to the entities already fetched
+				from the datastore (None if they don't exist), as requested by :func:`getRefreshKeys`.
+			:type prefetched: dict | None
 		"""
 		pass
 
@@ -10,10 +10,19 @@ class booleanBone( baseBone ):
 	def generageSearchWidget(target,name="BOOLEAN BONE"):
 		return ( {"name":name,"target":target,"type":"boolean"} )
 
-	def __init__( self, defaultValue=False, *args, **kwargs ):
+	def __init__( self, defaultValue=False, facet=False, *args, **kwargs ):
 		assert defaultValue in [True, False]
 		defaultValue = defaultValue
 		super( booleanBone, self ).__init__( defaultValue=defaultValue,  *args,  **kwargs )
+		self.facet = facet
+
+	def getFacetValues( self, valuesCache, name ):
+		if valuesCache.get( name ) is None:
+			return( [] )
+		return( [ u"1" if valuesCache[name] else u"0" ] )
+
+	def getFacetCandidates( self ):
+		return( [ u"0", u"1" ] )
 
 	def fromClient( self, valuesCache, name, data ):
 		"""
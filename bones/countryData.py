@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+"""
+	Countries known to :class:`server.bones.selectCountryBone.selectCountryBone`.
+
+	One country per line: its ISO 3166-1 alpha-3 code, alpha-2 code and english name.
+	This module is imported on first use only.
+"""
+
+countries = u"""\
+abw aw Aruba
+afg af Afghanistan
+ago ao Angola
+aia ai Anguilla
+alb al Albania
+and ad Andorra
+ant an Netherlands Antilles
+are ae United Arab Emirates
+arg ar Argentina
+arm am Armenia
+asm as American Samoa
+ata aq Antarctica
+atf tf French Southern Territories
+atg ag Antigua and Barbuda
+aus au Australia
+aut at Austria
+aze az Azerbaijan
+bdi bi Burundi
+bel be Belgium
+ben bj Benin
+bfa bf Burkina Faso
+bgd bd Bangladesh
+bgr bg Bulgaria
+bhr bh Bahrain
+bhs bs Bahamas
+bih ba Bosnia and Herzegovina
+blm bl Saint Barthelemy
+blr by Belarus
+blz bz Belize
+bmu bm Bermuda
+bol bo Bolivia
+bra br Brazil
+brb bb Barbados
+brn bn Brunei
+btn bt Bhutan
+bvt bv Bouvet Island
+bwa bw Botswana
+caf cf Central African Republic
+can ca Canada
+cck cc Cocos Islands
+che ch Switzerland
+chl cl Chile
+chn cn China
+civ ci Ivory Coast
+cmr cm Cameroon
+cod cd Congo Democratic Republic
+cog cg Congo Republic
+cok ck Cook Islands
+col co Colombia
+com km Comoros
+cpv cv Cape Verde
+cri cr Costa Rica
+cub cu Cuba
+cxr cx Christmas Island
+cym ky Cayman Islands
+cyp cy Cyprus
+cze cz Czech Republic
+deu de Germany
+dji dj Djibouti
+dma dm Dominica
+dnk dk Denmark
+dom do Dominican Republic
+dza dz Algeria
+ecu ec Ecuador
+egy eg Egypt
+eri er Eritrea
+esh eh Western Sahara
+esp es Spain
+est ee Estonia
+eth et Ethiopia
+fin fi Finland
+fji fj Fiji
+flk fk Falkland Islands
+fra fr France
+fro fo Faroe Islands
+fsm fm Micronesia
+gab ga Gabon
+gbr gb United Kingdom
+geo ge Georgia
+ggy gg Guernsey
+gha gh Ghana
+gib gi Gibraltar
+gin gn Guinea
+gmb gm Gambia
+gnb gw Guinea-Bissau
+gnq gq Equatorial Guinea
+grc gr Greece
+grd gd Grenada
+grl gl Greenland
+gtm gt Guatemala
+gum gu Guam
+guy gy Guyana
+hkg hk Hong Kong
+hmd hm Heard Island and McDonald Islands
+hnd hn Honduras
+hrv hr Croatia
+hti ht Haiti
+hun hu Hungary
+idn id Indonesia
+imn im Isle of Man
+ind in India
+iot io British Indian Ocean Territory
+irl ie Ireland
+irn ir Iran
+irq iq Iraq
+isl is Iceland
+isr il Israel
+ita it Italy
+jam jm Jamaica
+jey je Jersey
+jor jo Jordan
+jpn jp Japan
+kaz kz Kazakhstan
+ken ke Kenya
+kgz kg Kyrgyzstan
+khm kh Cambodia
+kir ki Kiribati
+kna kn Saint Kitts and Nevis
+kor kr Korea South
+kwt kw Kuwait
+lao la Laos
+lbn lb Lebanon
+lbr lr Liberia
+lby ly Libya
+lca lc Saint Lucia
+lie li Liechtenstein
+lka lk Sri Lanka
+lso ls Lesotho
+ltu lt Lithuania
+lux lu Luxembourg
+lva lv Latvia
+mac mo Macao
+maf mf Saint Martin
+mar ma Morocco
+mco mc Monaco
+mda md Moldova
+mdg mg Madagascar
+mdv mv Maldives
+mex mx Mexico
+mhl mh Marshall Islands
+mkd mk Macedonia
+mli ml Mali
+mlt mt Malta
+mmr mm Myanmar
+mne me Montenegro
+mng mn Mongolia
+mnp mp Northern Mariana Islands
+moz mz Mozambique
+mrt mr Mauritania
+msr ms Montserrat
+mus mu Mauritius
+mwi mw Malawi
+mys my Malaysia
+myt yt Mayotte
+nam na Namibia
+ncl nc New Caledonia
+ner ne Niger
+nfk nf Norfolk Island
+nga ng Nigeria
+nic ni Nicaragua
+niu nu Niue
+nld nl Netherlands
+nor no Norway
+npl np Nepal
+nru nr Nauru
+nzl nz New Zealand
+omn om Oman
+pak pk Pakistan
+pan pa Panama
+pcn pn Pitcairn
+per pe Peru
+phl ph Philippines
+plw pw Palau
+png pg Papua New Guinea
+pol pl Poland
+pri pr Puerto Rico
+prk kp Korea North
+prt pt Portugal
+pry py Paraguay
+pse ps Palestinian Territory
+pyf pf French Polynesia
+qat qa Qatar
+rou ro Romania
+rus ru Russia
+rwa rw Rwanda
+sau sa Saudi Arabia
+sdn sd Sudan
+sen sn Senegal
+sgp sg Singapore
+shn sh Saint Helena Ascension and Tristan da Cunha
+sjm sj Svalbard
+slb sb Solomon Islands
+sle sl Sierra Leone
+slv sv El Salvador
+smr sm San Marino
+som so Somalia
+spm pm Saint Pierre and Miquelon
+srb rs Serbia
+stp st Sao Tome and Principe
+sur sr Suriname
+svk sk Slovakia
+svn si Slovenia
+swe se Sweden
+swz sz Swaziland
+syc sc Seychelles
+syr sy Syria
+tca tc Turks and Caicos Islands
+tcd td Chad
+tgo tg Togo
+tha th Thailand
+tjk tj Tajikistan
+tkl tk Tokelau
+tkm tm Turkmenistan
+tls tl Timor-Leste
+ton to Tonga
+tto tt Trinidad and Tobago
+tun tn Tunisia
+tur tr Turkey
+tuv tv Tuvalu
+twn tw Taiwan
+tza tz Tanzania
+uga ug Uganda
+ukr ua Ukraine
+ury uy Uruguay
+usa us United States
+uzb uz Uzbekistan
+vat va Holy See
+vct vc Saint Vincent and the Grenadines
+ven ve Venezuela
+vgb vg British Virgin Islands
+vir vi Virgin Islands
+vnm vn Vietnam
+vut vu Vanuatu
+wlf wf Wallis and Futuna
+wsm ws Samoa
+yem ye Yemen
+zaf za South Africa
+zmb zm Zambia
+zwe zw Zimbabwe
+"""
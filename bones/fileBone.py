@@ -52,7 +52,26 @@ class fileBone(treeItemBone):
 						val["dest"]["mimetype"] = val["dest"]["metamime"]
 		return res
 
-	def refresh(self, valuesCache, boneName, skel):
+	def _blobImportMapKey(self, dlkey):
+		"""
+			Returns the key of the viur-blobimportmap entry for *dlkey*.
+		"""
+		return str(db.Key.from_path("viur-blobimportmap", sha256(dlkey).hexdigest().encode("hex")))
+
+	def getRefreshKeys(self, valuesCache, boneName):
+		"""
+			Returns the keys of the referenced files and their viur-blobimportmap entries.
+		"""
+		res = super(fileBone, self).getRefreshKeys(valuesCache, boneName)
+		for relDict in self._iterRelDicts(valuesCache, boneName):
+			if isinstance(relDict, dict) and relDict.get("dest") and relDict["dest"].get("dlkey"):
+				try:
+					res.append(self._blobImportMapKey(relDict["dest"]["dlkey"]))
+				except:
+					continue
+		return res
+
+	def refresh(self, valuesCache, boneName, skel, prefetched=None):
 		"""
 			Refresh all values we might have cached from other entities.
 		"""
@@ -79,10 +98,12 @@ class fileBone(treeItemBone):
 			# from the corresponding viur-blobimportmap entity.
 			if "dlkey" in valDict:
 				try:
-					oldKeyHash = sha256(valDict["dlkey"]).hexdigest().encode("hex")
-
-					logging.info("Trying to fetch entry from blobimportmap with hash %s" % oldKeyHash)
-					res = db.Get(db.Key.from_path("viur-blobimportmap", oldKeyHash))
+					importMapKey = self._blobImportMapKey(valDict["dlkey"])
+					if prefetched is not None and importMapKey in prefetched:
+						res = prefetched[importMapKey]
+					else:
+						logging.info("Trying to fetch entry from blobimportmap %s" % importMapKey)
+						res = db.Get(importMapKey)
 				except:
 					res = None
 
@@ -104,11 +125,7 @@ class fileBone(treeItemBone):
 			return
 
 		logging.info("Refreshing fileBone %s of %s" % (boneName, skel.kindName))
-		super(fileBone, self).refresh(valuesCache, boneName, skel)
-
-		if isinstance(valuesCache[boneName], dict):
-			updateInplace(valuesCache[boneName])
+		super(fileBone, self).refresh(valuesCache, boneName, skel, prefetched)
 
-		elif isinstance(valuesCache[boneName], list):
-			for k in valuesCache[boneName]:
-				updateInplace(k)
+		for relDict in self._iterRelDicts(valuesCache, boneName):
+			updateInplace(relDict)
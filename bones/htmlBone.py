@@ -1,11 +1,10 @@
 # -*- coding: utf-8 -*-
-import HTMLParser
-import htmlentitydefs
-
 from google.appengine.api import search
 
 from server import db
+from server.fulltext import tokenize
 from server.bones import baseBone
+from server.bones.htmlSanitizer import sanitizeHtml
 from server.bones.stringBone import LanguageWrapper
 from server.config import conf
 
@@ -34,83 +33,16 @@ _defaultTags = {
 del _attrsDescr, _attrsSpacing, _attrsMargins
 
 
-class HtmlSerializer(HTMLParser.HTMLParser):  # html.parser.HTMLParser
+class HtmlSerializer(object):
+	"""
+		Sanitizes HTML like htmlBone does; see :func:`server.bones.htmlSanitizer.sanitizeHtml`.
+	"""
+
 	def __init__(self, validHtml=None):
-		global _defaultTags
-		HTMLParser.HTMLParser.__init__(self)
-		self.result = ""
-		self.openTagsList = []
 		self.validHtml = validHtml
 
-	def handle_data(self, data):
-		data = unicode(data) \
-			.replace("<", "&lt;") \
-			.replace(">", "&gt;") \
-			.replace("\"", "&quot;") \
-			.replace("'", "&#39;") \
-			.replace("\n", "") \
-			.replace("\0", "")
-		if data:
-			self.result += data
-
-	def handle_charref(self, name):
-		self.result += "&#%s;" % (name)
-
-	def handle_entityref(self, name):  # FIXME
-		if name in htmlentitydefs.entitydefs.keys():
-			self.result += "&%s;" % (name)
-
-	def handle_starttag(self, tag, attrs):
-		""" Delete all tags except for legal ones """
-		if self.validHtml and tag in self.validHtml["validTags"]:
-			self.result = self.result + '<' + tag
-			isBlankTarget = False
-			for k, v in attrs:
-				if not tag in self.validHtml["validAttrs"] or not k in self.validHtml["validAttrs"][tag]:
-					continue
-				if k.lower()[0:2] != 'on' and v.lower()[0:10] != 'javascript':
-					self.result = '%s %s="%s"' % (self.result, k, v)
-				if tag == "a" and k == "target" and v.lower() == "_blank":
-					isBlankTarget = True
-			if "style" in [k for (k, v) in attrs]:
-				syleRes = {}
-				styles = [v for (k, v) in attrs if k == "style"][0].split(";")
-				for s in styles:
-					style = s[: s.find(":")].strip()
-					value = s[s.find(":") + 1:].strip()
-					if style in self.validHtml["validStyles"] and not any([(x in value) for x in ["\"", ":", ";"]]):
-						syleRes[style] = value
-				if len(syleRes.keys()):
-					self.result += " style=\"%s\"" % "; ".join([("%s: %s" % (k, v)) for (k, v) in syleRes.items()])
-			if isBlankTarget:
-				self.result += " rel=\"noopener noreferrer\""
-			if tag in self.validHtml["singleTags"]:
-				self.result = self.result + ' />'
-			else:
-				self.result = self.result + '>'
-				self.openTagsList.insert(0, tag)
-
-	def handle_endtag(self, tag):
-		if self.validHtml and tag in self.openTagsList:
-			for endTag in self.openTagsList[:]:  # Close all currently open Tags until we reach the current one
-				self.result = "%s</%s>" % (self.result, endTag)
-				self.openTagsList.remove(endTag)
-				if endTag == tag:
-					break
-
-	def cleanup(self):  # FIXME: vertauschte tags
-		""" Append missing closing tags """
-		for tag in self.openTagsList:
-			endTag = '</%s>' % tag
-			self.result += endTag
-
 	def santinize(self, instr):
-		self.result = ""
-		self.openTagsList = []
-		self.feed(instr)
-		self.close()
-		self.cleanup()
-		return (self.result)
+		return (sanitizeHtml(instr, self.validHtml, separator="", newline="").html)
 
 
 class htmlBone(baseBone):
@@ -156,7 +88,7 @@ class htmlBone(baseBone):
 			for lang in self.languages:
 				if isinstance(valuesCache[name], dict) and lang in valuesCache[name]:
 					val = valuesCache[name][lang]
-					if not val or (not HtmlSerializer().santinize(val).strip() and not "<img " in val):
+					if not val or (not self._sanitize(val).text.strip() and not "<img " in val):
 						# This text is empty (ie. it might contain only an empty <p> tag
 						continue
 					entity.set("%s.%s" % (name, lang), val, self.indexed)
@@ -215,7 +147,7 @@ class htmlBone(baseBone):
 					val = data["%s.%s" % (name, lang)]
 					err = self.isInvalid(val)  # Returns None on success, error-str otherwise
 					if not err:
-						valuesCache[name][lang] = HtmlSerializer(self.validHtml).santinize(val)
+						valuesCache[name][lang] = self._sanitize(val).html
 					else:
 						lastError = err
 			if not any(valuesCache[name].values()) and not lastError:
@@ -233,7 +165,7 @@ class htmlBone(baseBone):
 				value = unicode(value)
 			err = self.isInvalid(value)
 			if not err:
-				valuesCache[name] = HtmlSerializer(self.validHtml).santinize(value)
+				valuesCache[name] = self._sanitize(value).html
 			return err
 
 	def isInvalid(self, value):
@@ -246,38 +178,25 @@ class htmlBone(baseBone):
 		if len(value) > self.maxLength:
 			return "Maximum length exceeded"
 
+	def _sanitize(self, value):
+		return (sanitizeHtml(value, self.validHtml, separator="", newline=""))
+
 	def getReferencedBlobs(self, valuesCache, name):
 		"""
 			Test for /file/download/ links inside our text body.
-			Doesn't check for actual <a href=> or <img src=> yet.
+			These are found while sanitizing the text, which is memoised.
 		"""
 		newFileKeys = []
 		if self.languages:
-			if valuesCache[name]:
-				for lng in self.languages:
-					if lng in valuesCache[name]:
-						val = valuesCache[name][lng]
-						if not val:
-							continue
-						idx = val.find("/file/download/")
-						while idx != -1:
-							idx += 15
-							seperatorIdx = min([x for x in [val.find("/", idx), val.find("\"", idx)] if x != -1])
-							fk = val[idx:seperatorIdx]
-							if not fk in newFileKeys:
-								newFileKeys.append(fk)
-							idx = val.find("/file/download/", seperatorIdx)
+			values = [valuesCache[name][lng] for lng in self.languages if valuesCache[name] and lng in valuesCache[name]]
 		else:
-			values = valuesCache.get(name)
-			if values:
-				idx = values.find("/file/download/")
-				while idx != -1:
-					idx += 15
-					seperatorIdx = min([x for x in [values.find("/", idx), values.find("\"", idx)] if x != -1])
-					fk = values[idx:seperatorIdx]
-					if fk not in newFileKeys:
-						newFileKeys.append(fk)
-					idx = values.find("/file/download/", seperatorIdx)
+			values = [valuesCache.get(name)]
+		for val in values:
+			if not val:
+				continue
+			for fk in self._sanitize(val).blobs:
+				if fk not in newFileKeys:
+					newFileKeys.append(fk)
 		return newFileKeys
 
 	def getSearchTags(self, valuesCache, name):
@@ -286,19 +205,9 @@ class htmlBone(baseBone):
 			return (res)
 		if self.languages:
 			for v in valuesCache[name].values():
-				value = HtmlSerializer(None).santinize(v.lower())
-				for line in unicode(value).splitlines():
-					for key in line.split(" "):
-						key = "".join([c for c in key if c.lower() in conf["viur.searchValidChars"]])
-						if key and key not in res and len(key) > 3:
-							res.append(key.lower())
+				res.extend(tokenize(self._sanitize(v).text, minLength=4))
 		else:
-			value = HtmlSerializer(None).santinize(valuesCache[name].lower())
-			for line in unicode(value).splitlines():
-				for key in line.split(" "):
-					key = "".join([c for c in key if c.lower() in conf["viur.searchValidChars"]])
-					if key and key not in res and len(key) > 3:
-						res.append(key.lower())
+			res.extend(tokenize(self._sanitize(valuesCache[name]).text, minLength=4))
 		return (res)
 
 	def getSearchDocumentFields(self, valuesCache, name, prefix=""):
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+from server.config import conf
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+import HTMLParser
+import htmlentitydefs
+
+"""
+	The HTML sanitizer shared by textBone, htmlBone and modules.htmlserializer.
+
+	The validHtml rules of a bone are compiled once into lookup tables. One pass over the input
+	yields the sanitized HTML, its plain text (as used for search tags) and the keys of all blobs
+	referenced by /file/download/ links. Results are memoised by the hash of their input, so
+	the repeated calls while saving a skeleton (fromClient, serialize, getReferencedBlobs and
+	getSearchTags) parse each value only once.
+"""
+
+_blobMarker = "/file/download/"
+_rulesCache = {}  # Mapping of the contents of a validHtml dict -> SanitizerRules
+_resultCache = OrderedDict()  # Mapping (hash, rules, separator, newline) -> SanitizedHtml, least recently used first
+_resultCacheSize = [0]  # Characters currently held by _resultCache
+_resultCacheLock = Lock()  # Guards _resultCache and _resultCacheSize, which are shared by all threads
+
+
+class SanitizerRules(object):
+	"""
+		The lookup tables compiled from a validHtml dict.
+	"""
+
+	def __init__(self, validHtml):
+		self.tags = dict((tag, frozenset(validHtml["validAttrs"].get(tag, ()))) for tag in validHtml["validTags"])
+		self.styles = frozenset(validHtml["validStyles"])
+		self.singleTags = frozenset(validHtml["singleTags"])
+
+	@staticmethod
+	def forValidHtml(validHtml):
+		"""
+			Returns the (cached) rules for *validHtml*, or None if no HTML is allowed at all.
+
+			:type validHtml: dict | None
+			:rtype: SanitizerRules | None
+		"""
+		if not validHtml:
+			return None
+		# Bones of cloned skeletons hold copies of their validHtml, so these are cached by their content
+		signature = (tuple(validHtml["validTags"]),
+		             tuple(sorted((tag, tuple(attrs)) for tag, attrs in validHtml["validAttrs"].items())),
+		             tuple(validHtml["validStyles"]),
+		             tuple(validHtml["singleTags"]))
+		res = _rulesCache.get(signature)
+		if res is None:
+			res = _rulesCache[signature] = SanitizerRules(validHtml)
+		return res
+
+
+class SanitizedHtml(object):
+	"""
+		The result of :func:`sanitizeHtml`.
+
+		:ivar html: The sanitized HTML
+		:ivar text: The plain text, with tags replaced by spaces and entities resolved
+		:ivar blobs: The keys of all blobs referenced by /file/download/ links, in order of appearance
+	"""
+	__slots__ = ["html", "text", "blobs"]
+
+	def __init__(self, html, text, blobs):
+		self.html = html
+		self.text = text
+		self.blobs = blobs
+
+
+def _findBlobs(value, blobs):
+	idx = value.find(_blobMarker)
+	while idx != -1:
+		idx += len(_blobMarker)
+		ends = [x for x in (value.find("/", idx), value.find("\"", idx)) if x != -1]
+		end = min(ends) if ends else len(value)
+		key = value[idx:end]
+		if key and key not in blobs:
+			blobs.append(key)
+		idx = value.find(_blobMarker, end)
+
+
+def _escape(value):
+	return unicode(value) \
+		.replace("<", "&lt;") \
+		.replace(">", "&gt;") \
+		.replace("\"", "&quot;") \
+		.replace("'", "&#39;") \
+		.replace("\0", "")
+
+
+class _SanitizingParser(HTMLParser.HTMLParser):
+	def __init__(self, rules, separator, newline):
+		HTMLParser.HTMLParser.__init__(self)
+		self.rules = rules
+		self.separator = separator
+		self.newline = newline
+		self.result = []
+		self.text = []
+		self.blobs = []
+		self.openTagsList = []
+
+	def handle_data(self, data):
+		if _blobMarker in data:
+			_findBlobs(data, self.blobs)
+		if data:
+			self.result.append(_escape(data).replace("\n", self.newline))
+			self.text.append(data.replace("\n", " "))
+
+	def handle_charref(self, name):
+		self.result.append("&#%s;" % name)
+		try:
+			self.text.append(unichr(int(name[1:], 16) if name[:1] in "xX" else int(name)))
+		except (ValueError, OverflowError):
+			pass
+
+	def handle_entityref(self, name):
+		if name in htmlentitydefs.name2codepoint:
+			self.result.append("&%s;" % name)
+			self.text.append(unichr(htmlentitydefs.name2codepoint[name]))
+
+	def handle_starttag(self, tag, attrs):
+		for k, v in attrs:
+			if v and _blobMarker in v:
+				_findBlobs(v, self.blobs)
+		self.text.append(" ")
+		validAttrs = self.rules.tags.get(tag) if self.rules else None
+		if validAttrs is None:
+			self.result.append(self.separator)
+			return
+		self.result.append("<%s" % tag)
+		isBlankTarget = False
+		style = None
+		for k, v in attrs:
+			v = v or ""
+			if k == "style" and style is None:
+				style = v
+			if k not in validAttrs:
+				continue
+			if k.lower()[0:2] != "on" and v.lower()[0:10] != "javascript":
+				self.result.append(" %s=\"%s\"" % (k, v.replace("\"", "&quot;")))
+			if tag == "a" and k == "target" and v.lower() == "_blank":
+				isBlankTarget = True
+		if style is not None:
+			styleRes = []
+			for s in style.split(";"):
+				name = s[:s.find(":")].strip()
+				value = s[s.find(":") + 1:].strip()
+				if name in self.rules.styles and not any([(x in value) for x in ["\"", ":", ";"]]):
+					styleRes.append("%s: %s" % (name, value))
+			if styleRes:
+				self.result.append(" style=\"%s\"" % "; ".join(styleRes))
+		if isBlankTarget:
+			self.result.append(" rel=\"noopener noreferrer\"")
+		if tag in self.rules.singleTags:
+			self.result.append(" />")
+		else:
+			self.result.append(">")
+			self.openTagsList.insert(0, tag)
+
+	def handle_endtag(self, tag):
+		self.text.append(" ")
+		if self.rules and tag in self.openTagsList:
+			for endTag in self.openTagsList[:]:  # Close all currently open Tags until we reach the current one
+				self.result.append("</%s>" % endTag)
+				self.openTagsList.remove(endTag)
+				if endTag == tag:
+					break
+		else:
+			self.result.append(self.separator)
+
+	def getResult(self):
+		for tag in self.openTagsList:  # Append missing closing tags
+			self.result.append("</%s>" % tag)
+		return SanitizedHtml(u"".join(self.result), u"".join(self.text), self.blobs)
+
+
+def sanitizeHtml(value, validHtml, separator=" ", newline=" "):
+	"""
+		Sanitizes *value* according to *validHtml*, memoising the result.
+
+		:param value: The HTML to sanitize
+		:type value: str | unicode
+		:param validHtml: The rules (like textBone's validHtml), None to remove all tags
+		:type validHtml: dict | None
+		:param separator: Inserted in place of each removed tag
+		:type separator: str
+		:param newline: Inserted in place of each linebreak in the text
+		:type newline: str
+		:rtype: SanitizedHtml
+	"""
+	rules = SanitizerRules.forValidHtml(validHtml)
+	if isinstance(value, unicode):
+		digest = sha1(value.encode("UTF-8")).digest()
+	else:
+		digest = sha1(value).digest()
+	cacheKey = (digest, id(rules), separator, newline)
+	with _resultCacheLock:
+		res = _resultCache.pop(cacheKey, None)
+		if res is not None:
+			_resultCache[cacheKey] = res  # Mark as most recently used
+			return res
+	parser = _SanitizingParser(rules, separator, newline)  # Parsed outside the lock
+	parser.feed(value)
+	parser.close()
+	res = parser.getResult()
+	size = len(res.html) + len(res.text)
+	if size > conf["viur.bones.htmlCacheSize"]:  # Too large to be cached at all
+		return res
+	with _resultCacheLock:
+		old = _resultCache.pop(cacheKey, None)  # Sanitized by another thread meanwhile
+		if old is not None:
+			_resultCacheSize[0] -= len(old.html) + len(old.text)
+		_resultCacheSize[0] += size
+		while _resultCacheSize[0] > conf["viur.bones.htmlCacheSize"] and _resultCache:
+			_, old = _resultCache.popitem(last=False)
+			_resultCacheSize[0] -= len(old.html) + len(old.text)
+		_resultCache[cacheKey] = res
+	return res
@@ -9,7 +9,7 @@ class keyBone(baseBone):
 		super(keyBone, self).__init__(descr=descr, readOnly=readOnly, visible=visible, **kwargs)
 
 
-	def refresh(self, valuesCache, boneName, skel):
+	def refresh(self, valuesCache, boneName, skel, prefetched=None):
 		"""
 			Refresh all values we might have cached from other entities.
 		"""
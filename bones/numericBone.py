@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from server.bones import baseBone
 from math import pow
+from bisect import bisect_right
 from google.appengine.api import search
 
 import logging, sys
@@ -18,7 +19,7 @@ class numericBone( baseBone ):
 
 	type = "numeric"
 
-	def __init__(self, precision=0, min=-int( pow(2, 30) ), max=int( pow(2, 30) ), *args,  **kwargs ):
+	def __init__(self, precision=0, min=-int( pow(2, 30) ), max=int( pow(2, 30) ), facetBuckets=None, *args,  **kwargs ):
 		"""
 			Initializes a new NumericBone.
 
@@ -28,6 +29,9 @@ class numericBone( baseBone ):
 			:type min: float
 			:param max: Maximum accepted value (including).
 			:type max: float
+			:param facetBuckets: If set, counts of entities are maintained per range between these\
+			boundaries (see :mod:`server.facets`). [10, 50] yields the facet-values "-10", "10-50" and "50-".
+			:type facetBuckets: list of float
 		"""
 		baseBone.__init__( self,  *args,  **kwargs )
 		self.precision = precision
@@ -35,6 +39,20 @@ class numericBone( baseBone ):
 			self.precision = 8
 		self.min = min
 		self.max = max
+		self.facetBuckets = sorted( facetBuckets ) if facetBuckets else None
+		self.facet = bool( facetBuckets )
+
+	def getFacetValues( self, valuesCache, name ):
+		value = valuesCache.get( name )
+		if not self.facetBuckets or not isinstance( value, (int, long, float) ):
+			return( [] )
+		return( [ self.getFacetCandidates()[ bisect_right( self.facetBuckets, value ) ] ] )
+
+	def getFacetCandidates( self ):
+		if not self.facetBuckets:
+			return( [] )
+		bounds = [ u"" ] + [ unicode( x ) for x in self.facetBuckets ] + [ u"" ]
+		return( [ u"%s-%s" % ( bounds[ i ], bounds[ i+1 ] ) for i in range( 0, len( bounds )-1 ) ] )
 
 	def fromClient( self, valuesCache, name, data ):
 		"""
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from server import utils
 from server.bones import stringBone
-from hashlib import sha256
+from hashlib import sha256, sha512
 import hmac
 from struct import Struct
 from operator import xor
@@ -9,21 +9,28 @@ from itertools import izip, starmap
 from server.config import conf
 import string, random
 
+try:
+	from hashlib import pbkdf2_hmac
+except ImportError:  # Python < 2.7.8
+	pbkdf2_hmac = None
+
 def pbkdf2( password, salt, iterations=1001, keylen=42):
 	"""
-		An implementation of PBKDF2 (http://wikipedia.org/wiki/PBKDF2)
-		
-		Mostly based on the implementation of 
+		An implementation of PBKDF2 (http://wikipedia.org/wiki/PBKDF2) using HMAC-SHA256.
+
+		Uses hashlib.pbkdf2_hmac if available; the fallback is mostly based on the implementation of
 		https://github.com/mitsuhiko/python-pbkdf2/blob/master/pbkdf2.py
 		
 		:copyright: (c) Copyright 2011 by Armin Ronacher.
 		:license: BSD, see LICENSE for more details.
 	"""
-	_pack_int = Struct('>I').pack
 	if isinstance( password, unicode ):
 		password = password.encode("UTF-8")
 	if isinstance( salt, unicode ):
 		salt = salt.encode("UTF-8")
+	if pbkdf2_hmac is not None:
+		return pbkdf2_hmac( "sha256", password, salt, iterations, keylen ).encode("hex")
+	_pack_int = Struct('>I').pack
 	mac = hmac.new(password, None, sha256)
 	def _pseudorandom(x, mac=mac):
 		h = mac.copy()
@@ -38,6 +45,56 @@ def pbkdf2( password, salt, iterations=1001, keylen=42):
 		buf.extend(rv)
 	return (''.join(map(chr, buf))[:keylen]).encode("hex")
 
+def getPasswordHashParams( entity, name="password" ):
+	"""
+		Returns how the password stored in *entity* has been hashed.
+
+		:returns: Tuple of algorithm ("pbkdf2_sha256", "pbkdf2" for hashes written before the algorithm\
+		has been stored, or "sha512" for hashes without salt), salt and iterations
+		:rtype: tuple
+	"""
+	if not entity.get( "%s_salt" % name ):
+		return( "sha512", None, None )
+	if not entity.get( "%s_algorithm" % name ):
+		return( "pbkdf2", entity[ "%s_salt" % name ], 1001 )
+	return( entity[ "%s_algorithm" % name ], entity[ "%s_salt" % name ], entity[ "%s_iterations" % name ] )
+
+def hashPassword( password, algorithm, salt, iterations ):
+	"""
+		Hashes *password* the way described by :func:`getPasswordHashParams`.
+
+		:rtype: str
+	"""
+	password = password[ : conf["viur.maxPasswordLength"] ]
+	if algorithm == "pbkdf2_sha256":
+		return( pbkdf2( password, salt, iterations, keylen=32 ) )
+	elif algorithm == "pbkdf2":
+		return( pbkdf2( password, salt, iterations ) )
+	elif algorithm == "sha512":
+		return( sha512( password.encode("UTF-8")+conf["viur.salt"] ).hexdigest() )
+	raise ValueError( "Unknown password hash algorithm %s" % algorithm )
+
+def needsRehash( algorithm, iterations ):
+	"""
+		Returns True if a password hashed this way should be hashed again using the current settings.
+
+		:rtype: bool
+	"""
+	return( algorithm != "pbkdf2_sha256" or iterations < conf["viur.password.iterations"] )
+
+def setPasswordHash( entity, name, password, saltLength=13, indexed=True ):
+	"""
+		Hashes *password* using a new salt and conf["viur.password.iterations"] and stores it in *entity*.
+
+		:type entity: server.db.Entity
+	"""
+	salt = utils.generateRandomString( saltLength )
+	iterations = conf["viur.password.iterations"]
+	entity.set( name, hashPassword( password, "pbkdf2_sha256", salt, iterations ), indexed )
+	entity.set( "%s_salt" % name, salt, indexed )
+	entity.set( "%s_algorithm" % name, "pbkdf2_sha256", indexed )
+	entity.set( "%s_iterations" % name, iterations, indexed )
+
 
 class passwordBone( stringBone ):
 	"""
@@ -89,10 +146,7 @@ class passwordBone( stringBone ):
 
 	def serialize( self, valuesCache, name, entity ):
 		if valuesCache.get(name,None) and valuesCache[name] != "":
-			salt = utils.generateRandomString(self.saltLength)
-			passwd = pbkdf2( valuesCache[name][ : conf["viur.maxPasswordLength"] ], salt )
-			entity.set( name, passwd, self.indexed )
-			entity.set( "%s_salt" % name, salt, self.indexed )
+			setPasswordHash( entity, name, valuesCache[name], self.saltLength, self.indexed )
 
 		return entity
 
@@ -1,25 +1,32 @@
 # -*- coding: utf-8 -*-
 from server.bones import baseBone
-from math import pow, floor, ceil
 from server import db
 import logging
-from math import sqrt
-from random import random, sample, shuffle
-from itertools import chain
+from random import random, shuffle
+
+__levelCache__ = {} # (kindName, boneName, filters) -> bucket-level which returned enough entries last time
 
 class randomSliceBone( baseBone ):
 	"""
 		Simulates the orderby=random from SQL.
 		If you sort by this bone, the query will return a random set of elements from that query.
+
+		Each entry gets a random offset in [0..1). Additionally, the bucket this offset falls into is stored for
+		several levels (the range is split into 2^level buckets on each level). A random page is read from the
+		bucket containing a random point, starting at that point and wrapping around at the end of the bucket.
+		If that bucket holds not enough entries, the next larger one is used. The level which has been sufficient
+		is remembered per kind and set of filters, so usually one or two queries are needed.
 	"""
 
 	type = "randomslice"
 
+	bucketLevels = (12, 9, 6, 3, 0) # Levels of buckets stored, the most precise first
+
 	def __init__(self, indexed=True, visible=False, readOnly=True, slices=2, sliceSize=0.5, *args,  **kwargs ):
 		"""
 			Initializes a new randomSliceBone.
 
-
+			*slices* and *sliceSize* are not used anymore and kept for compatibility only.
 		"""
 		if not indexed or visible or not readOnly:
 			raise NotImplemented("A RandomSliceBone must be indexed, not visible and readonly!")
@@ -27,19 +34,27 @@ class randomSliceBone( baseBone ):
 		self.slices = slices
 		self.sliceSize = sliceSize
 
+	def getBucket(self, level, value):
+		"""
+			Returns the identifier of the bucket *value* falls into on the given level.
+		"""
+		return "%d:%d" % (level, int(value*(1 << level)))
+
 	def serialize(self, valuesCache, name, entity):
 		"""
 			Serializes this bone into something we
 			can write into the datastore.
 
 			This time, we just ignore whatever is set on this bone and write a randomly chosen
-			float [0..1) as value for this bone.
+			float [0..1) as value for this bone, together with the buckets it falls into.
 
 			:param name: The property-name this bone has in its Skeleton (not the description!)
 			:type name: String
 			:returns: dict
 		"""
-		entity.set(name, random(), True)
+		value = random()
+		entity.set(name, value, True)
+		entity.set(name+".bucket", [self.getBucket(level, value) for level in self.bucketLevels], True)
 		return entity
 
 	def buildDBSort( self, name, skel, dbFilter, rawFilter ):
@@ -63,55 +78,53 @@ class randomSliceBone( baseBone ):
 			:type rawFilter: dict
 			:returns: The modified :class:`server.db.Query`
 		"""
-		def applyFilterHook(dbfilter, property, value):
-			"""
-				Applies dbfilter._filterHook to the given filter if set,
-				else return the unmodified filter.
-				Allows orderby=random also be used in relational-queries.
-
-			:param dbfilter:
-			:param property:
-			:param value:
-			:return:
-			"""
-			if dbFilter._filterHook is None:
-				return property, value
-			try:
-				property, value = dbFilter._filterHook(dbFilter, property, value)
-			except:
-				# Either, the filterHook tried to do something special to dbFilter (which won't
-				# work as we are currently rewriting the core part of it) or it thinks that the query
-				# is unsatisfiable (fe. because of a missing ref/parent key in relationalBone).
-				# In each case we kill the query here - making it to return no results
-				raise RuntimeError()
-			return property, value
-
 		if "orderby" in rawFilter and rawFilter["orderby"] == name:
 			# We select a random set of elements from that collection
 			assert not isinstance(dbFilter.datastoreQuery, db.MultiQuery), "Orderby random is not possible on a query that already uses an IN-filter!"
 			origFilter = dbFilter.datastoreQuery
 			origKind = dbFilter.getKind()
-			queries = []
-			for unused in range(0,self.slices): #Fetch 3 Slices from the set
-				rndVal = random() # Choose our Slice center
-				# Right Side
-				q = db.DatastoreQuery( kind=origKind )
-				property, value = applyFilterHook(dbFilter, "%s <=" % name, rndVal)
-				q[property] = value
-				q.Order( (name, db.DESCENDING) )
-				queries.append( q )
-				# Left Side
-				q = db.DatastoreQuery( kind=origKind )
-				property, value = applyFilterHook(dbFilter, "%s >" % name, rndVal)
-				q[property] = value
-				queries.append( q )
+			cacheKey = (origKind, name, tuple(sorted(origFilter.keys())))
+			level = __levelCache__.get(cacheKey, self.bucketLevels[0])
+			point = random() # Choose where our slice starts
+			queries = [self._buildSliceQuery(name, dbFilter, origKind, origFilter.items(), level, point, False)]
 			dbFilter.datastoreQuery = db.MultiQuery(queries, None)
-			# Map the original filter back in
-			for k, v in origFilter.items():
-				dbFilter.datastoreQuery[ k ] = v
-			dbFilter._customMultiQueryMerge = self.customMultiQueryMerge
+			dbFilter.setKind(origKind)
+			dbFilter._customMultiQueryMerge = lambda *args, **kwargs: self.customMultiQueryMerge(name, cacheKey, level, point, origKind, *args, **kwargs)
 			dbFilter._calculateInternalMultiQueryAmount = self.calculateInternalMultiQueryAmount
 
+	def _applyFilterHook(self, dbFilter, property, value):
+		"""
+			Applies dbfilter._filterHook to the given filter if set,
+			else return the unmodified filter.
+			Allows orderby=random also be used in relational-queries.
+		"""
+		if dbFilter._filterHook is None:
+			return property, value
+		try:
+			return dbFilter._filterHook(dbFilter, property, value)
+		except:
+			# Either, the filterHook tried to do something special to dbFilter (which won't
+			# work as we are currently rewriting the core part of it) or it thinks that the query
+			# is unsatisfiable (fe. because of a missing ref/parent key in relationalBone).
+			# In each case we kill the query here - making it to return no results
+			raise RuntimeError()
+
+	def _buildSliceQuery(self, name, dbFilter, kind, baseFilters, level, point, wrapAround):
+		"""
+			Builds the query reading the bucket of *level* containing *point*, starting at *point* or, if
+			*wrapAround* is set, from the start of that bucket up to *point*.
+		"""
+		q = db.DatastoreQuery( kind=kind )
+		bucketProperty, bucket = self._applyFilterHook(dbFilter, "%s.bucket =" % name, self.getBucket(level, point))
+		offsetProperty, offset = self._applyFilterHook(dbFilter, "%s %s" % (name, "<" if wrapAround else ">="), point)
+		for k, v in baseFilters:
+			if k.split(" ")[0] not in [bucketProperty.split(" ")[0], offsetProperty.split(" ")[0]]:
+				q[k] = v
+		q[bucketProperty] = bucket
+		q[offsetProperty] = offset
+		q.Order( offsetProperty.split(" ")[0] )
+		return q
+
 	def calculateInternalMultiQueryAmount(self, targetAmount):
 		"""
 			Tells :class:`server.db.Query` How much entries should be fetched in each subquery.
@@ -121,12 +134,12 @@ class randomSliceBone( baseBone ):
 			:returns: The amount of elements db.Query should fetch on each subquery
 			:rtype: int
 		"""
-		return int(targetAmount*self.sliceSize)
+		return targetAmount
 
 
-	def customMultiQueryMerge(self, dbFilter, result, targetAmount):
+	def customMultiQueryMerge(self, name, cacheKey, level, point, kind, dbFilter, result, targetAmount):
 		"""
-			Randomly returns 'targetAmount' elements from 'result'
+			Randomly returns 'targetAmount' elements, reading larger buckets if necessary.
 
 			:param dbFilter: The db.Query calling this function
 			:type: dbFilter: server.db.Query
@@ -137,14 +150,17 @@ class randomSliceBone( baseBone ):
 			:return: List of elements which should be returned from db.Query
 			:rtype: list of :class:`server.db.Entity`
 		"""
-		# res is a list of iterators at this point, chain them together
-		res = chain(*[list(x) for x in result])
-		# Remove duplicates
-		tmpDict = {}
-		for item in res:
-			tmpDict[ str(item.key()) ] = item
-		res = list(tmpDict.values())
-		# Slice the requested amount of results our 3times lager set
-		res = sample(res, min(len(res), targetAmount))
+		baseFilters = getattr(dbFilter.datastoreQuery, "_MultiQuery__bound_queries")[0].items()
+		res = list(result[0])
+		levels = [x for x in self.bucketLevels if x <= level]
+		for idx, level in enumerate(levels):
+			if idx > 0: # The previous bucket was too small, read the next larger one
+				res = list(self._buildSliceQuery(name, dbFilter, kind, baseFilters, level, point, False).Run(limit=targetAmount))
+			if len(res) < targetAmount: # Continue at the start of that bucket
+				q = self._buildSliceQuery(name, dbFilter, kind, baseFilters, level, point, True)
+				res.extend(q.Run(limit=targetAmount-len(res)))
+			if len(res) >= targetAmount:
+				break
+		__levelCache__[cacheKey] = level
 		shuffle(res)
 		return res
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from server.bones.bone import baseBone, getSystemInitialized
 from server.errors import ReadFromClientError
-import extjson
+from server.bones.valueCodec import encodeValues, decodeValues
 
 
 class recordBone(baseBone):
@@ -32,15 +32,15 @@ class recordBone(baseBone):
 		self.format = " ".join(["$(%s)" % k for k in self._usingSkelCache.keys()])
 		return True
 
-	def _restoreValueFromDatastore(self, val):
+	def _restoreValueFromDatastore(self, record):
 		"""
-			Restores one of our values from the serialized data read from the datastore
+			Restores one of our values from a record read from the datastore
 
-			:param value: Json-Encoded datastore property
+			:param record: The record as decoded by :func:`server.bones.valueCodec.decodeValues`
 
 			:return: Our Value (with restored usingSkel data)
 		"""
-		value = extjson.loads(val)
+		value = record[0]
 		assert isinstance(value, dict), "Read something from the datastore thats not a dict: %s" % str(type(value))
 
 		usingSkel = self._usingSkelCache
@@ -54,48 +54,15 @@ class recordBone(baseBone):
 			valuesCache[name] = None
 			return True
 
-		val = expando[name]
+		records = decodeValues(expando[name])
 
 		if self.multiple:
-			valuesCache[name] = []
-
-			if not val:
-				return True
-
-			if isinstance(val, list):
-				for res in val:
-					try:
-						valuesCache[name].append(self._restoreValueFromDatastore(res))
-					except:
-						raise
-						pass
-
-			else:
-				try:
-					valuesCache[name].append(self._restoreValueFromDatastore(val))
-				except:
-					raise
-					pass
+			valuesCache[name] = [self._restoreValueFromDatastore(record) for record in records]
+		elif records:
+			valuesCache[name] = self._restoreValueFromDatastore(records[0])
 		else:
 			valuesCache[name] = None
 
-			if isinstance(val, list) and len(val) > 0:
-				try:
-					valuesCache[name] = self._restoreValueFromDatastore(val[0])
-				except:
-					raise
-					pass
-
-			else:
-				if val:
-					try:
-						valuesCache[name] = self._restoreValueFromDatastore(val)
-					except:
-						raise
-						pass
-				else:
-					valuesCache[name] = None
-
 		return True
 
 	def serialize(self, valuesCache, name, entity):
@@ -111,19 +78,19 @@ class recordBone(baseBone):
 			usingSkel = self._usingSkelCache
 
 			if self.multiple:
-				res = []
+				records = []
 
 				for val in valuesCache[name]:
 					usingSkel.setValuesCache(val)
-					res.append(extjson.dumps(usingSkel.serialize()))
+					records.append([usingSkel.serialize()])
 
-				entity.set(name, res, False)
+				entity.set(name, encodeValues(records), False)
 
 			else:
 				usingSkel.setValuesCache(valuesCache[name])
 				usingData = usingSkel.serialize()
 
-				entity.set(name, extjson.dumps(usingData), False)
+				entity.set(name, encodeValues([[usingData]])[0], False)
 
 				# Copy attrs of our referenced entity in
 				if self.indexed:
@@ -234,9 +201,7 @@ class recordBone(baseBone):
 		def getValues(res, skel, valuesCache):
 			for k, bone in skel.items():
 				if bone.searchable:
-					for tag in bone.getSearchTags(valuesCache, k):
-						if tag not in res:
-							res.append(tag)
+					res.extend(bone.getSearchTags(valuesCache, k))
 			return res
 
 		value = values.get(key)
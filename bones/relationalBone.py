@@ -5,11 +5,14 @@ from server import db
 from server.errors import ReadFromClientError
 from server.utils import normalizeKey
 from google.appengine.api import search
-import extjson
+from server.bones.valueCodec import encodeValues, decodeValues
 from time import time
 from datetime import datetime
+from collections import OrderedDict
 import logging
 
+__compactChunkSize__ = 500 #Maximum amount of referenced keys stored in one compact relation entity
+__relationBatchSize__ = 500 #Maximum amount of relation entities written or deleted by one datastore call
 
 class relationalBone( baseBone ):
 	"""
@@ -45,7 +48,7 @@ class relationalBone( baseBone ):
 	kind = None
 
 	def __init__(self, kind=None, module=None, refKeys=None, parentKeys=None, multiple=False,
-	             format="$(dest.name)", using=None, *args, **kwargs):
+	             format="$(dest.name)", using=None, compactRelations=False, *args, **kwargs):
 		"""
 			Initialize a new relationalBone.
 
@@ -67,10 +70,18 @@ class relationalBone( baseBone ):
 			:param format: Hint for the admin how to display such an relation. See admin/utils.py:formatString for
 				more information
 			:type format: String
+			:param compactRelations: Store the keys of the referenced entities in one viur-relations entity per
+				entry (and 500 references) instead of one entity per reference. Only possible for bones which
+				are not indexed.
+			:type compactRelations: bool
 		"""
 		baseBone.__init__( self, *args, **kwargs )
 		self.multiple = multiple
 		self.format = format
+
+		if compactRelations and self.indexed:
+			raise AttributeError("compactRelations is only possible on relationalBones which are not indexed!")
+		self.compactRelations = compactRelations
 		#self._dbValue = None #Store the original result fetched from the db here so we have that information in case a referenced entity has been deleted
 
 		if kind:
@@ -113,36 +124,31 @@ class relationalBone( baseBone ):
 		self._usingSkelCache = self.using() if self.using else None
 
 
-	def _restoreValueFromDatastore(self, val):
+	def _restoreValueFromDatastore(self, record):
 		"""
-			Restores one of our values (including the Rel- and Using-Skel) from the serialized data read from the datastore
-			:param value: Json-Encoded datastore property
+			Restores one of our values (including the Rel- and Using-Skel) from a record read from the datastore
+			:param record: The dest and rel part as decoded by :func:`server.bones.valueCodec.decodeValues`
 			:return: Our Value (with restored RelSkel and using-Skel)
 		"""
-		value = extjson.loads(val)
-		assert isinstance(value, dict), "Read something from the datastore thats not a dict: %s" % str(type(value))
+		dest, rel = record
+		assert isinstance(dest, dict), "Read something from the datastore thats not a dict: %s" % str(type(dest))
 
 		relSkel = self._refSkelCache
 		relSkel.setValuesCache({})
 
 		# !!!ViUR re-design compatibility!!!
-		if not "dest" in value:
-			nvalue = dict()
-			nvalue["dest"] = value
-			value = nvalue
-
-		if "id" in value["dest"] and not("key" in value["dest"] and value["dest"]["key"]):
-			value["dest"]["key"] = value["dest"]["id"]
-			del value["dest"]["id"]
+		if "id" in dest and not("key" in dest and dest["key"]):
+			dest["key"] = dest["id"]
+			del dest["id"]
 		# UNTIL HERE!
 
-		relSkel.unserialize(value["dest"])
+		relSkel.unserialize(dest)
 
 		if self.using is not None:
 			usingSkel = self._usingSkelCache
 			usingSkel.setValuesCache({})
-			if value["rel"] is not None:
-				usingSkel.unserialize(value["rel"])
+			if rel is not None:
+				usingSkel.unserialize(rel)
 			usingData = usingSkel.getValuesCache()
 		else:
 			usingData = None
@@ -151,51 +157,36 @@ class relationalBone( baseBone ):
 
 	def unserialize( self, valuesCache, name, expando ):
 		if name in expando:
-			val = expando[ name ]
+			records = decodeValues(expando[ name ], ("dest", "rel"))
 			if self.multiple:
-				valuesCache[name] = []
-				if not val:
-					return True
-				if isinstance(val, list):
-					for res in val:
-						try:
-							valuesCache[name].append(self._restoreValueFromDatastore(res))
-						except:
-							raise
-							pass
-				else:
-					try:
-						valuesCache[name].append(self._restoreValueFromDatastore(val))
-					except:
-						raise
-						pass
+				valuesCache[name] = [self._restoreValueFromDatastore(record) for record in records]
+			elif records:
+				valuesCache[name] = self._restoreValueFromDatastore(records[0])
 			else:
 				valuesCache[name] = None
-				if isinstance( val, list ) and len( val )>0:
-					try:
-						valuesCache[name] = self._restoreValueFromDatastore(val[0])
-					except:
-						raise
-						pass
-				else:
-					if val:
-						try:
-							valuesCache[name] = self._restoreValueFromDatastore(val)
-						except:
-							raise
-							pass
-					else:
-						valuesCache[name] = None
 		else:
 			valuesCache[name] = None
-		#if isinstance( valuesCache[name], list ):
-		#	self._dbValue = valuesCache[name][ : ]
-		#elif isinstance( valuesCache[name], dict ):
-		#	self._dbValue = dict( valuesCache[name].items() )
-		#else:
-		#	self._dbValue = None
 		return True
 
+	def _serializeRecord(self, val):
+		"""
+			Returns the dest and rel part of one of our values, as passed to
+			:func:`server.bones.valueCodec.encodeValues`.
+		"""
+		refSkel = self._refSkelCache
+		usingSkel = self._usingSkelCache
+		if val["dest"]:
+			refSkel.setValuesCache(val["dest"])
+			refData = refSkel.serialize()
+		else:
+			refData = None
+		if usingSkel and val["rel"]:
+			usingSkel.setValuesCache(val["rel"])
+			usingData = usingSkel.serialize()
+		else:
+			usingData = None
+		return [refData, usingData]
+
 	def serialize(self, valuesCache, name, entity ):
 		if not valuesCache[name]:
 			entity.set( name, None, False )
@@ -205,38 +196,11 @@ class relationalBone( baseBone ):
 						del entity[ k ]
 		else:
 			if self.multiple:
-				res = []
-				refSkel = self._refSkelCache
-				usingSkel = self._usingSkelCache
-				for val in valuesCache[name]:
-					if val["dest"]:
-						refSkel.setValuesCache(val["dest"])
-						refData = refSkel.serialize()
-					else:
-						refData = None
-					if usingSkel and val["rel"]:
-						usingSkel.setValuesCache(val["rel"])
-						usingData = usingSkel.serialize()
-					else:
-						usingData = None
-					r = {"rel": usingData, "dest": refData}
-					res.append(extjson.dumps(r))
-				entity.set( name, res, False )
+				records = [self._serializeRecord(val) for val in valuesCache[name]]
+				entity.set( name, encodeValues(records, ("dest", "rel")), False )
 			else:
-				refSkel = self._refSkelCache
-				usingSkel = self._usingSkelCache
-				if valuesCache[name]["dest"]:
-					refSkel.setValuesCache(valuesCache[name]["dest"])
-					refData = refSkel.serialize()
-				else:
-					refData = None
-				if usingSkel and valuesCache[name]["rel"]:
-					usingSkel.setValuesCache(valuesCache[name]["rel"])
-					usingData = usingSkel.serialize()
-				else:
-					usingData = None
-				r = {"rel": usingData, "dest": refData}
-				entity.set(name, extjson.dumps(r), False)
+				refData, usingData = self._serializeRecord(valuesCache[name])
+				entity.set(name, encodeValues([[refData, usingData]], ("dest", "rel"))[0], False)
 				#Copy attrs of our referenced entity in
 				if self.indexed:
 					if refData:
@@ -245,11 +209,30 @@ class relationalBone( baseBone ):
 					if usingData:
 						for k, v in usingData.items():
 							entity.set("%s.rel.%s" % (name,k), v, True)
-					#for k, v in valuesCache[name].items():
-					#	if (k in self.refKeys or any( [ k.startswith("%s." %x) for x in self.refKeys ] ) ):
-					#		entity[ "%s.%s" % (name,k) ] = v
 		return entity
 
+	def _getRelationProperties(self, data, key, parentValues):
+		"""
+			Returns the properties the viur-relations entity for the relation *data* should hold.
+		"""
+		res = {}
+		if not self.indexed: #Dont store more than key and kinds, as they aren't used anyway
+			res[ "dest.key" ] = data["dest"]["key"]
+			res[ "src.key" ] = key
+			return res
+		refSkel = self._refSkelCache
+		refSkel.setValuesCache(data["dest"])
+		for k, v in refSkel.serialize().items():
+			res[ "dest."+k ] = v
+		for k,v in parentValues.items():
+			res[ "src."+k ] = v
+		if self.using is not None:
+			usingSkel = self._usingSkelCache
+			usingSkel.setValuesCache(data["rel"])
+			for k, v in usingSkel.serialize().items():
+				res[ "rel."+k ] = v
+		return res
+
 	def postSavedHandler( self, valuesCache, boneName, skel, key, dbfields ):
 		if boneName not in valuesCache:
 			return
@@ -267,67 +250,112 @@ class relationalBone( baseBone ):
 			if parentKey in self.parentKeys or any([parentKey.startswith(x+".") for x in self.parentKeys]):
 				parentValues[parentKey] = dbfields[parentKey]
 
-		dbVals = db.Query( "viur-relations" ).ancestor( db.Key( key ) ) #skel.kindName+"_"+self.kind+"_"+key
+		if self.compactRelations:
+			return self._saveCompactRelations( values, boneName, skel, key )
+
+		# The relations we should have, grouped by their destination
+		wantedRelations = OrderedDict()
+		for val in values:
+			wantedRelations.setdefault( val["dest"]["key"], [] ).append( self._getRelationProperties( val, key, parentValues ) )
+
+		dbVals = db.Query( "viur-relations" ).ancestor( db.decodeKey( key ) ) #skel.kindName+"_"+self.kind+"_"+key
 		dbVals.filter("viur_src_kind =", skel.kindName )
 		dbVals.filter("viur_dest_kind =", self.kind)
 		dbVals.filter("viur_src_property =", boneName )
 
+		putList = []
+		deleteList = []
+
 		for dbObj in dbVals.iter():
-			try:
-				if not dbObj[ "dest.key" ] in [ x["dest"]["key"] for x in values ]: #Relation has been removed
-					db.Delete( dbObj.key() )
-					continue
-			except: #This entry is corrupt
-				db.Delete( dbObj.key() )
-			else: # Relation: Updated
-				data = [x for x in values if x["dest"]["key"] == dbObj["dest.key"]][0]
-				if self.indexed: #We dont store more than key and kinds, and these dont change
-					#Write our (updated) values in
-					refSkel = self._refSkelCache
-					refSkel.setValuesCache(data["dest"])
-					for k, v in refSkel.serialize().items():
-						dbObj[ "dest."+k ] = v
-					for k,v in parentValues.items():
-						dbObj[ "src."+k ] = v
-					if self.using is not None:
-						usingSkel = self._usingSkelCache
-						usingSkel.setValuesCache(data["rel"])
-						for k, v in usingSkel.serialize().items():
-							dbObj[ "rel."+k ] = v
-					dbObj[ "viur_delayed_update_tag" ] = time()
-					db.Put( dbObj )
-				values.remove( data )
+			if dbObj.get( "viur_compact" ): #Written in compact mode before
+				deleteList.append( dbObj.key() )
+				continue
+			if not wantedRelations.get( dbObj.get( "dest.key" ) ): #Relation has been removed or this entry is corrupt
+				deleteList.append( dbObj.key() )
+				continue
+			data = wantedRelations[ dbObj["dest.key"] ].pop( 0 )
+			if all( [ k in dbObj and dbObj[k] == v for k, v in data.items() ] ):
+				continue #Relation: Unchanged
+			# Relation: Updated
+			dbObj = db.Entity.FromDatastoreEntity( dbObj )
+			for k, v in data.items():
+				dbObj[ k ] = v
+			dbObj[ "viur_delayed_update_tag" ] = time()
+			putList.append( dbObj )
 
 		# Add any new Relation
-		for val in values:
-			dbObj = db.Entity( "viur-relations" , parent=db.Key( key ) ) #skel.kindName+"_"+self.kind+"_"+key
+		for dataList in wantedRelations.values():
+			for data in dataList:
+				dbObj = db.Entity( "viur-relations" , parent=db.decodeKey( key ) ) #skel.kindName+"_"+self.kind+"_"+key
+				for k, v in data.items():
+					dbObj[ k ] = v
+				dbObj[ "viur_delayed_update_tag" ] = time()
+				dbObj[ "viur_src_kind" ] = skel.kindName #The kind of the entry referencing
+				dbObj[ "viur_src_property" ] = boneName #The key of the bone referencing
+				dbObj[ "viur_dest_kind" ] = self.kind
+				putList.append( dbObj )
+
+		futures = [ db.PutAsync( putList[ i:i+__relationBatchSize__ ] ) for i in range( 0, len( putList ), __relationBatchSize__ ) ]
+		futures.extend( [ db.DeleteAsync( deleteList[ i:i+__relationBatchSize__ ] ) for i in range( 0, len( deleteList ), __relationBatchSize__ ) ] )
+		for future in futures:
+			future.get_result()
+
+	def _saveCompactRelations(self, values, boneName, skel, key):
+		"""
+			Stores the reverse-index for this bone as viur-relations entities holding the keys of the
+			referenced entities in their (multi-valued) dest.key property, up to __compactChunkSize__
+			keys per entity (so large relations stay within the index-entry and size limits of an entity).
 
-			if not self.indexed: #Dont store more than key and kinds, as they aren't used anyway
-				dbObj[ "dest.key" ] = val["dest"]["key"]
-				dbObj[ "src.key" ] = key
-			else:
-				refSkel = self._refSkelCache
-				refSkel.setValuesCache(val["dest"])
-				for k, v in refSkel.serialize().items():
-					dbObj[ "dest."+k ] = v
-				for k,v in parentValues.items():
-					dbObj[ "src."+k ] = v
-				if self.using is not None:
-					usingSkel = self._usingSkelCache
-					usingSkel.setValuesCache(val["rel"])
-					for k, v in usingSkel.serialize().items():
-						dbObj[ "rel."+k ] = v
+			As they're stored in the same kind and use the same property-names, these entities are found
+			by dest.key queries (like in :func:`server.skeleton.updateRelations`) as if they were the
+			per-reference entities.
+		"""
+		destKeys = sorted( set( [ str( x["dest"]["key"] ) for x in values ] ) )
+		chunks = OrderedDict()
+		for i in range( 0, len( destKeys ), __compactChunkSize__ ):
+			chunks[ "viur-compact-%s-%s" % ( boneName, i // __compactChunkSize__ ) ] = destKeys[ i:i+__compactChunkSize__ ]
+
+		dbVals = db.Query( "viur-relations" ).ancestor( db.decodeKey( key ) )
+		dbVals.filter("viur_src_kind =", skel.kindName )
+		dbVals.filter("viur_dest_kind =", self.kind)
+		dbVals.filter("viur_src_property =", boneName )
 
+		existingKeys = []
+		deleteList = []
+		for relKey in dbVals.iter( keysOnly=True ):
+			if relKey.name() in chunks:
+				existingKeys.append( relKey )
+			else: #Written by the non-compact mode, or a chunk no longer needed
+				deleteList.append( relKey )
+		existing = dict( ( x.key().name(), x ) for x in db.Get( existingKeys ) if x ) if existingKeys else {}
+
+		putList = []
+		for compactName, chunk in chunks.items():
+			storedKeys = existing[ compactName ].get( "dest.key" ) if compactName in existing else None
+			if not isinstance( storedKeys, list ): #Single values are returned unwrapped by the datastore
+				storedKeys = [ storedKeys ] if storedKeys else []
+			if sorted( [ str( x ) for x in storedKeys ] ) == chunk:
+				continue
+			dbObj = db.Entity( "viur-relations", parent=db.decodeKey( key ), name=compactName )
+			dbObj[ "dest.key" ] = chunk
+			dbObj[ "src.key" ] = key
 			dbObj[ "viur_delayed_update_tag" ] = time()
-			dbObj[ "viur_src_kind" ] = skel.kindName #The kind of the entry referencing
-			#dbObj[ "viur_src_key" ] = str( key ) #The key of the entry referencing
-			dbObj[ "viur_src_property" ] = boneName #The key of the bone referencing
-			#dbObj[ "viur_dest_key" ] = val["key"]
+			dbObj[ "viur_src_kind" ] = skel.kindName
+			dbObj[ "viur_src_property" ] = boneName
 			dbObj[ "viur_dest_kind" ] = self.kind
-			db.Put( dbObj )
+			dbObj[ "viur_compact" ] = True
+			putList.append( dbObj )
+
+		futures = [ db.PutAsync( putList[ i:i+__relationBatchSize__ ] ) for i in range( 0, len( putList ), __relationBatchSize__ ) ]
+		futures.extend( [ db.DeleteAsync( deleteList[ i:i+__relationBatchSize__ ] ) for i in range( 0, len( deleteList ), __relationBatchSize__ ) ] )
+		for future in futures:
+			future.get_result()
 
 	def postDeletedHandler( self, skel, key, id ):
-		db.Delete( [x for x in db.Query( "viur-relations" ).ancestor( db.Key( id ) ).run( keysOnly=True ) ] )
+		relKeys = list( db.Query( "viur-relations" ).ancestor( db.decodeKey( id ) ).iter( keysOnly=True ) )
+		futures = [ db.DeleteAsync( relKeys[ i:i+__relationBatchSize__ ] ) for i in range( 0, len( relKeys ), __relationBatchSize__ ) ]
+		for future in futures:
+			future.get_result()
 
 	def isInvalid( self, key ):
 		return False
@@ -403,7 +431,7 @@ class relationalBone( baseBone ):
 			entry = None
 
 			try:
-				entry = db.Get( db.Key( r["dest"]["key"] ) )
+				entry = db.Get( db.decodeKey( r["dest"]["key"] ) )
 			except: #Invalid key or something like thatmnn
 
 				logging.info( "Invalid reference key >%s< detected on bone '%s'",
@@ -502,7 +530,7 @@ class relationalBone( baseBone ):
 						logging.warning( "Invalid filtering! Doing an relational Query on %s with multiple key= filters is unsupported!" % (name) )
 						raise RuntimeError()
 					if not isinstance(v, db.Key ):
-						v = db.Key( v )
+						v = db.decodeKey( v )
 					dbFilter.ancestor( v )
 					continue
 				if not (k if "." not in k else k.split(".")[0]) in self.parentKeys:
@@ -671,10 +699,10 @@ class relationalBone( baseBone ):
 					logging.warning( "Invalid filtering! Doing an relational Query on %s with multiple key= filters is unsupported!" % (name) )
 					raise RuntimeError()
 				if not isinstance( value, db.Key ):
-					value = db.Key( value )
+					value = db.decodeKey( value )
 				query.ancestor( value )
 				return( None )
-			if srcKey not in self.parentKeys:
+			if srcKey not in self.parentKeys and srcKey.split(".")[0] not in self.parentKeys: #Sub-properties are copied, too
 				logging.warning( "Invalid filtering! %s is not in parentKeys of RelationalBone %s!" % (srcKey,name) )
 				raise RuntimeError()
 			return( "src.%s" % param, value )
@@ -725,9 +753,35 @@ class relationalBone( baseBone ):
 						res.append( "src.%s" % orderKey )
 		return( res )
 
-	def refresh(self, valuesCache, boneName, skel):
+	def _iterRelDicts(self, valuesCache, boneName):
+		"""
+			Yields each {"dest": ..., "rel": ...} dictionary stored in this bone.
+		"""
+		if isinstance(valuesCache.get(boneName), dict):
+			yield valuesCache[boneName]
+		elif isinstance(valuesCache.get(boneName), list):
+			for relDict in valuesCache[boneName]:
+				yield relDict
+
+	def getRefreshKeys(self, valuesCache, boneName):
+		"""
+			Returns the keys of all entities referenced by this bone.
+		"""
+		res = []
+		for relDict in self._iterRelDicts(valuesCache, boneName):
+			if not isinstance(relDict, dict) or not relDict.get("dest") or not relDict["dest"].get("key"):
+				continue
+			try:
+				res.append(normalizeKey(relDict["dest"]["key"]))
+			except:  # Invalid key, refresh() will deal with it
+				continue
+		return res
+
+	def refresh(self, valuesCache, boneName, skel, prefetched=None):
 		"""
 			Refresh all values we might have cached from other entities.
+
+			Entities found in *prefetched* are used as they are, all others are fetched one by one.
 		"""
 		def updateInplace(relDict):
 			"""
@@ -756,14 +810,19 @@ class relationalBone( baseBone ):
 			# (key was overidden above to have a new appid when transferred).
 			newValues = None
 
-			try:
-				newValues = db.Get(entityKey)
-				assert newValues is not None
-			except db.EntityNotFoundError:
-				#This entity has been deleted
-				logging.info("The key %s does not exist" % entityKey)
-			except:
-				raise
+			if prefetched is not None and entityKey in prefetched:
+				newValues = prefetched[entityKey]
+				if newValues is None:
+					logging.info("The key %s does not exist" % entityKey)
+			else:
+				try:
+					newValues = db.Get(entityKey)
+					assert newValues is not None
+				except db.EntityNotFoundError:
+					#This entity has been deleted
+					logging.info("The key %s does not exist" % entityKey)
+				except:
+					raise
 
 			if newValues:
 				for key in self._refSkelCache.keys():
@@ -778,20 +837,62 @@ class relationalBone( baseBone ):
 
 		logging.debug("Refreshing relationalBone %s of %s" % (boneName, skel.kindName))
 
-		if isinstance(valuesCache[boneName], dict):
-			updateInplace(valuesCache[boneName])
+		for relDict in self._iterRelDicts(valuesCache, boneName):
+			updateInplace(relDict)
+
+	def refNeedsUpdate(self, valuesCache, boneName, destKey, destEntity):
+		"""
+			Checks if the values we've cached from the entity *destKey* differ from its current values.
+
+			Used by :func:`server.skeleton.updateRelations` to skip referencing entities that are
+			already up to date.
+
+			:param destKey: The (string-encoded) key of the referenced entity
+			:type destKey: str
+			:param destEntity: The current version of that entity
+			:type destEntity: server.db.Entity
+			:returns: True if a refresh of this bone would change its value, False otherwise
+			:rtype: bool
+		"""
+		value = valuesCache.get(boneName)
+		if not value:
+			return False
+		if isinstance(value, dict):
+			value = [value]
+		foundRef = False
+		for relDict in value:
+			if not isinstance(relDict, dict) or not relDict.get("dest") or relDict["dest"].get("key") != destKey:
+				continue
+			foundRef = True
+			newValues = {}
+			for key, bone in self._refSkelCache.items():
+				if key == "key":
+					continue
+				if key not in destEntity and not any(x.startswith("%s." % key) for x in destEntity.keys()):
+					continue  # Not stored in that entity (multi-language bones are stored as key.lang)
+				bone.unserialize(newValues, key, destEntity)
+				if newValues.get(key) != relDict["dest"].get(key):
+					return True
+		# If we couldn't find that key (e.g. it's encoded differently), we must assume it's stale
+		return not foundRef
 
-		elif isinstance(valuesCache[boneName], list):
-			for k in valuesCache[boneName]:
-				updateInplace(k)
+	def getFacetValues(self, valuesCache, name):
+		"""
+			Returns the keys of the referenced entities, so this bone can be used as
+			facetScope of a skeleton (see :mod:`server.facets`).
+		"""
+		value = valuesCache.get(name)
+		if not value:
+			return []
+		if not self.multiple:
+			value = [value]
+		return [unicode(x["dest"]["key"]) for x in value if x and x.get("dest") and x["dest"].get("key")]
 
 	def getSearchTags(self, values, key):
 		def getValues(res, skel, valuesCache):
 			for k, bone in skel.items():
 				if bone.searchable:
-					for tag in bone.getSearchTags(valuesCache, k):
-						if tag not in res:
-							res.append(tag)
+					res.extend(bone.getSearchTags(valuesCache, k))
 			return res
 		value = values.get(key)
 		res = []
@@ -863,7 +964,7 @@ class relationalBone( baseBone ):
 		from server.skeleton import RefSkel, skeletonByKind
 		def relSkelFromKey(key):
 			if not isinstance(key, db.Key):
-				key = db.Key(encoded=key)
+				key = db.decodeKey(key)
 			if not key.kind() == self.kind:
 				logging.error("I got a key, which kind doesn't match my type! (Got: %s, my type %s)" % (key.kind(), self.kind))
 				return None
@@ -3,10 +3,38 @@ from server.bones import baseBone
 from collections import OrderedDict
 import logging
 
+_codelists = {}  # Mapping of codelist id -> function returning its values
+
+def registerCodelist(codelistId, getValues):
+	"""
+		Registers a list of values shared by many selectBones under *codelistId*.
+
+		Renderers may then send just this id (see :func:`getCodelist`) instead of the values of
+		each bone using it.
+
+		:param codelistId: Unique name of the codelist, like "country.iso2"
+		:type codelistId: str
+		:param getValues: Function returning an OrderedDict of key -> description
+		:type getValues: callable
+	"""
+	_codelists[codelistId] = getValues
+
+def getCodelist(codelistId):
+	"""
+		Returns the values registered under *codelistId*, or None if there is no such codelist.
+
+		:rtype: OrderedDict | None
+	"""
+	getValues = _codelists.get(codelistId)
+	if getValues is None:
+		return None
+	return getValues()
+
 class selectBone(baseBone):
 	type = "select"
+	codelist = None  # Id of the codelist (see registerCodelist) holding our values, if any
 
-	def __init__(self, defaultValue=None, values={}, multiple=False, *args, **kwargs):
+	def __init__(self, defaultValue=None, values={}, multiple=False, facet=False, *args, **kwargs):
 		"""
 			Creates a new selectBone.
 
@@ -14,12 +42,15 @@ class selectBone(baseBone):
 			:type defaultValue: List
 			:param values: Dict of key->value pairs from which the user can choose from. Values will be translated
 			:type values: Dict
+			:param facet: Maintain counts of entities per value (see :mod:`server.facets`)
+			:type facet: bool
 		"""
 
 		if defaultValue is None and multiple:
 			defaultValue = []
 
 		super(selectBone, self ).__init__(defaultValue=defaultValue, multiple=multiple, *args, **kwargs)
+		self.facet = facet
 
 		if "sortBy" in kwargs:
 			logging.warning("The sortBy parameter is deprecated. Please use an orderedDict for 'values' instead")
@@ -47,6 +78,17 @@ class selectBone(baseBone):
 		elif isinstance(values, OrderedDict):
 			self.values = values
 
+	def getFacetValues(self, valuesCache, name):
+		value = valuesCache.get(name)
+		if value is None:
+			return []
+		if not isinstance(value, list):
+			value = [value]
+		return [unicode(x) for x in value if x is not None]
+
+	def getFacetCandidates(self):
+		return [unicode(x) for x in self.values.keys()]
+
 	def fromClient(self, valuesCache, name, data):
 		values = data.get(name)
 
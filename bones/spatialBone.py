@@ -5,6 +5,14 @@ from server import db
 import logging
 import math
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+__geohashAlphabet__ = "0123456789bcdefghjkmnpqrstuvwxyz"
+__earthCircumference__ = 40030173.0 # In meters, used to convert degrees of latitude into meters
+
 def haversine(lat1, lng1, lat2, lng2):
 	"""
 		Calculates the distance between two points on Earth given by (lat1,lng1) and (lat2, lng2) in Meter.
@@ -21,29 +29,92 @@ def haversine(lat1, lng1, lat2, lng2):
 	d = math.sin(distLat/2.0)**2.0+math.cos(lat1)*math.cos(lat2)*math.sin(distlng/2.0)**2.0
 	return math.atan2(math.sqrt(d),math.sqrt(1-d))*12742000 # 12742000 = Avg. Earth size (6371km) in meters*2
 
+def haversineMany(lats, lngs, lat, lng):
+	"""
+		Calculates the distances between (lat, lng) and each point given by *lats* and *lngs* at once.
+
+		Uses numpy if available, otherwise the terms depending on (lat, lng) are computed only once.
+
+		:return: Distances in Meter
+		:rtype: list of float
+	"""
+	lat1 = math.radians(lat)
+	lng1 = math.radians(lng)
+	cosLat1 = math.cos(lat1)
+	if numpy is not None:
+		lats = numpy.radians(numpy.asarray(lats, dtype=float))
+		lngs = numpy.radians(numpy.asarray(lngs, dtype=float))
+		d = numpy.sin((lats-lat1)/2.0)**2.0+cosLat1*numpy.cos(lats)*numpy.sin((lngs-lng1)/2.0)**2.0
+		return (numpy.arctan2(numpy.sqrt(d), numpy.sqrt(1-d))*12742000).tolist()
+	res = []
+	sin, cos, atan2, sqrt, radians = math.sin, math.cos, math.atan2, math.sqrt, math.radians
+	for lat2, lng2 in zip(lats, lngs):
+		lat2 = radians(lat2)
+		d = sin((lat2-lat1)/2.0)**2.0+cosLat1*cos(lat2)*sin((radians(lng2)-lng1)/2.0)**2.0
+		res.append(atan2(sqrt(d), sqrt(1-d))*12742000)
+	return res
+
+def encodeGeohash(lat, lng, precision):
+	"""
+		Returns the geohash of the given point with *precision* characters.
+		See https://en.wikipedia.org/wiki/Geohash
+	"""
+	latRange = [-90.0, 90.0]
+	lngRange = [-180.0, 180.0]
+	res = []
+	bits = 0
+	char = 0
+	isLng = True
+	while len(res) < precision:
+		currRange, value = (lngRange, lng) if isLng else (latRange, lat)
+		mid = (currRange[0]+currRange[1])/2.0
+		if value >= mid:
+			char = char*2+1
+			currRange[0] = mid
+		else:
+			char = char*2
+			currRange[1] = mid
+		isLng = not isLng
+		bits += 1
+		if bits == 5:
+			res.append(__geohashAlphabet__[char])
+			bits = 0
+			char = 0
+	return "".join(res)
+
+def getGeohashCellSize(precision):
+	"""
+		:return: The size of a geohash-cell with *precision* characters in (degrees-of-latitude, degrees-of-longitude)
+		:rtype: (float, float)
+	"""
+	bits = 5*precision
+	return 180.0/pow(2, bits//2), 360.0/pow(2, (bits+1)//2)
+
 
 class spatialBone( baseBone ):
 	"""
 		Allows to query by Elements close to a given position.
-		Prior to use, you must specify for which region of the map the index should be build.
-		This region should be as small as possible for best accuracy. You cannot use the whole world, as
-		no boundary wraps are been performed.
-		GridDimensions specifies into how many sub-regions the map will be split. Results further away than the
-		size of these sub-regions won't be considered within a search by this algorithm.
-
-		Example:
-			If you use this bone to query your data for the nearest pubs, you might want to this algorithm
-			to consider results up to 100km distance, but not results that are 500km away.
-			Setting the size of these sub-regions to roughly 100km width/height allows this algorithm
-			to exclude results further than 200km away on database-query-level, therefore drastically
-			improving performance and reducing costs per query.
+
+		Each point is indexed by its geohash, written in all precisions from one up to *geohashPrecision*
+		characters. Queries select the cells to look at by equality filters on these geohashes, so they
+		can be combined with filters on other bones. The following filters are supported:
+
+			- *name.lat* and *name.lng*: Returns the entries closest to that point (k-nearest), ordered by
+			  their distance. The area searched grows until enough entries are found.
+			- *name.lat*, *name.lng* and *name.radius*: Entries within *radius* meters around that point,
+			  ordered by their distance.
+			- *name.minLat*, *name.maxLat*, *name.minLng* and *name.maxLng*: Entries inside that bounding-box.
+
+		Values outside the region given by boundsLat and boundsLng are rejected.
 
 		Example region: Germany: boundsLat=(46.988, 55.022), boundsLng=(4.997, 15.148)
 	"""
 
 	type = "spatial"
 
-	def __init__(self, boundsLat, boundsLng, gridDimensions, indexed=True, *args,  **kwargs ):
+	maxBoxCells = 8 # Maximum amount of cells queried to cover a bounding-box
+
+	def __init__(self, boundsLat, boundsLng, gridDimensions=None, geohashPrecision=8, indexed=True, *args,  **kwargs ):
 		"""
 			Initializes a new spatialBone.
 
@@ -51,26 +122,20 @@ class spatialBone( baseBone ):
 			:type boundsLat: (int, int)
 			:param boundsLng: Outer bounds (Latitude) of the region we will search in.
 			:type boundsLng: (int, int)
-			:param gridDimensions: Number of sub-regions the map will be divided in
+			:param gridDimensions: Not used anymore, the index covers all precisions up to geohashPrecision.
 			:type gridDimensions: (int, int)
+			:param geohashPrecision: Length of the most precise geohash indexed (8 equals cells of ~38x19m)
+			:type geohashPrecision: int
 		"""
 		baseBone.__init__( self, *args, indexed=indexed, **kwargs )
 		assert indexed, "spatialBone must be indexed! You want to search using it - don't you?"
 		assert isinstance(boundsLat, tuple) and len(boundsLat) == 2, "boundsLat must be a tuple of (int, int)"
 		assert isinstance(boundsLng, tuple) and len(boundsLng) == 2, "boundsLng must be a tuple of (int, int)"
-		assert isinstance(gridDimensions, tuple) and len(gridDimensions) == 2, "gridDimensions must be a tuple of (int, int)"
+		assert 1 <= geohashPrecision <= 12, "geohashPrecision must be between 1 and 12"
 		self.boundsLat = boundsLat
 		self.boundsLng = boundsLng
 		self.gridDimensions = gridDimensions
-
-	def getGridSize(self):
-		"""
-			:return: the size of our sub-regions in (fractions-of-latitude, fractions-of-longitude)
-			:rtype: (float, flot)
-		"""
-		latDelta = self.boundsLat[1]-self.boundsLat[0]
-		lngDelta = self.boundsLng[1]-self.boundsLng[0]
-		return latDelta/self.gridDimensions[0], lngDelta/self.gridDimensions[1]
+		self.geohashPrecision = geohashPrecision
 
 	def isInvalid( self, value ):
 		"""
@@ -112,13 +177,8 @@ class spatialBone( baseBone ):
 			entity.set( name+".lat.val", lat, self.indexed )
 			entity.set( name+".lng.val", lng, self.indexed )
 			if self.indexed:
-				gridSizeLat, gridSizeLng = self.getGridSize()
-				tileLat = int(floor((lat-self.boundsLat[0])/gridSizeLat))
-				tileLng = int(floor((lng-self.boundsLng[0])/gridSizeLng))
-				entity.set( name+".lat.tiles", [tileLat-1,tileLat,tileLat+1], self.indexed )
-				entity.set( name+".lng.tiles", [tileLng-1,tileLng,tileLng+1], self.indexed )
-		logging.error( entity[name+".lat.tiles"] )
-		logging.error( entity[name+".lng.tiles"] )
+				geohash = encodeGeohash(lat, lng, self.geohashPrecision)
+				entity.set( name+".geohash", [geohash[:x] for x in range(1, self.geohashPrecision+1)], self.indexed )
 		return( entity )
 
 	def unserialize( self, valuesCache, name, expando ):
@@ -137,6 +197,69 @@ class spatialBone( baseBone ):
 			return
 		valuesCache[name] = expando[name+".lat.val"], expando[name+".lng.val"]
 
+	def _getBlock(self, lat, lng, precision):
+		"""
+			Returns the 2x2 geohash-cells with *precision* characters closest to (lat, lng) and the distance
+			up to which this block is guaranteed to contain all points around (lat, lng).
+
+			:rtype: (list of str, float)
+		"""
+		latSize, lngSize = getGeohashCellSize(precision)
+		cellLat = floor((lat+90.0)/latSize)*latSize-90.0
+		cellLng = floor((lng+180.0)/lngSize)*lngSize-180.0
+		dirLat = 1 if lat-cellLat >= latSize/2.0 else -1
+		dirLng = 1 if lng-cellLng >= lngSize/2.0 else -1
+		cells = []
+		for lat2 in [lat, lat+dirLat*latSize]:
+			if not -90.0 <= lat2 < 90.0:
+				continue
+			for lng2 in [lng, lng+dirLng*lngSize]:
+				lng2 = ((lng2+180.0) % 360.0)-180.0
+				cell = encodeGeohash(lat2, lng2, precision)
+				if cell not in cells:
+					cells.append(cell)
+		blockLat = sorted([cellLat, cellLat+latSize, cellLat+dirLat*latSize, cellLat+(dirLat+1)*latSize])
+		blockLng = sorted([cellLng, cellLng+lngSize, cellLng+dirLng*lngSize, cellLng+(dirLng+1)*lngSize])
+		radius = min(haversineMany([blockLat[0], blockLat[-1], lat, lat], [lng, lng, blockLng[0], blockLng[-1]], lat, lng))
+		return cells, radius
+
+	def _getBoxCells(self, minLat, maxLat, minLng, maxLng):
+		"""
+			Returns the geohash-cells covering the given bounding-box, choosing the most precise cells
+			possible with no more than maxBoxCells cells.
+
+			:returns: List of cells or None if the box is too large to be covered.
+			:rtype: list of str | None
+		"""
+		for precision in range(self.geohashPrecision, 0, -1):
+			latSize, lngSize = getGeohashCellSize(precision)
+			latSteps = int(floor((maxLat+90.0)/latSize))-int(floor((minLat+90.0)/latSize))+1
+			lngSteps = int(floor((maxLng+180.0)/lngSize))-int(floor((minLng+180.0)/lngSize))+1
+			if latSteps*lngSteps > self.maxBoxCells:
+				continue
+			cells = []
+			for x in range(latSteps):
+				for y in range(lngSteps):
+					cell = encodeGeohash(min(minLat+x*latSize, maxLat), min(minLng+y*lngSize, maxLng), precision)
+					if cell not in cells:
+						cells.append(cell)
+			return cells
+		return None
+
+	def _buildCellQueries(self, name, kind, baseFilters, cells):
+		"""
+			Returns one query for each geohash-cell in *cells*, including the filters in *baseFilters*.
+		"""
+		res = []
+		for cell in cells:
+			q = db.DatastoreQuery( kind=kind )
+			for k, v in baseFilters:
+				if k.split(" ")[0] != name+".geohash":
+					q[k] = v
+			q[name+".geohash"] = cell
+			res.append(q)
+		return res
+
 	def buildDBFilter( self, name, skel, dbFilter, rawFilter, prefix=None ):
 		"""
 			Parses the searchfilter a client specified in his Request into
@@ -160,50 +283,65 @@ class spatialBone( baseBone ):
 			:returns: The modified :class:`server.db.Query`
 		"""
 		assert prefix is None, "You cannot use spatial data in a relation for now"
+		boxKeys = [name+".minLat", name+".maxLat", name+".minLng", name+".maxLng"]
 		if name+".lat" in rawFilter and name+".lng" in rawFilter:
 			try:
 				lat = float(rawFilter[name+".lat"])
 				lng = float(rawFilter[name+".lng"])
+				radius = float(rawFilter[name+".radius"]) if name+".radius" in rawFilter else None
 			except:
 				logging.debug("Received invalid values for lat/lng in %s", name)
 				dbFilter.datastoreQuery = None
 				return
-			if self.isInvalid( (lat,lng) ):
+			if self.isInvalid( (lat,lng) ) or (radius is not None and radius <= 0):
 				logging.debug("Values out of range in %s", name)
 				dbFilter.datastoreQuery = None
 				return
-			assert self.indexed
-			gridSizeLat, gridSizeLng = self.getGridSize()
-			tileLat = int(floor((lat-self.boundsLat[0])/gridSizeLat))
-			tileLng = int(floor((lng-self.boundsLng[0])/gridSizeLng))
-			assert not isinstance( dbFilter.datastoreQuery, db.MultiQuery )
-			origQuery = dbFilter.datastoreQuery
-			# Lat - Right Side
-			q1 = db.DatastoreQuery( kind=dbFilter.getKind() )
-			q1[name+".lat.val >="] = lat
-			q1[name+".lat.tiles"] = tileLat
-			# Lat - Left Side
-			q2 = db.DatastoreQuery( kind=dbFilter.getKind() )
-			q2[name+".lat.val <"] = lat
-			q2[name+".lat.tiles"] = tileLat
-			q2.Order( (name+".lat.val", db.DESCENDING) )
-			# Lng - Down
-			q3 = db.DatastoreQuery( kind=dbFilter.getKind() )
-			q3[name+".lng.val >="] = lng
-			q3[name+".lng.tiles"] = tileLng
-			# Lng - Top
-			q4 = db.DatastoreQuery( kind=dbFilter.getKind() )
-			q4[name+".lng.val <"] = lng
-			q4[name+".lng.tiles"] = tileLng
-			q4.Order( (name+".lng.val", db.DESCENDING) )
-
-			dbFilter.datastoreQuery = db.MultiQuery([q1,q2,q3,q4], None)
-
-			dbFilter._customMultiQueryMerge = lambda *args, **kwargs: self.customMultiQueryMerge( name, lat, lng, *args, **kwargs )
-			dbFilter._calculateInternalMultiQueryAmount = self.calculateInternalMultiQueryAmount
-
-
-		#return( super( spatialBone, self ).buildDBFilter( name, skel, dbFilter, rawFilter ) )
+		elif all([x in rawFilter for x in boxKeys]):
+			try:
+				minLat, maxLat, minLng, maxLng = [float(rawFilter[x]) for x in boxKeys]
+			except:
+				logging.debug("Received invalid values for the bounding-box in %s", name)
+				dbFilter.datastoreQuery = None
+				return
+			if minLat > maxLat or minLng > maxLng:
+				logging.debug("Invalid bounding-box in %s", name)
+				dbFilter.datastoreQuery = None
+				return
+			lat = lng = radius = None
+		else:
+			return
+		assert self.indexed
+		assert not isinstance( dbFilter.datastoreQuery, db.MultiQuery )
+		origQuery = dbFilter.datastoreQuery
+		kind = dbFilter.getKind()
+		if lat is None: # Bounding-Box
+			cells = self._getBoxCells(minLat, maxLat, minLng, maxLng)
+			isMatch = lambda x: minLat <= x[name+".lat.val"] <= maxLat and minLng <= x[name+".lng.val"] <= maxLng
+		elif radius is not None:
+			cells = None
+			for precision in range(self.geohashPrecision, 0, -1):
+				latSize, lngSize = getGeohashCellSize(precision)
+				cellSize = min(latSize, lngSize*math.cos(math.radians(lat)))*__earthCircumference__/360.0
+				if cellSize/2.0 >= radius:
+					cells = self._getBlock(lat, lng, precision)[0]
+					break
+			isMatch = None
+		else: # k-nearest
+			precision = self.geohashPrecision
+			cells = self._getBlock(lat, lng, precision)[0]
+		if cells is None: # Area too large for our index, check each entry
+			cells = []
+			queries = [origQuery]
+		else:
+			queries = self._buildCellQueries(name, kind, origQuery.items(), cells)
+		dbFilter.datastoreQuery = db.MultiQuery(queries, None)
+		dbFilter.setKind(kind)
+		if lat is not None and radius is None:
+			dbFilter._customMultiQueryMerge = lambda *args, **kwargs: self.customMultiQueryMerge( name, lat, lng, precision, kind, *args, **kwargs )
+		else:
+			dbFilter._customMultiQueryMerge = lambda *args, **kwargs: self.areaMultiQueryMerge( name, lat, lng, radius, isMatch, *args, **kwargs )
+		dbFilter._calculateInternalMultiQueryAmount = self.calculateInternalMultiQueryAmount
 
 	def calculateInternalMultiQueryAmount(self, targetAmount):
 		"""
@@ -214,11 +352,24 @@ class spatialBone( baseBone ):
 			:returns: The amount of elements db.Query should fetch on each subquery
 			:rtype: int
 		"""
-		return targetAmount*2
+		return targetAmount
 
-	def customMultiQueryMerge(self, name, lat, lng, dbFilter, result, targetAmount):
+	def _sortByDistance(self, name, lat, lng, entries):
+		"""
+			:returns: List of (distance, entry) tuples, nearest first
 		"""
-			Randomly returns 'targetAmount' elements from 'result'
+		distances = haversineMany([x[name+".lat.val"] for x in entries], [x[name+".lng.val"] for x in entries], lat, lng)
+		res = zip(distances, entries)
+		res.sort(key=lambda x: x[0])
+		return res
+
+	def customMultiQueryMerge(self, name, lat, lng, precision, kind, dbFilter, result, targetAmount):
+		"""
+			Returns the 'targetAmount' elements closest to (lat, lng).
+
+			If the cells queried don't contain enough elements within the distance they cover completely,
+			the next larger (less precise) block of cells is queried, until *targetAmount* elements have been
+			found or the whole world has been searched.
 
 			:param dbFilter: The db.Query calling this function
 			:type: dbFilter: server.db.Query
@@ -229,30 +380,48 @@ class spatialBone( baseBone ):
 			:return: List of elements which should be returned from db.Query
 			:rtype: list of :class:`server.db.Entity`
 		"""
-		assert len(result)==4 #There should be exactly one result for each direction
-		result = [list(x) for x in result] # Remove the iterators
-		latRight, latLeft, lngBottom, lngTop = result
-		gridSizeLat, gridSizeLng = self.getGridSize()
-		# Calculate the outer bounds we've reached - used to tell to which distance we can
-		# prove the result to be correct.
-		# If a result further away than this distance there might be missing results before that result
-		# If there are no results in a give lane (f.e. because we are close the border and there is no point
-		# in between) we choose a arbitrary large value for that lower bound
-		limits = [
-				haversine(latRight[-1][name+".lat.val"], lng, lat, lng) if latRight else 2^31, # Lat - Right Side
-				haversine(latLeft[-1][name+".lat.val"], lng, lat, lng) if latLeft else 2^31, # Lat - Left Side
-				haversine(lat, lngBottom[-1][name+".lng.val"], lat, lng) if lngBottom else 2^31, # Lng - Bottom
-				haversine(lat, lngTop[-1][name+".lng.val"], lat, lng) if lngTop else 2^31, # Lng - Top
-				haversine(lat+gridSizeLat,lng,lat,lng),
-				haversine(lat,lng+gridSizeLng,lat,lng)
-			]
-		dbFilter.customQueryInfo["spatialGuaranteedCorrectness"] = min(limits)
+		baseFilters = getattr(dbFilter.datastoreQuery, "_MultiQuery__bound_queries")[0].items()
+		candidates = {}
+		while True:
+			result = [list(x) for x in result] # Remove the iterators
+			isTruncated = any([len(x) >= targetAmount for x in result])
+			for item in sum(result, []):
+				candidates[str(item.key())] = item
+			radius = self._getBlock(lat, lng, precision)[1]
+			tmpList = self._sortByDistance(name, lat, lng, candidates.values())
+			if precision <= 1 or isTruncated or len([x for x in tmpList if x[0] <= radius]) >= targetAmount:
+				break
+			# Not enough results within the area we've searched completely, look at the next larger area
+			precision -= 1
+			cells = self._getBlock(lat, lng, precision)[0]
+			result = [q.Run(limit=targetAmount) for q in self._buildCellQueries(name, kind, baseFilters, cells)]
+		# Tell up to which distance the result is known to be correct. A truncated cell returned arbitrary
+		# elements, not the closest ones, so there might be closer elements we haven't seen.
+		dbFilter.customQueryInfo["spatialGuaranteedCorrectness"] = 0 if isTruncated else radius
+		dbFilter.customQueryInfo["spatialTruncated"] = isTruncated
 		logging.debug("SpatialGuaranteedCorrectness: %s", dbFilter.customQueryInfo["spatialGuaranteedCorrectness"])
-		# Filter duplicates
+		return [x[1] for x in tmpList[:targetAmount]]
+
+	def areaMultiQueryMerge(self, name, lat, lng, radius, isMatch, dbFilter, result, targetAmount):
+		"""
+			Returns up to 'targetAmount' elements inside the bounding-box or radius queried; ordered by their
+			distance if a center has been given.
+
+			Each cell returns at most 'targetAmount' elements, before they are matched against the area.
+			If a cell has been truncated, the result might miss elements inside the area (or, for a radius,
+			closer ones); this is recorded as customQueryInfo["spatialTruncated"] and, for a radius, as a
+			spatialGuaranteedCorrectness of 0 (the radius otherwise).
+
+			:return: List of elements which should be returned from db.Query
+			:rtype: list of :class:`server.db.Entity`
+		"""
+		result = [list(x) for x in result]
+		isTruncated = any([len(x) >= targetAmount for x in result])
+		dbFilter.customQueryInfo["spatialTruncated"] = isTruncated
 		tmpDict = {}
-		for item in (latRight+latLeft+lngBottom+lngTop):
+		for item in sum(result, []):
 			tmpDict[str(item.key())] = item
-		# Build up the final results
-		tmpList = [(haversine(x[name+".lat.val"],x[name+".lng.val"],lat,lng),x) for x in tmpDict.values()]
-		tmpList.sort( key=lambda x: x[0])
-		return [x[1] for x in tmpList[:targetAmount]]
+		if lat is None:
+			return [x for x in tmpDict.values() if isMatch(x)][:targetAmount]
+		dbFilter.customQueryInfo["spatialGuaranteedCorrectness"] = 0 if isTruncated else radius
+		return [x[1] for x in self._sortByDistance(name, lat, lng, tmpDict.values()) if x[0] <= radius][:targetAmount]
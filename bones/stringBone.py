@@ -2,11 +2,12 @@
 from server.bones import baseBone
 from server.config import conf
 from server import db
+from server.fulltext import tokenize
 from server import request
 from server import utils
 from server.session import current as currentSession
 from google.appengine.api import search
-import logging
+import logging, re
 
 
 class LanguageWrapper( dict ):
@@ -53,11 +54,26 @@ class stringBone( baseBone ):
 	def generageSearchWidget(target,name="STRING BONE",mode="equals"):
 		return ( {"name":name,"mode":mode,"target":target,"type":"string"} )
 
-	def __init__(self, caseSensitive = True, multiple=False, languages=None, *args, **kwargs ):
+	def __init__(self, caseSensitive = True, multiple=False, languages=None, ngramIndex=False, ngramMaxLength=10, *args, **kwargs ):
+		"""
+			Initializes a new stringBone.
+
+			:param caseSensitive: If False, a lowercase copy of the value is indexed for filtering and sorting
+			:type caseSensitive: bool
+			:param ngramIndex: If True, the prefixes of each word are indexed (per language), so name$lk\
+			matches words anywhere in the value using equality filters
+			:type ngramIndex: bool
+			:param ngramMaxLength: Longest prefix indexed per word; longer search-terms are truncated
+			:type ngramMaxLength: int
+		"""
 		super( stringBone, self ).__init__( *args, **kwargs )
 		if not caseSensitive and not self.indexed:
 			raise ValueError("Creating a case-insensitive index without actually writing the index is nonsense.")
+		if ngramIndex and not self.indexed:
+			raise ValueError("Creating a n-gram index without actually writing the index is nonsense.")
 		self.caseSensitive = caseSensitive
+		self.ngramIndex = ngramIndex
+		self.ngramMaxLength = ngramMaxLength
 		if not (languages is None or (isinstance( languages, list ) and len(languages)>0 and all( [isinstance(x,basestring) for x in languages] ))):
 			raise ValueError("languages must be None or a list of strings ")
 		self.languages = languages
@@ -69,6 +85,15 @@ class stringBone( baseBone ):
 				del entity[ k ]
 		if name not in valuesCache:
 			return entity
+		if self.ngramIndex and name != "key":
+			value = valuesCache[name]
+			if not self.languages:
+				entity.set( name+".ngrams", self.getNgrams( value ), True )
+			elif isinstance( value, dict ):
+				for lang in self.languages:
+					entity.set( "%s.%s.ngrams" % (name, lang), self.getNgrams( value.get( lang ) ), True )
+			elif value: #Old format
+				entity.set( "%s.%s.ngrams" % (name, self.languages[0]), self.getNgrams( value ), True )
 		if not self.languages:
 			if self.caseSensitive:
 				return( super( stringBone, self ).serialize( valuesCache, name, entity ) )
@@ -119,6 +144,26 @@ class stringBone( baseBone ):
 								entity.set( "%s.%s.idx" % (name, lang), "", self.indexed )
 		return( entity )
 
+	def getNgrams( self, value ):
+		"""
+			Returns the edge n-grams (all prefixes up to ngramMaxLength chars) of each word in *value*.
+
+			:param value: A string or a list of strings (or None)
+			:rtype: list of unicode
+		"""
+		if not value:
+			return( [] )
+		if not isinstance( value, list ):
+			value = [ value ]
+		res = set()
+		for val in value:
+			if not isinstance( val, basestring ):
+				continue
+			for word in re.findall( r"\w+", val.lower(), re.UNICODE ):
+				for i in range( 1, min( len( word ), self.ngramMaxLength )+1 ):
+					res.add( word[ :i ] )
+		return( sorted( res ) )
+
 	def unserialize(self, valuesCache, name, expando):
 		"""
 			Inverse of serialize. Evaluates whats
@@ -250,7 +295,14 @@ class stringBone( baseBone ):
 				if not lang or not lang in self.languages:
 					lang = self.languages[ 0 ]
 			namefilter = "%s.%s" % (name, lang)
-		if name+"$lk" in rawFilter: #Do a prefix-match
+		if name+"$lk" in rawFilter and self.ngramIndex: #Match words starting with each given word
+			ngrams = [ word[ :self.ngramMaxLength ] for word in re.findall( r"\w+", unicode( rawFilter[name+"$lk"] ).lower(), re.UNICODE ) ]
+			ngrams = sorted( set( ngrams ) )
+			if len( ngrams )==1:
+				dbFilter.filter( (prefix or "")+namefilter+".ngrams =", ngrams[0] )
+			elif ngrams: #All of them must match
+				dbFilter.filter( (prefix or "")+namefilter+".ngrams =", ngrams )
+		elif name+"$lk" in rawFilter: #Do a prefix-match
 			if not self.caseSensitive:
 				dbFilter.filter( (prefix or "")+namefilter +".idx >=", unicode( rawFilter[name+"$lk"] ).lower() )
 				dbFilter.filter( (prefix or "")+namefilter +".idx <", unicode( rawFilter[name+"$lk"]+u"\ufffd" ).lower() )
@@ -323,40 +375,15 @@ class stringBone( baseBone ):
 			return (res)
 		value = valuesCache[name]
 		if self.languages and isinstance(value, dict):
-			if self.multiple:
-				for lang in value.values():
-					for val in lang:
-						for line in unicode(val).splitlines():
-							for key in line.split(" "):
-								key = "".join([c for c in key if c.lower() in conf[
-									"viur.searchValidChars"]])
-								if key and key not in res and len(key) > 1:
-									res.append(key.lower())
-			else:
-				for lang in value.values():
-					for line in unicode(lang).splitlines():
-						for key in line.split(" "):
-							key = "".join([c for c in key if
-							               c.lower() in conf["viur.searchValidChars"]])
-							if key and key not in res and len(key) > 1:
-								res.append(key.lower())
+			values = value.values()
 		else:
-			if self.multiple:
-				for val in value:
-					for line in unicode(val).splitlines():
-						for key in line.split(" "):
-							key = "".join([c for c in key if
-							               c.lower() in conf["viur.searchValidChars"]])
-							if key and key not in res and len(key) > 1:
-								res.append(key.lower())
+			values = [value]
+		for val in values:
+			if self.multiple and isinstance(val, list):
+				for v in val:
+					res.extend(tokenize(v, minLength=2))
 			else:
-				for line in unicode(value).splitlines():
-					for key in line.split(" "):
-						key = "".join(
-							[c for c in key if c.lower() in conf["viur.searchValidChars"]])
-						if key and key not in res and len(key) > 1:
-							res.append(key.lower())
-
+				res.extend(tokenize(val, minLength=2))
 		return (res)
 
 	def getSearchDocumentFields(self, valuesCache, name, prefix = ""):
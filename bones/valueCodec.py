@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+from server.config import conf
+from datetime import datetime
+import extjson, json
+
+"""
+	Codecs used to store the values of relationalBone and recordBone in the datastore.
+
+	A value is stored as a list of records; each record consists of one dict (or None) per part,
+	like the "dest" and "rel" part of a relation. The codec used for writing is selected by
+	conf["viur.bones.valueCodec"]; values are always read by the codec they have been written with,
+	so changing that setting upgrades entities when they are saved the next time.
+
+	The default is the legacy "json" codec. To migrate to the compact "v1" codec, deploy a version
+	supporting it first, then set conf["viur.bones.valueCodec"] = "v1" (and rebuild the affected
+	kinds to convert existing entities). Versions without that codec can't read values written by
+	it, so don't enable it while a rollback to such a version might still be needed.
+"""
+
+_codecs = {}  # Mapping name -> ValueCodec
+
+
+class ValueCodec(object):
+	"""
+		Base class for value codecs. Register subclasses using :func:`registerValueCodec`.
+
+		Values written by a codec must start with its name followed by a colon, except for the
+		legacy JSON codec, which is used for any value without such a prefix.
+	"""
+	name = None
+
+	def encode(self, records, parts=None):
+		"""
+			Encodes *records*.
+
+			:param records: The records to store, each a list containing one dict (or None) per part
+			:type records: list of list
+			:param parts: Names of the parts of each record (like ("dest", "rel")), None if there's just one
+			:type parts: tuple | None
+			:returns: The strings to store; one string might hold multiple records.
+			:rtype: list of str
+			:raises: :exc:`TypeError` or :exc:`ValueError` if the records cannot be encoded by this codec
+		"""
+		raise NotImplementedError()
+
+	def decode(self, data, parts=None):
+		"""
+			Decodes one string written by :func:`encode` (without its prefix).
+
+			:returns: The records stored in *data*
+			:rtype: list of list
+		"""
+		raise NotImplementedError()
+
+
+class JsonValueCodec(ValueCodec):
+	"""
+		The original format: One JSON-object per record, holding one key per part.
+	"""
+	name = "json"
+
+	def encode(self, records, parts=None):
+		if not parts:
+			return [extjson.dumps(record[0]) for record in records]
+		return [extjson.dumps(dict(zip(parts, record))) for record in records]
+
+	def decode(self, data, parts=None):
+		value = extjson.loads(data)
+		assert isinstance(value, dict), "Read something from the datastore thats not a dict: %s" % str(type(value))
+		if not parts:
+			return [[value]]
+		if not parts[0] in value:  # Written before parts have been introduced
+			return [[value] + [None] * (len(parts) - 1)]
+		return [[value.get(part) for part in parts]]
+
+
+class CompactValueCodec(ValueCodec):
+	"""
+		Stores all records of a value in one string.
+
+		The property-names of each part are stored once; the records hold their values positionally.
+		Parts with a different set of properties are stored as objects instead.
+		Datetimes are stored as lists of their components.
+	"""
+	name = "v1"
+	_dateTimeMarker = u"\x00dt"
+
+	@classmethod
+	def _encodeDefault(cls, obj):
+		if isinstance(obj, datetime) and obj.tzinfo is None:
+			return {cls._dateTimeMarker: [obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second, obj.microsecond]}
+		raise TypeError("%s is not supported by the compact value codec" % type(obj))
+
+	@classmethod
+	def _decodeHook(cls, obj):
+		if cls._dateTimeMarker in obj and len(obj) == 1:
+			return datetime(*obj[cls._dateTimeMarker])
+		return obj
+
+	def encode(self, records, parts=None):
+		partCount = len(parts) if parts else 1
+		fields = [None] * partCount
+		for record in records:
+			for idx in range(partCount):
+				if fields[idx] is None and record[idx] is not None:
+					fields[idx] = list(record[idx].keys())
+		fieldSets = [set(x) if x is not None else None for x in fields]
+		rows = []
+		for record in records:
+			row = []
+			for idx in range(partCount):
+				part = record[idx]
+				if part is None:
+					row.append(None)
+				elif len(part) == len(fields[idx]) and fieldSets[idx].issuperset(part.keys()):
+					row.append([part[k] for k in fields[idx]])
+				else:
+					row.append(part)
+			rows.append(row)
+		return ["%s:%s" % (self.name, json.dumps([fields, rows], separators=(",", ":"), default=self._encodeDefault))]
+
+	def decode(self, data, parts=None):
+		fields, rows = json.loads(data, object_hook=self._decodeHook)
+		res = []
+		for row in rows:
+			res.append([dict(zip(fields[idx], part)) if isinstance(part, list) else part for idx, part in enumerate(row)])
+		return res
+
+
+def registerValueCodec(codec):
+	"""
+		Makes *codec* available for reading and (if selected by conf["viur.bones.valueCodec"]) writing.
+
+		:type codec: ValueCodec
+	"""
+	_codecs[codec.name] = codec
+
+
+def encodeValues(records, parts=None):
+	"""
+		Encodes *records* using the codec selected by conf["viur.bones.valueCodec"].
+
+		Falls back to the JSON codec if the selected one cannot handle these values.
+
+		:returns: The strings to store
+		:rtype: list of str
+	"""
+	codec = _codecs.get(conf["viur.bones.valueCodec"], _codecs["json"])
+	try:
+		return codec.encode(records, parts)
+	except (TypeError, ValueError, UnicodeDecodeError):
+		return _codecs["json"].encode(records, parts)
+
+
+def decodeValues(data, parts=None):
+	"""
+		Decodes the records stored in *data*, which may be a string or a list of strings
+		as read from the datastore, written by any registered codec.
+
+		:rtype: list of list
+	"""
+	if not isinstance(data, list):
+		data = [data]
+	res = []
+	for value in data:
+		if not value:
+			continue
+		codec = None
+		if not value.startswith("{") and ":" in value:
+			codec = _codecs.get(value[:value.find(":")])
+		if codec is not None:
+			res.extend(codec.decode(value[len(codec.name) + 1:], parts))
+		else:
+			res.extend(_codecs["json"].decode(value, parts))
+	return res
+
+
+registerValueCodec(JsonValueCodec())
+registerValueCodec(CompactValueCodec())
@@ -3,7 +3,7 @@ from server import db, utils, request, tasks, session
 from server.config import conf
 from hashlib import sha512
 from datetime import datetime, timedelta
-import logging
+import logging, types
 from functools import wraps
 
 """
@@ -141,6 +141,8 @@ def wrapCallable(f, urls, userSensitive, languageSensitive, evaluatedArgs, maxCa
 				return( dbRes["data"] )
 		# If we made it this far, the request wasnt cached or too old; we need to rebuild it
 		res = f( self, *args, **kwargs )
+		if isinstance( res, types.GeneratorType ): # Streamed responses must be stored as a whole
+			res = "".join( res )
 		dbEntity = db.Entity( viurCacheName, name=key )
 		dbEntity[ "data" ] = res
 		dbEntity[ "creationtime" ] = datetime.now()
@@ -13,12 +13,21 @@ conf = {
 
 	"viur.accessRights": ["root","admin"],  #Accessrights available on this Application
 	"viur.availableLanguages": [], #List of language-codes, which are valid for this application
+	"viur.bones.htmlCacheSize": 4*1024*1024, #Characters of sanitized HTML (and its text) memoised by textBone and htmlBone per instance
+	"viur.bones.valueCodec": "json", #Codec used to store the values of relationalBones and recordBones ("v1" for the compact format, which older versions cannot read)
 
 	"viur.cacheEnvironmentKey": None, #If set, this function will be called for each cache-attempt and the result will be included in the computed cache-key
 	"viur.capabilities": [], #Extended functionality of the whole System (For module-dependend functionality advertise this in the module configuration (adminInfo)
+	"viur.codelists.inline": False, #If set, select bones using a shared codelist (like selectCountryBone) render their values into each structure instead of its id and ETag
 	"viur.contentSecurityPolicy": None, #If set, viur will emit a CSP http-header with each request. Use the csp module to set this property
 
+	"viur.db.adaptiveFetch.excludeKinds": [], #Queries on these kinds always fetch keys only and resolve them by Get(), which reads strongly consistent; entities fetched directly by the query are only eventually consistent
+	"viur.db.adaptiveFetch.minHitRatio": 0.5, #Queries fetch keys only and resolve them by Get() if at least this ratio of entities of that kind has been served from memcache, entire entities otherwise (requires viur.db.caching 2)
+	"viur.db.adaptiveFetch.minSamples": 50, #Queries fetch keys only until this many memcache lookups of that kind have been observed
+	"viur.db.adaptiveFetch.probeRate": 0.1, #Ratio of queries still fetching keys only on kinds with a low hit rate, so a rising hit rate is noticed
+	"viur.db.adaptiveFetch.window": 1000, #Number of memcache lookups per kind after which older observations are weighted down
 	"viur.db.caching" : 2, #Cache strategy used by the database. 2: Aggressive, 1: Safe, 0: Off
+	"viur.db.keyCacheSize": 2000, #Number of decoded keys kept by db.decodeKey() and db.encodeKey()
 	"viur.debug.traceExceptions": False, #If enabled, user-generated exceptions from the server.errors module won't be caught and handled
 	"viur.debug.traceExternalCallRouting": False, #If enabled, ViUR will log which (exposed) function are called from outside with what arguments
 	"viur.debug.traceInternalCallRouting": False, #If enabled, ViUR will log which (internal-exposed) function are called from templates with what arguments
@@ -35,7 +44,13 @@ conf = {
 	"viur.errorTemplate": "server/template/error.html", #Path to the template to render if an unhandled error occurs. This is a Python String-template, *not* a jinja2 one!
 	"viur.exportPassword": None, # Activates the Database export API if set. Must be exactly 32 chars. *Everyone* knowing this password can dump the whole database!
 
+	"viur.facets.maxAttempts": 5, #Updating facet counts is given up after that many failed attempts (retried with an exponential backoff)
+	"viur.facets.markerLifeTime": 7*24*60*60, #Markers of applied facet count changes (guarding against applying them twice) are purged after that many seconds
+	"viur.facets.shards": 4, #Each facet count is spread over that many entities. Lowering this loses the counts held by the removed shards
 	"viur.forceSSL": False,  #If true, all requests must be encrypted (ignored on development server)
+	"viur.fulltext.enabled": False, #Use and update the fulltext-index (server.fulltext) for the search-filter of skeletons without a searchIndex; the viur_tags-search is used otherwise. Rebuild the search-index after enabling it
+	"viur.fulltext.maxCandidates": 500, #Maximum amount of matching entities ranked by a fulltext-search (and per prefix, for words ending with an asterisk)
+	"viur.fulltext.maxResults": 30, #Maximum amount of ranked search-results
 
 	"viur.importPassword": None, # Activates the Database import API if set. Must be exactly 32 chars. *Everyone* knowing this password can rewrite the whole database!
 
@@ -51,9 +66,25 @@ conf = {
 
 	"viur.noSSLCheckUrls": ["/_tasks*", "/ah/*"], #List of Urls for which viur.forceSSL is ignored. Add an asterisk to mark that entry as a prefix (exact match otherwise)
 
+	"viur.password.iterations": 10000, #PBKDF2 iterations used for new password hashes; existing ones are rehashed on the next successful login
+	"viur.postSave.async": True, #If set, asynchronous post-save stages (searchindex, relations, fulltext-index) of all entities saved during a request run in one deferred task after it; otherwise inside toDB
+	"viur.postSave.maxAttempts": 5, #Asynchronous post-save stages failing for an entity are retried (with an exponential backoff) until they failed that many times
+
+	"viur.rebuild.batchSize": 25, #Amount of entities refreshed per task by the rebuild job
+	"viur.rebuild.concurrency": 10, #Default amount of shards processed in parallel by the rebuild job
+	"viur.rebuild.maxErrors": 3, #Give up a shard of the rebuild job after that many failed attempts
+	"viur.rebuild.shardsPerKind": 8, #Amount of key-ranges each kind is split into by the rebuild job
+	"viur.relations.updateBatchSize": 50, #Amount of referencing entities processed at once by updateRelations
+	"viur.relations.updateDelay": 5, #Changes to the same entity within this amount of seconds are propagated to its references at once
+
+	"viur.render.html.bytecodeCache": ["filesystem", "memcache"], #Backends storing the compiled templates of the html renderer (see server.render.html.bytecode), tried in this order
+	"viur.render.html.bytecodeDir": "templates_compiled", #Directory (relative to the application) holding compiled templates; fill it by the "Compile templates" task on the development server before deploying
 	"viur.requestPreprocessor": None, # Allows the application to register a function that's called before the request gets routed
 
 	"viur.salt": "ViUR-CMS",  #Default salt which will be used for eg. passwords. Once the application is used, this must not change!
+	"viur.searchQueue.localIndex": False, #If set, documents are indexed in memory (server.searchQueue.LocalIndex) instead of by the search API, so indexing can be run offline
+	"viur.searchQueue.retries": 3, #Documents the search API failed to index (or remove) are sent again up to this many times
+	"viur.searchQueue.retryDelay": 0.1, #Seconds to wait before sending failed documents again; doubled for each further retry
 	"viur.searchValidChars": "abcdefghijklmnopqrstuvwxyz0123456789",  #Characters valid for the internal search functionality (all other chars are ignored)
 	"viur.security.contentSecurityPolicy": {'enforce': {'style-src': ['self', 'unsafe-inline'],  # unsafe-inline currently required for textBones
 	                                                    'default-src': ['self'],
@@ -4,7 +4,10 @@ from google.appengine.datastore import datastore_query, datastore_rpc
 from google.appengine.api import memcache
 from google.appengine.api import search
 from server.config import conf
-import logging
+from server import searchQueue
+from collections import OrderedDict
+from threading import Lock
+import logging, random
 
 
 """
@@ -21,6 +24,123 @@ __cacheTime__ = 15*60 #15 Mins
 __CacheKeyPrefix__ ="viur-db-cache:" #Our Memcache-Namespace. Dont use that for other purposes
 __MemCacheBatchSize__ = 30
 __undefinedC__ = object()
+_cacheStats = {} # Mapping kind -> [memcache hits, misses] observed by Get() on this instance
+_cacheStatsLock = Lock() # Guards _cacheStats, which is shared by all threads
+
+
+def _recordCacheStats( keys, encodedKeys, cacheRes ):
+	"""
+		Counts the memcache hits and misses of a list-Get() per kind.
+	"""
+	observations = [ ( decodeKey( key ).kind(), encoded in cacheRes ) for key, encoded in zip( keys, encodedKeys ) ]
+	with _cacheStatsLock:
+		for kindName, isHit in observations:
+			stats = _cacheStats.get( kindName )
+			if stats is None:
+				stats = _cacheStats[ kindName ] = [ 0, 0 ]
+			elif stats[0]+stats[1] >= conf["viur.db.adaptiveFetch.window"]:
+				# Let older observations fade out, so we adapt if a kind becomes (un)popular
+				stats[0] //= 2
+				stats[1] //= 2
+			stats[ 0 if isHit else 1 ] += 1
+
+
+def _preferKeysOnly( kindName ):
+	"""
+		Decides whether a query on *kindName* should fetch keys only and resolve them by Get()
+		(saving datastore reads if most entities are in memcache) or fetch entire entities directly
+		(saving a round trip if they are not).
+
+		Entities fetched directly are read from the (eventually consistent) query results, whereas
+		Get() reads them strongly consistent; kinds listed in conf["viur.db.adaptiveFetch.excludeKinds"]
+		therefore always fetch keys only.
+	"""
+	if kindName in conf["viur.db.adaptiveFetch.excludeKinds"]:
+		return( True )
+	with _cacheStatsLock:
+		hits, misses = _cacheStats.get( kindName, ( 0, 0 ) )
+	if hits+misses < conf["viur.db.adaptiveFetch.minSamples"]:
+		return( True )
+	if hits >= ( hits+misses )*conf["viur.db.adaptiveFetch.minHitRatio"]:
+		return( True )
+	# Still probe the cache now and then, so we notice if the hit rate rises again
+	return( random.random() < conf["viur.db.adaptiveFetch.probeRate"] )
+
+
+def getCacheStats():
+	"""
+		Returns the memcache hit rates observed on this instance, which decide the fetch strategy
+		of :func:`server.db.Query.run`.
+
+		:returns: Mapping of kind -> dict with the number of "hits" and "misses", the "hitRatio" and\
+		whether queries currently fetch keys only ("keysOnly")
+		:rtype: dict
+	"""
+	res = {}
+	with _cacheStatsLock:
+		stats = [ ( kindName, hits, misses ) for kindName, ( hits, misses ) in _cacheStats.items() ]
+	for kindName, hits, misses in stats:
+		total = hits+misses
+		res[ kindName ] = {
+			"hits": hits,
+			"misses": misses,
+			"hitRatio": float( hits )/total if total else None,
+			"keysOnly": kindName in conf["viur.db.adaptiveFetch.excludeKinds"]
+			            or total < conf["viur.db.adaptiveFetch.minSamples"]
+			            or hits >= total*conf["viur.db.adaptiveFetch.minHitRatio"]
+		}
+	return( res )
+
+
+_keyCache = OrderedDict() # Mapping urlsafe string -> Key, least recently used first
+_keyCacheLock = Lock() # Guards _keyCache, which is shared by all threads
+
+
+def _rememberKey( encoded, key ):
+	with _keyCacheLock:
+		_keyCache.pop( encoded, None )
+		_keyCache[ encoded ] = key
+		while len( _keyCache ) > conf["viur.db.keyCacheSize"]:
+			_keyCache.popitem( last=False )
+
+
+def decodeKey( encoded ):
+	"""
+		Returns the :class:`server.db.Key` for its urlsafe string *encoded*.
+
+		Recently used keys are kept in a bounded LRU (sized by conf["viur.db.keyCacheSize"]), so decoding
+		the same string again returns the same instance, whose string representation is already known.
+
+		:type encoded: str | unicode
+		:rtype: server.db.Key
+		:raises: :exc:`BadKeyError` if *encoded* is not a valid key
+	"""
+	if isinstance( encoded, datastore_types.Key ):
+		return( encoded )
+	if not isinstance( encoded, basestring ):
+		return( datastore_types.Key( encoded=encoded ) )
+	with _keyCacheLock:
+		key = _keyCache.pop( encoded, None )
+		if key is not None:
+			_keyCache[ encoded ] = key # Mark as most recently used
+			return( key )
+	key = datastore_types.Key( encoded=encoded )
+	_rememberKey( encoded, key )
+	return( key )
+
+
+def encodeKey( key ):
+	"""
+		Returns the urlsafe string of *key*, remembering that key for :func:`decodeKey`.
+
+		:type key: server.db.Key | str
+		:rtype: str
+	"""
+	if isinstance( key, basestring ):
+		return( key )
+	encoded = str( key )
+	_rememberKey( encoded, key )
+	return( encoded )
 
 
 def PutAsync( entities, **kwargs ):
@@ -33,7 +153,7 @@ def PutAsync( entities, **kwargs ):
 	"""
 	if isinstance( entities, Entity ):
 		entities._fixUnindexedProperties()
-	elif isinstance( entities, List ):
+	elif isinstance( entities, list ):
 		for entity in entities:
 			assert isinstance( entity, Entity )
 			entity._fixUnindexedProperties()
@@ -44,8 +164,8 @@ def PutAsync( entities, **kwargs ):
 		elif isinstance( entities, list ):
 			for entity in entities:
 				assert isinstance( entity, Entity )
-				if entity.is_saved(): #Its an update
-					memcache.delete( str( entity.key() ), namespace=__CacheKeyPrefix__, seconds=__cacheLockTime__  )
+			memcache.delete_multi( [ str( entity.key() ) for entity in entities if entity.is_saved() ],
+			                       namespace=__CacheKeyPrefix__, seconds=__cacheLockTime__ )
 	return( datastore.PutAsync( entities, **kwargs ) )
 
 def Put( entities, **kwargs ):
@@ -82,8 +202,8 @@ def Put( entities, **kwargs ):
 		elif isinstance( entities, list ):
 			for entity in entities:
 				assert isinstance( entity, Entity )
-				if entity.is_saved(): #Its an update
-					memcache.delete( str( entity.key() ), namespace=__CacheKeyPrefix__, seconds=__cacheLockTime__  )
+			memcache.delete_multi( [ str( entity.key() ) for entity in entities if entity.is_saved() ],
+			                       namespace=__CacheKeyPrefix__, seconds=__cacheLockTime__ )
 	return( datastore.Put( entities, **kwargs ) )
 
 def GetAsync( keys, **kwargs ):
@@ -152,13 +272,15 @@ def Get( keys, **kwargs ):
 			#Check Memcache first
 			cacheRes = {}
 			tmpRes = []
-			keyList = [ str(x) for x in keys ]
+			encodedKeys = [ encodeKey( x ) for x in keys ]
+			keyList = encodedKeys[:]
 			while keyList: #Fetch in Batches of 30 entries, as the max size for bulk_get is limited to 32MB
 				currentBatch = keyList[:__MemCacheBatchSize__]
 				keyList = keyList[__MemCacheBatchSize__:]
 				cacheRes.update( memcache.get_multi( currentBatch, namespace=__CacheKeyPrefix__) )
+			_recordCacheStats( keys, encodedKeys, cacheRes )
 			#Fetch the rest from DB
-			missigKeys = [ x for x in keys if not str(x) in cacheRes ]
+			missigKeys = [ x for x, encoded in zip( keys, encodedKeys ) if not encoded in cacheRes ]
 			dbRes = [ Entity.FromDatastoreEntity(x) for x in datastore.Get( missigKeys ) if x is not None ]
 			# Cache what we had fetched
 			saveIdx = 0
@@ -169,19 +291,17 @@ def Get( keys, **kwargs ):
 				except:
 					pass
 				saveIdx += 1
-			for key in [ str(x) for x in keys ]:
+			dbResMap = { encodeKey( e.key() ): e for e in dbRes }
+			for key in encodedKeys:
 				if key in cacheRes:
 					tmpRes.append( cacheRes[ key ] )
-				else:
-					for e in dbRes:
-						if str( e.key() ) == key:
-							tmpRes.append ( e )
-							break
+				elif key in dbResMap:
+					tmpRes.append( dbResMap[ key ] )
 			if conf["viur.debug.traceQueries"]:
 				logging.debug( "Fetched a result-set from Datastore: %s total, %s from cache, %s from datastore" % (len(tmpRes),len( cacheRes.keys()), len( dbRes ) ) )
 			return( tmpRes )
 	if isinstance( keys, list ):
-		return( [ Entity.FromDatastoreEntity(x) for x in datastore.Get( keys, **kwargs ) ] )
+		return( [ Entity.FromDatastoreEntity(x) if x is not None else None for x in datastore.Get( keys, **kwargs ) ] )
 	else:
 		return( Entity.FromDatastoreEntity( datastore.Get( keys, **kwargs ) ) )
 
@@ -219,7 +339,7 @@ def GetOrInsert( key, kindName=None, parent=None, **kwargs ):
 
 	if not isinstance( key, datastore_types.Key ):
 		try:
-			key = datastore_types.Key( encoded=key )
+			key = decodeKey( key )
 		except:
 			assert kindName
 			key = datastore_types.Key.from_path( kindName, key, parent=parent )
@@ -242,7 +362,7 @@ def DeleteAsync(keys, **kwargs):
 		elif isinstance( keys, list ):
 			for key in keys:
 				assert isinstance( key, datastore_types.Key ) or isinstance( key, basestring )
-				memcache.delete( str( key ), namespace=__CacheKeyPrefix__, seconds=__cacheLockTime__  )
+			memcache.delete_multi( [ str( key ) for key in keys ], namespace=__CacheKeyPrefix__, seconds=__cacheLockTime__ )
 	return( datastore.DeleteAsync( keys, **kwargs ) )
 
 def Delete(keys, **kwargs):
@@ -270,10 +390,80 @@ def Delete(keys, **kwargs):
 		elif isinstance( keys, list ):
 			for key in keys:
 				assert isinstance( key, datastore_types.Key ) or isinstance( key, basestring )
-				memcache.delete( str( key ), namespace=__CacheKeyPrefix__, seconds=__cacheLockTime__  )
+			memcache.delete_multi( [ str( key ) for key in keys ], namespace=__CacheKeyPrefix__, seconds=__cacheLockTime__ )
 	return( datastore.Delete( keys, **kwargs ) )
 
 
+class FilterPlan( object ):
+	"""
+		Precomputed information on which bones of a skeleton have to be consulted by
+		:func:`server.db.Query.mergeExternalFilter`.
+
+		The bones shipped with ViUR only react on filter keys targeting their own name
+		(like *name*, *name$lt* or *name.lang*) and on orderings by such a key.
+		Only these bones (and bones with custom buildDBFilter/buildDBSort implementations, which
+		are always called) are run for a given set of filters, in the same order as before.
+	"""
+	_cache = {}  # (skelCls, boneNames) -> FilterPlan
+
+	def __init__(self, skel):
+		from server.bones import relationalBone
+		self.nonRelational = []  # List of (bone, boneName, alwaysFilter, alwaysSort)
+		self.relational = []
+		for key, bone in skel.items():
+			entry = (bone, key, not self._isBuiltin(bone, "buildDBFilter"), not self._isBuiltin(bone, "buildDBSort"))
+			if isinstance(bone, relationalBone):
+				self.relational.append(entry)
+			else:
+				self.nonRelational.append(entry)
+
+	@staticmethod
+	def _isBuiltin(bone, funcName):
+		if funcName in bone.__dict__:
+			return False
+		return getattr(type(bone), funcName).__module__.startswith("server.bones.")
+
+	@staticmethod
+	def getBoneName(filterKey):
+		"""
+			Returns the name of the bone a filter key like *name$lt* or *name.lang* targets.
+		"""
+		return filterKey.split("$", 1)[0].split(".", 1)[0]
+
+	@classmethod
+	def forSkel(cls, skel):
+		"""
+			Returns the plan for the given skeleton instance.
+
+			Plans are cached per skeleton class and set of bones, except for cloned skeletons
+			as their bones might have been modified.
+		"""
+		if skel.isClonedInstance:
+			return cls(skel)
+		cacheKey = (type(skel), tuple(skel.keys()))
+		if cacheKey not in cls._cache:
+			cls._cache[cacheKey] = cls(skel)
+		return cls._cache[cacheKey]
+
+	def apply(self, query, skel, filters):
+		"""
+			Lets the relevant bones write their filters and orderings into *query*.
+
+			:raises: :exc:`RuntimeError` if a bone considers the query invalid.
+		"""
+		filterNames = set([self.getBoneName(x) for x in filters.keys() if isinstance(x, basestring)])
+		orderby = filters.get("orderby")
+		sortName = self.getBoneName(orderby) if isinstance(orderby, basestring) else None
+		for boneList in (self.nonRelational, self.relational):
+			#First filter, then process the orderings
+			for bone, key, alwaysFilter, alwaysSort in boneList:
+				if alwaysFilter or key in filterNames:
+					bone.buildDBFilter(key, skel, query, filters)
+			for bone, key, alwaysFilter, alwaysSort in boneList:
+				if alwaysSort or key == sortName:
+					bone.buildDBSort(key, skel, query, filters)
+
+
 class Query( object ):
 	"""
 		Thin wrapper around datastore.Query to provide a consistent
@@ -349,7 +539,6 @@ class Query( object ):
 			:returns: Returns the query itself for chaining.
 			:rtype: server.db.Query
 		"""
-		from server.bones import baseBone, relationalBone
 		if "id" in filters:
 			self.datastoreQuery = None
 			logging.error("Filtering by id is no longer supported. Use key instead.")
@@ -361,14 +550,14 @@ class Query( object ):
 		skel = self.srcSkel
 		if skel.searchIndex and "search" in filters: #We perform a Search via Google API - all other parameters are ignored
 			try:
-				searchRes = search.Index( name=skel.searchIndex ).search( query=search.Query( query_string=filters["search"], options=search.QueryOptions( limit=25 ) ) )
+				searchRes = searchQueue.getIndex( skel.searchIndex ).search( query=search.Query( query_string=filters["search"], options=search.QueryOptions( limit=25 ) ) )
 			except search.QueryError: #We cant parse the query, treat it as verbatim
 				qstr = u"\"%s\"" % filters["search"].replace(u"\"",u"")
 				try:
-					searchRes = search.Index(name=skel.searchIndex).search(query=search.Query(query_string=qstr, options=search.QueryOptions(limit=25)))
+					searchRes = searchQueue.getIndex(skel.searchIndex).search(query=search.Query(query_string=qstr, options=search.QueryOptions(limit=25)))
 				except search.QueryError:  # Still cant parse it
 					searchRes = []
-			tmpRes = [ datastore_types.Key( encoded=x.doc_id[ 2: ] ) for x in searchRes ]
+			tmpRes = [ decodeKey( x.doc_id[ 2: ] ) for x in searchRes ]
 			if tmpRes:
 				filters = []
 				for x in tmpRes:
@@ -377,40 +566,18 @@ class Query( object ):
 			else:
 				self.datastoreQuery = None
 			return( self )
-		#bones = [ (getattr( skel, key ), key) for key in dir( skel ) if not "__" in key and isinstance( getattr( skel, key ) , baseBone ) ]
-		bones = [ (y,x) for x,y in skel.items() ]
 		try:
-			#First, filter non-relational bones
-			for bone, key in [ x for x in bones if not isinstance( x[0], relationalBone ) ]:
-				bone.buildDBFilter( key, skel, self, filters )
-			#Second, process orderings of non-relational bones
-			for bone, key in [ x for x in bones if not isinstance( x[0], relationalBone ) ]:
-				bone.buildDBSort( key, skel, self, filters )
-			#Now filter relational bones
-			for bone, key in [ x for x in bones if isinstance( x[0], relationalBone ) ]:
-				bone.buildDBFilter( key, skel, self, filters )
-			#finally process orderings of relational bones
-			for bone, key in [ x for x in bones if isinstance( x[0], relationalBone ) ]:
-				bone.buildDBSort( key, skel, self, filters )
+			#Non-relational bones first, then relational ones; only bones targeted by filters are run
+			FilterPlan.forSkel( skel ).apply( self, skel, filters )
 		except RuntimeError as e:
 			logging.exception(e)
 			self.datastoreQuery = None
 			return( self )
-		if "search" in filters and filters["search"]:
-			if isinstance( filters["search"], list ):
-				taglist = [ "".join([y for y in unicode(x).lower() if y in conf["viur.searchValidChars"] ] ) for x in filters["search"] ]
+		if "search" in filters and filters["search"] and self.datastoreQuery is not None:
+			if conf["viur.fulltext.enabled"] and self.getKind() == self.origKind:
+				self._mergeFulltextSearch( filters["search"] )
 			else:
-				taglist = [ "".join([y for y in unicode(x).lower() if y in conf["viur.searchValidChars"] ]) for x in unicode(filters["search"]).split(" ")]
-			assert not isinstance( self.datastoreQuery, datastore.MultiQuery ), "Searching using viur-tags is not possible on a query that already uses an IN-filter!"
-			origFilter = self.datastoreQuery
-			queries = []
-			for tag in taglist[:30]: #Limit to max 30 keywords
-				q = datastore.Query( kind=origFilter.__kind )
-				q[ "viur_tags" ] = tag
-				queries.append( q )
-			self.datastoreQuery = datastore.MultiQuery( queries, origFilter.__orderings )
-			for k, v in origFilter.items():
-				self.datastoreQuery[ k ] = v
+				self._mergeTagSearch( filters["search"] )
 		if "cursor" in filters and filters["cursor"] and filters["cursor"].lower()!="none":
 			self.cursor( filters["cursor"] )
 		if "amount" in filters and str(filters["amount"]).isdigit() and int( filters["amount"] ) >0 and int( filters["amount"] ) <= 100:
@@ -419,6 +586,67 @@ class Query( object ):
 			skel.postProcessSearchFilter( self, filters )
 		return( self )
 
+	def _mergeTagSearch(self, search):
+		"""
+			Restricts this query to entities having any of the words in *search* in their viur_tags.
+		"""
+		if isinstance( search, list ):
+			taglist = [ "".join([y for y in unicode(x).lower() if y in conf["viur.searchValidChars"] ] ) for x in search ]
+		else:
+			taglist = [ "".join([y for y in unicode(x).lower() if y in conf["viur.searchValidChars"] ]) for x in unicode(search).split(" ")]
+		assert not isinstance( self.datastoreQuery, datastore.MultiQuery ), "Searching using viur-tags is not possible on a query that already uses an IN-filter!"
+		origFilter = self.datastoreQuery
+		queries = []
+		for tag in taglist[:30]: #Limit to max 30 keywords
+			q = datastore.Query( kind=origFilter.__kind )
+			q[ "viur_tags" ] = tag
+			queries.append( q )
+		self.datastoreQuery = datastore.MultiQuery( queries, origFilter.__orderings )
+		for k, v in origFilter.items():
+			self.datastoreQuery[ k ] = v
+
+	def _mergeFulltextSearch(self, search):
+		"""
+			Restricts this query to the entities found by :func:`server.fulltext.search` for *search*.
+
+			The matching keys are combined with the filters already set on this query; the results are
+			returned in the order of their ranking.
+		"""
+		from server import fulltext
+		kind = self.getKind()
+		if isinstance( self.datastoreQuery, datastore.MultiQuery ):
+			baseFilters = [ qry.items() for qry in getattr(self.datastoreQuery, "_MultiQuery__bound_queries") ]
+		else:
+			baseFilters = [ self.datastoreQuery.items() ]
+		# A MultiQuery consists of at most 30 queries
+		keys = fulltext.search( kind, search, limit=max( 1, 30 // len( baseFilters ) ) )
+		if not keys:
+			self.datastoreQuery = None
+			return
+		queries = []
+		for key in keys:
+			for items in baseFilters:
+				qry = datastore.Query( kind=kind )
+				for k, v in items:
+					qry[ k ] = v
+				qry[ "%s =" % datastore_types.KEY_SPECIAL_PROPERTY ] = datastore_types.Key( key )
+				queries.append( qry )
+		self.datastoreQuery = MultiQuery( queries, () )
+		self.setKind( kind )
+		ranking = dict( (key, idx) for idx, key in enumerate( keys ) )
+		self._customMultiQueryMerge = lambda dbFilter, result, targetAmount: self._fulltextMultiQueryMerge( ranking, result, targetAmount )
+
+	def _fulltextMultiQueryMerge(self, ranking, result, targetAmount):
+		"""
+			Merges the results of the queries built by :func:`_mergeFulltextSearch` by their ranking.
+		"""
+		res = {}
+		for qryRes in result:
+			for entry in qryRes:
+				key = entry if isinstance( entry, datastore_types.Key ) else entry.key()
+				res[ str( key ) ] = entry
+		return( [ res[ key ] for key in sorted( res.keys(), key=ranking.get ) ][ :targetAmount ] )
+
 	def filter(self, filter, value=__undefinedC__ ):
 		"""
 			Adds a filter to this query. #fixme: Better description required here...
@@ -457,7 +685,7 @@ class Query( object ):
 			filter, value = r
 
 		# Cast keys into string
-		if filter != datastore_types.KEY_SPECIAL_PROPERTY and isinstance(value, datastore_types.Key):
+		if filter.split(" ")[0] != datastore_types.KEY_SPECIAL_PROPERTY and isinstance(value, datastore_types.Key):
 			value = str(value)
 
 		if value!=None and (filter.endswith(" !=") or filter.lower().endswith(" in")):
@@ -762,6 +990,10 @@ class Query( object ):
 			If queried data is wanted as instances of Skeletons, :func:`server.db.Query.fetch`
 			should be used.
 
+			:warning: On kinds rarely served from memcache, entities are taken from the query results,\
+			which are only eventually consistent (see :func:`getCacheStats`). List kinds which must be\
+			read strongly consistent in conf["viur.db.adaptiveFetch.excludeKinds"].
+
 			:param limit: Limits the query to the defined maximum entities.
 			:type limit: int
 
@@ -789,6 +1021,10 @@ class Query( object ):
 		if conf["viur.db.caching" ]<2:
 			# Query-Caching is disabled, make this query keys-only if (and only if) explicitly requested for this query
 			internalKeysOnly = keysOnly
+		elif internalKeysOnly and not keysOnly and self.getKind()==self.origKind:
+			# Resolving keys by Get() only pays off if memcache can serve most of them (and never inside
+			# transactions, where Get() bypasses memcache)
+			internalKeysOnly = not datastore.IsInTransaction() and _preferKeysOnly( self.origKind )
 		if self._customMultiQueryMerge:
 			# We do a really dirty trick here: Running the queries in our MultiQuery by hand, as
 			# we don't want the default sort&merge functionality from :class:`google.appengine.api.datastore.MultiQuery`
@@ -831,7 +1067,7 @@ class Query( object ):
 				res = [ x.parent() for x in res ]
 			return( Get( res ) )
 
-	def fetch(self, limit=-1, **kwargs ):
+	def fetch(self, limit=-1, columnar=False, **kwargs ):
 		"""
 			Run this query and fetch results as :class:`server.skeleton.SkelList`.
 
@@ -847,6 +1083,13 @@ class Query( object ):
 			A maxiumum value of 99 entries can be fetched at once.
 			:type limit: int
 
+			:param columnar: Return a :class:`server.skeleton.ColumnarSkelList`, which stores its values\
+			per bone and needs less memory for result sets with repeating values. Each entity is still\
+			unserialized into a values-cache first, which is moved into the columns before the next\
+			entity is read; so only the memory held by the list itself is reduced, not the cost of\
+			unserializing.
+			:type columnar: bool
+
 			:raises: :exc:`BadFilterError` if a filter string is invalid
 			:raises: :exc:`BadValueError` if a filter value is invalid.
 			:raises: :exc:`BadQueryError` if an IN filter in combination with a sort order on\
@@ -857,8 +1100,11 @@ class Query( object ):
 		amount = limit if limit!=-1 else self.amount
 		if amount < 1 or amount > 100:
 			raise NotImplementedError("This query is not limited! You must specify an upper bound using limit() between 1 and 100")
-		from server.skeleton import SkelList
-		res = SkelList( self.srcSkel )
+		from server.skeleton import SkelList, ColumnarSkelList
+		if columnar:
+			res = ColumnarSkelList( self.srcSkel )
+		else:
+			res = SkelList( self.srcSkel )
 		dbRes = self.run( amount )
 		res.customQueryInfo = self.customQueryInfo
 		if dbRes is None:
@@ -928,6 +1174,39 @@ class Query( object ):
 						self.datastoreQuery = q.datastoreQuery
 						lastCursor = None
 
+	def iterSkel(self, limit=-1):
+		"""
+			Run this query and yield its results one by one as :class:`server.skeleton.Skeleton`.
+
+			Unlike :func:`server.db.Query.fetch`, the results aren't kept in memory, which makes this
+			function suitable for exports, feeds or sitemaps covering many entities.
+			As with :func:`server.db.Query.iter`, there's no caching and no upper bound for *limit*.
+
+			:warning: The same skeleton instance is yielded for each result. Its values are replaced\
+			in each step, so copy whatever you need to keep.
+
+			:param limit: Stop after that many results, -1 means no limit.
+			:type limit: int
+		"""
+		if self.srcSkel is None:
+			raise NotImplementedError("This query has not been created using skel.all()")
+		if self.datastoreQuery is None:
+			return
+		count = 0
+		for e in self.iter():
+			if limit != -1 and count >= limit:
+				return
+			if e.key().kind() != self.origKind and e.key().parent().kind() == self.origKind:
+				#Fixing the kind - it has been changed (probably by quering an relation)
+				try:
+					e = Get( e.key().parent() )
+				except datastore_errors.EntityNotFoundError:
+					continue
+			self.srcSkel.setValuesCache({})
+			self.srcSkel.setValues(e)
+			count += 1
+			yield self.srcSkel
+
 	def get( self ):
 		"""
 			Returns only the first entity of the current query.
@@ -1114,8 +1393,9 @@ class Entity( datastore.Entity ):
 			Required, as ``datastore.Get()`` always returns a datastore.Entity
 			(and it seems that currently there is no valid way to change that).
 		"""
-		res = Entity(	entity.kind(), parent=entity.key().parent(), _app=entity.key().app(),
-				name=entity.key().name(), id=entity.key().id(),
+		key = entity.key()
+		res = Entity(	entity.kind(), parent=key.parent(), _app=key.app(),
+				name=key.name(), id=key.id(),
 				unindexed_properties=entity.unindexed_properties(),
 				namespace=entity.namespace() )
 		res.update( entity )
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+from server import db
+from server.config import conf
+from server.tasks import callDeferred, PeriodicTask
+from time import time
+import logging, random, uuid
+
+"""
+	Facet counts: how many entities of a kind have each value of a facetable bone.
+
+	Bones become facetable by setting facet=True (selectBone, selectCountryBone, booleanBone) or by
+	defining facetBuckets (numericBone). Counts are kept globally and, for each bone listed in the
+	facetScopes of the skeleton, per value of that bone (like a category), so a page listing one
+	category can show the counts within that category.
+
+	Each entity remembers the facets it has been counted for in its viur_facets property. Saving
+	or deleting it enqueues (transactionally) a task applying the difference to the counters, which
+	are spread over conf["viur.facets.shards"] entities each to allow concurrent updates.
+"""
+
+__countKind__ = "viur-facet-counts"
+__appliedKind__ = "viur-facet-applied"  # Markers of the batches of a change-set already applied
+__maxTransactionSize__ = 24  # Counters updated in one cross-group transaction
+
+
+def _facetKey(scope, boneName, value):
+	return u"%s|%s|%s" % (scope, boneName, value)
+
+
+def _counterName(kindName, facetKey, shard):
+	return u"%s|%s|%s" % (kindName, facetKey, shard)
+
+
+def getFacetKeys(skel):
+	"""
+		Returns the facets *skel* has to be counted for.
+
+		:type skel: server.skeleton.Skeleton
+		:rtype: set of unicode
+	"""
+	res = set()
+	facetValues = {}
+	facetBones = []
+	for boneName, bone in skel.items():
+		if getattr(bone, "facet", False):
+			facetBones.append(boneName)
+		if getattr(bone, "facet", False) or boneName in skel.facetScopes:
+			facetValues[boneName] = bone.getFacetValues(skel.valuesCache, boneName)
+	for boneName in facetBones:
+		for value in facetValues[boneName]:
+			res.add(_facetKey(u"", boneName, value))
+			for scopeName in skel.facetScopes:
+				if scopeName == boneName:
+					continue
+				for scopeValue in facetValues.get(scopeName, []):
+					res.add(_facetKey(u"%s=%s" % (scopeName, scopeValue), boneName, value))
+	return res
+
+
+def updateFacets(skel, dbObj):
+	"""
+		Stores the facets of *skel* in *dbObj* and enqueues updating the counters if they changed.
+		Must be called inside the transaction writing *dbObj*.
+
+		:type skel: server.skeleton.Skeleton
+		:type dbObj: server.db.Entity
+	"""
+	oldKeys = set(dbObj.get("viur_facets") or [])
+	newKeys = getFacetKeys(skel)
+	if oldKeys == newKeys:
+		return
+	dbObj.set("viur_facets", sorted(newKeys), False)
+	changes = dict((facetKey, -1) for facetKey in oldKeys - newKeys)
+	changes.update(dict((facetKey, 1) for facetKey in newKeys - oldKeys))
+	updateCounts(skel.kindName, changes, uuid.uuid4().hex, _transactional=True)
+
+
+def removeFacets(kindName, dbObj):
+	"""
+		Enqueues removing the entity *dbObj* from the counters. Must be called inside the
+		transaction deleting it.
+	"""
+	if dbObj.get("viur_facets"):
+		updateCounts(kindName, dict((facetKey, -1) for facetKey in dbObj["viur_facets"]), uuid.uuid4().hex,
+		             _transactional=True)
+
+
+def _applyCounts(kindName, changes, markerName):
+	try:
+		db.Get(db.Key.from_path(__appliedKind__, markerName))
+		return  # This batch has already been applied
+	except db.EntityNotFoundError:
+		pass
+	keys = [db.Key.from_path(__countKind__, _counterName(kindName, facetKey, random.randrange(conf["viur.facets.shards"])))
+	        for facetKey in changes.keys()]
+	existing = dict((e.key().name(), e) for e in db.Get(keys) if e)
+	toPut = []
+	for key, (facetKey, delta) in zip(keys, changes.items()):
+		dbObj = existing.get(key.name())
+		if dbObj is None:
+			dbObj = db.Entity(__countKind__, name=key.name())
+			dbObj["count"] = 0
+		dbObj["kind"] = kindName
+		dbObj["count"] += delta
+		toPut.append(dbObj)
+	marker = db.Entity(__appliedKind__, name=markerName)
+	marker["date"] = time()
+	toPut.append(marker)
+	db.Put(toPut)
+
+
+@callDeferred
+def updateCounts(kindName, changes, changeSetId=None, attempt=0):
+	"""
+		Adds *changes* (a dict of facet -> delta) to the counters of *kindName*.
+
+		Each batch writes a marker named after *changeSetId* inside its transaction, so batches
+		which have already been applied (including commits reported as failed) are skipped if this
+		change-set is run again, either by us or by the task queue delivering this task twice.
+		Markers are kept for conf["viur.facets.markerLifeTime"] seconds (see :func:`purgeMarkers`).
+		Failing change-sets are re-enqueued with an exponential backoff until conf["viur.facets.maxAttempts"]
+		is reached.
+	"""
+	if changeSetId is None:
+		changeSetId = uuid.uuid4().hex
+	facetKeys = sorted(changes.keys())
+	for idx in range(0, len(facetKeys), __maxTransactionSize__):
+		markerName = u"%s/%s" % (changeSetId, idx // __maxTransactionSize__)
+		try:
+			db.RunInTransactionOptions(db.TransactionOptions(xg=True), _applyCounts, kindName,
+			                           dict((facetKey, changes[facetKey]) for facetKey in facetKeys[idx:idx + __maxTransactionSize__]),
+			                           markerName)
+		except Exception as e:
+			logging.exception(e)
+			if attempt + 1 >= conf["viur.facets.maxAttempts"]:
+				logging.error("Giving up updating the facet counts of %s (change-set %s) after %s attempts" % (kindName, changeSetId, attempt + 1))
+				return
+			updateCounts(kindName, changes, changeSetId, attempt + 1, _countdown=10 * 2 ** attempt)
+			return
+
+
+@PeriodicTask(60*4)
+def purgeMarkers():
+	"""
+		Removes the markers of applied change-sets older than conf["viur.facets.markerLifeTime"].
+	"""
+	doPurgeMarkers(time() - conf["viur.facets.markerLifeTime"], None)
+
+
+@callDeferred
+def doPurgeMarkers(olderThan, cursor):
+	query = db.Query(__appliedKind__).filter("date <", olderThan)
+	if cursor:
+		query.cursor(cursor)
+	keys = list(query.run(100, keysOnly=True))
+	if keys:
+		db.Delete(keys)
+	newCursor = query.getCursor()
+	if keys and newCursor and newCursor.urlsafe() != cursor:
+		doPurgeMarkers(olderThan, newCursor.urlsafe())
+
+
+def getFacetCounts(skel, filters=None, boneNames=None):
+	"""
+		Returns the facet counts for all entities of *skel* matching *filters*, using one multi-get.
+
+		:param skel: The skeleton (or skeleton class) to count for
+		:type skel: server.skeleton.Skeleton
+		:param filters: Either empty (count all entities) or a single bone listed in facetScopes\
+		mapped to one of its values, like {"category": key}
+		:type filters: dict
+		:param boneNames: Return the counts of these facetable bones only (defaults to all)
+		:type boneNames: list of str
+		:returns: Mapping of each bone to a dict of value -> count; values without entities are omitted
+		:rtype: dict
+		:raises: :exc:`ValueError` if *filters* cannot be answered by the maintained counters
+	"""
+	if isinstance(skel, type):
+		skel = skel()
+	filters = dict(filters or {})
+	if not filters:
+		scope = u""
+	elif len(filters) == 1 and filters.keys()[0] in skel.facetScopes:
+		scopeName, scopeValue = filters.items()[0]
+		scope = u"%s=%s" % (scopeName, scopeValue)
+	else:
+		raise ValueError("Facets can only be counted for one of %s" % (skel.facetScopes,))
+	facetKeys = []
+	for boneName, bone in skel.items():
+		if not getattr(bone, "facet", False) or (boneNames is not None and boneName not in boneNames):
+			continue
+		for value in bone.getFacetCandidates():
+			facetKeys.append((boneName, value, _facetKey(scope, boneName, value)))
+	keys = [db.Key.from_path(__countKind__, _counterName(skel.kindName, facetKey, shard))
+	        for (boneName, value, facetKey) in facetKeys for shard in range(conf["viur.facets.shards"])]
+	counts = {}
+	while keys:  # The datastore returns at most 1000 entities per multi-get
+		for dbObj in db.Get(keys[:1000]):
+			if dbObj:
+				facetKey = dbObj.key().name()[len(skel.kindName) + 1:dbObj.key().name().rfind("|")]
+				counts[facetKey] = counts.get(facetKey, 0) + dbObj["count"]
+		keys = keys[1000:]
+	res = {}
+	for boneName, value, facetKey in facetKeys:
+		if counts.get(facetKey, 0) > 0:
+			res.setdefault(boneName, {})[value] = counts[facetKey]
+	return res
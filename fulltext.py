@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+from server import db, postSave
+from server.config import conf
+from server.tasks import callDeferred
+from google.appengine.api import datastore
+from collections import Counter
+from math import log
+import json, logging
+
+"""
+	Datastore-backed fulltext-search for skeletons without a searchIndex.
+
+	Each indexed entity gets one document entity, holding its terms (prefixed by its kind) in the
+	indexed list property "terms" and the frequency of each term (used for ranking) in an unindexed
+	property. Searches are answered by equality filters on "terms", which the datastore merges using
+	its built-in indexes; prefixes (words ending with an asterisk) use a range-filter on that property.
+	As every document is stored in its own entity, saving an entity never touches the documents of
+	others.
+
+	The index is fed by the getSearchTags functions of the searchable bones and updated in a deferred
+	task whenever an entity is written (as a stage of :mod:`server.postSave`) or deleted by its skeleton.
+	It's only used (and updated) if conf["viur.fulltext.enabled"] is set; existing entities have to be
+	rebuilt after enabling it.
+"""
+
+__documentsKind__ = "viur-fulltext-docs"
+__maxTermLength__ = 100  # Longer terms aren't indexed
+__maxTerms__ = 5000  # Terms indexed per document (the most frequent ones), keeping it within the index-entry limit
+
+
+def tokenize(value, minLength=1):
+	"""
+		Splits *value* into lowercase terms, dropping all characters not in conf["viur.searchValidChars"].
+
+		:param value: The text to split
+		:param minLength: Terms shorter than this are omitted
+		:type minLength: int
+		:returns: The terms in order of their occurrence, including duplicates
+		:rtype: list of unicode
+	"""
+	validChars = conf["viur.searchValidChars"]
+	res = []
+	for word in unicode(value).lower().split():
+		word = "".join([c for c in word if c in validChars])
+		if len(word) >= minLength:
+			res.append(word)
+	return res
+
+
+def getSearchTerms(skel):
+	"""
+		Collects the terms of all searchable bones of *skel*.
+
+		:type skel: server.skeleton.Skeleton
+		:returns: Mapping of each term to its frequency in *skel*
+		:rtype: collections.Counter
+	"""
+	res = Counter()
+	for boneName, bone in skel.items():
+		if bone.searchable:
+			res.update(tag for tag in bone.getSearchTags(skel.valuesCache, boneName) if len(tag) < 400)
+	return res
+
+
+def _getTerm(kindName, term):
+	return u"%s/%s" % (kindName, term)
+
+
+@callDeferred
+def updateDocument(kindName, key):
+	"""
+		Brings the index in sync with the entity *key*, which is read from the datastore again.
+		If it doesn't exist anymore, it's removed from the index.
+
+		:param kindName: The kind of that entity
+		:type kindName: str
+		:param key: The key of the entity that has been written or deleted
+		:type key: str
+	"""
+	_updateDocument(kindName, key)
+
+
+def _updateDocument(kindName, key):
+	from server.skeleton import skeletonByKind
+	skelCls = skeletonByKind(kindName)
+	if skelCls is None or skelCls.searchIndex:
+		return
+	db.RunInTransactionOptions(db.TransactionOptions(xg=True), _updateDocumentTxn, skelCls, kindName, str(key))
+
+
+def _updateDocumentTxn(skelCls, kindName, key):
+	"""
+		Reads the entity *key* and its document and writes the document if its terms changed.
+		Runs inside a transaction, so concurrent updates of the same entity can't leave stale terms behind.
+	"""
+	newTerms = {}
+	skel = skelCls()
+	if skel.fromDB(key):
+		newTerms = dict((term, frequency) for term, frequency in getSearchTerms(skel).most_common(__maxTerms__)
+		                if len(term) <= __maxTermLength__)
+	try:
+		docObj = db.Get(db.Key.from_path(__documentsKind__, key))
+	except db.EntityNotFoundError:
+		docObj = None
+	if docObj is not None and docObj.get("frequencies") and json.loads(docObj["frequencies"]) == newTerms:
+		return  # Unchanged
+	if newTerms:
+		docObj = db.Entity(__documentsKind__, name=key)
+		docObj["kind"] = kindName
+		docObj["terms"] = [_getTerm(kindName, term) for term in sorted(newTerms.keys())]
+		docObj["frequencies"] = json.dumps(newTerms, separators=(",", ":"))
+		docObj.set_unindexed_properties(["frequencies"])
+		db.Put(docObj)
+	elif docObj is not None:
+		db.Delete(docObj.key())
+
+
+def _updateAfterSave(kindName, key, changedBones, clearUpdateTag):
+	if conf["viur.fulltext.enabled"]:
+		_updateDocument(kindName, key)
+
+postSave.registerStage("fulltext", _updateAfterSave, isAsync=True)
+
+
+def _findDocuments(kindName, terms):
+	"""
+		Fetches the documents containing all of *terms*.
+
+		:returns: List of document entities, at most conf["viur.fulltext.maxCandidates"]
+		:rtype: list of server.db.Entity
+	"""
+	qry = datastore.Query(__documentsKind__, {"terms =": [_getTerm(kindName, term) for term in sorted(terms)]})
+	return list(qry.Run(limit=conf["viur.fulltext.maxCandidates"]))
+
+
+def _findPrefixDocuments(kindName, prefix):
+	"""
+		Fetches the keys of the documents containing a term starting with *prefix*.
+
+		:returns: Set of key-names, at most conf["viur.fulltext.maxCandidates"]
+		:rtype: set of str
+	"""
+	start = _getTerm(kindName, prefix)
+	qry = datastore.Query(__documentsKind__, {"terms >=": start, "terms <": start + u"\ufffd"}, keys_only=True)
+	return set(key.name() for key in qry.Run(limit=conf["viur.fulltext.maxCandidates"]))
+
+
+def search(kindName, query, limit=None):
+	"""
+		Searches the index of *kindName* for entities containing all words in *query*.
+
+		Words ending with an asterisk match all terms starting with that word.
+		Results are ranked by the frequency of the searched terms. At most conf["viur.fulltext.maxCandidates"]
+		matching entities are considered, so very common words might not find all of them.
+
+		:param kindName: The kind to search in
+		:type kindName: str
+		:param query: The search-query, either a string or a list of words
+		:type query: str | list
+		:param limit: Return at most that many keys (defaults to conf["viur.fulltext.maxResults"])
+		:type limit: int
+		:returns: The keys of the matching entities, best match first
+		:rtype: list of str
+	"""
+	if limit is None:
+		limit = conf["viur.fulltext.maxResults"]
+	if not isinstance(query, list):
+		query = unicode(query).split()
+	terms = set()
+	prefixes = set()
+	for word in query:
+		for token in tokenize(word):
+			if len(token) > __maxTermLength__:
+				return []
+			if unicode(word).endswith("*"):
+				prefixes.add(token)
+			else:
+				terms.add(token)
+	if not terms and not prefixes:
+		return []
+	prefixMatches = None
+	for prefix in prefixes:
+		matches = _findPrefixDocuments(kindName, prefix)
+		prefixMatches = matches if prefixMatches is None else prefixMatches & matches
+		if not prefixMatches:
+			return []
+	if terms:
+		documents = _findDocuments(kindName, terms)
+		if prefixMatches is not None:
+			documents = [x for x in documents if x.key().name() in prefixMatches]
+	else:
+		documents = [x for x in db.Get([db.Key.from_path(__documentsKind__, x) for x in prefixMatches]) if x]
+	ranking = {}
+	for docObj in documents:
+		frequencies = json.loads(docObj["frequencies"])
+		rank = 0.0
+		for term in terms:
+			rank += 1.0 + log(frequencies.get(term, 1))
+		for prefix in prefixes:
+			rank += 1.0 + log(max(1, sum([v for k, v in frequencies.items() if k.startswith(prefix)])))
+		ranking[docObj.key().name()] = rank
+	if conf["viur.debug.traceQueries"]:
+		logging.debug("Fulltext-search on %s for %s matched %s entities" % (kindName, query, len(ranking)))
+	return sorted(ranking.keys(), key=lambda x: (-ranking[x], x))[:limit]
@@ -3,12 +3,11 @@ from server.prototypes.list import List
 from server.skeleton import Skeleton, RelSkel, skeletonByKind
 from server import utils, session, request
 from server.bones import *
-from server.bones.passwordBone import pbkdf2
+from server.bones.passwordBone import getPasswordHashParams, hashPassword, needsRehash, setPasswordHash
 from server import errors, conf, securitykey
 from server.tasks import StartupTask
 from time import time
 from server import db, exposed, forceSSL
-from hashlib import sha512
 from itertools import izip
 from google.appengine.api import users, app_identity
 import logging
@@ -91,12 +90,12 @@ class UserPassword(object):
 		res  = query.filter( "name.idx >=", name.lower()).get()
 
 		if res is None:
-			res = {"password":"", "status":0, "name":"","name.idx":""}
+			# Hash the password anyway, so unknown names can't be told apart by the response time
+			res = {"password":"", "status":0, "name":"","name.idx":"", "password_salt": "-",
+			       "password_algorithm": "pbkdf2_sha256", "password_iterations": conf["viur.password.iterations"]}
 
-		if "password_salt" in res:  # Its the new, more secure passwd
-			passwd = pbkdf2(password[:conf["viur.maxPasswordLength"]], res["password_salt"])
-		else:
-			passwd = sha512(password.encode("UTF-8")+conf["viur.salt"]).hexdigest()
+		algorithm, salt, iterations = getPasswordHashParams(res)
+		passwd = hashPassword(password, algorithm, salt, iterations)
 
 		isOkay = True
 
@@ -129,9 +128,8 @@ class UserPassword(object):
 			skel.fromClient({"name": name, "nomissing": "1"})
 			return self.userModule.render.login(skel, loginFailed=True)
 		else:
-			if not "password_salt" in res: #Update the password to the new, more secure format
-				res[ "password_salt" ] = utils.generateRandomString( 13 )
-				res[ "password" ] = pbkdf2( password[ : conf["viur.maxPasswordLength"] ], res["password_salt"] )
+			if needsRehash(algorithm, iterations): #Update the password to the current algorithm and cost
+				setPasswordHash(res, "password", password)
 				db.Put(res)
 
 			return self.userModule.continueAuthenticationFlow(self, res.key())
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from server import request
+from server.config import conf
+from server.tasks import callDeferred
+import logging
+
+"""
+	The operations run after a skeleton has been written by :func:`server.skeleton.Skeleton.toDB`.
+
+	Each operation is registered as a stage, which is either synchronous (run by toDB before it
+	returns, like the postSavedHandlers) or asynchronous. Asynchronous stages of all skeletons saved
+	during a request are collected and run by one deferred task (per __maxBatchSize__ saves) after the
+	request has been answered. Saving the same entity twice in one request runs its asynchronous
+	stages only once.
+
+	Synchronous stages are called with (skel, mergedSkel, key, dbObj, changedBones, clearUpdateTag),
+	where skel is the skeleton toDB has been called on (which might hold some bones only) and mergedSkel
+	holds all values written. Asynchronous ones are called with (kindName, key, changedBones,
+	clearUpdateTag), as they run in another request and have to read anything else from the datastore.
+"""
+
+__maxBatchSize__ = 100  # Saves handled by one deferred task
+_stages = []  # List of (name, function, isAsync) in the order they're run
+_stagesByName = {}
+
+
+def registerStage(name, func, isAsync=False):
+	"""
+		Registers a post-save stage. Stages run in the order of their registration; registering a name
+		again replaces the previous stage in place.
+
+		:param name: Unique name of the stage
+		:type name: str
+		:param func: The function to call
+		:type func: callable
+		:param isAsync: Run this stage in a deferred task after the request instead of inside toDB
+		:type isAsync: bool
+	"""
+	stage = (name, func, isAsync)
+	for idx, (stageName, _, _) in enumerate(_stages):
+		if stageName == name:
+			_stages[idx] = stage
+			break
+	else:
+		_stages.append(stage)
+	_stagesByName[name] = stage
+
+
+def runStages(skel, mergedSkel, key, dbObj, changedBones, clearUpdateTag, skipStages=None):
+	"""
+		Runs the synchronous stages for a skeleton that has just been written and queues its
+		asynchronous ones.
+
+		:param skipStages: Names of stages not to run for this write
+		:type skipStages: list of str | None
+	"""
+	pending = None
+	for name, func, isAsync in _stages:
+		if skipStages and name in skipStages:
+			continue
+		if not isAsync:
+			func(skel, mergedSkel, key, dbObj, changedBones, clearUpdateTag)
+		elif conf["viur.postSave.async"]:
+			pending = pending or []
+			pending.append(name)
+		else:
+			func(skel.kindName, key, changedBones, clearUpdateTag)
+	if pending:
+		_queue(skel.kindName, key, pending, changedBones, clearUpdateTag)
+
+
+def _queue(kindName, key, stageNames, changedBones, clearUpdateTag):
+	try:
+		reqData = request.current.requestData()
+	except AttributeError:  # Not inside a request, so nobody would flush our queue
+		_enqueue([[kindName, key, stageNames, sorted(changedBones or []), clearUpdateTag]])
+		return
+	queue = reqData.setdefault("viur.postSave", {})
+	entry = queue.get(key)
+	if entry is None:
+		queue[key] = [kindName, key, list(stageNames), set(changedBones or []), clearUpdateTag]
+	else:  # Saved again in this request - merge both saves
+		entry[2].extend([x for x in stageNames if x not in entry[2]])
+		entry[3].update(changedBones or [])
+		entry[4] = entry[4] and clearUpdateTag
+
+
+def flush():
+	"""
+		Enqueues the asynchronous stages collected during the current request. Called once the
+		request has been handled.
+	"""
+	try:
+		queue = request.current.requestData().pop("viur.postSave", None)
+	except AttributeError:
+		return
+	if not queue:
+		return
+	entries = [[kindName, key, stageNames, sorted(changedBones), clearUpdateTag]
+	           for (kindName, key, stageNames, changedBones, clearUpdateTag) in queue.values()]
+	while entries:
+		_enqueue(entries[:__maxBatchSize__])
+		entries = entries[__maxBatchSize__:]
+
+
+def _enqueue(entries):
+	try:
+		runBatch(entries)
+	except Exception as e:  # Don't let a failing task-queue break the request that saved these entities
+		logging.error("Could not enqueue the post-save stages of %s entities" % len(entries))
+		logging.exception(e)
+
+
+@callDeferred
+def runBatch(entries):
+	"""
+		Runs the asynchronous stages for a batch of saved entities.
+
+		Entries whose stages fail are enqueued again (with an exponential backoff), so the other
+		entities of this batch aren't processed twice. Entries are given up after
+		conf["viur.postSave.maxAttempts"] attempts.
+	"""
+	failed = {}  # Mapping attempt -> entries to retry
+	for entry in entries:
+		kindName, key, stageNames, changedBones, clearUpdateTag = entry[:5]
+		attempt = entry[5] if len(entry) > 5 else 0
+		for idx, name in enumerate(stageNames):
+			if name not in _stagesByName:
+				logging.error("Unknown post-save stage %s" % name)
+				continue
+			try:
+				_stagesByName[name][1](kindName, key, set(changedBones), clearUpdateTag)
+			except Exception as e:
+				logging.exception(e)
+				if attempt + 1 >= conf["viur.postSave.maxAttempts"]:
+					logging.error("Giving up the post-save stages %s of %s after %s attempts" % (", ".join(stageNames[idx:]), key, attempt + 1))
+				else:
+					failed.setdefault(attempt + 1, []).append([kindName, key, stageNames[idx:], changedBones, clearUpdateTag, attempt + 1])
+				break
+	for attempt, retryEntries in failed.items():
+		runBatch(retryEntries, _countdown=10 * 2 ** (attempt - 1))
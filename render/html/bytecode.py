@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+from server import utils, request
+from server.config import conf
+from server.tasks import CallableTask, CallableTaskBase
+from google.appengine.api import memcache
+from jinja2.bccache import BytecodeCache, Bucket
+from hashlib import sha1
+import os, logging
+
+"""
+	Bytecode caches for the Jinja2 environment of the html renderer.
+
+	Compiled templates are stored under a key derived from the hash of their source, the extensions and
+	the compile-time options (like autoescaping or delimiters) of the environment compiling them, so a
+	deploy changing a template never picks up stale bytecode.
+	The backends used are set by conf["viur.render.html.bytecodeCache"]:
+
+		- "filesystem" reads (and, where the filesystem is writable, writes) files in
+		  conf["viur.render.html.bytecodeDir"]. As the filesystem is read-only once deployed, fill
+		  that directory on the development server by running the "Compile templates" task (see
+		  :func:`compileTemplates`) before deploying.
+		- "memcache" shares the bytecode between all instances of a version.
+"""
+
+__memcacheNamespace__ = "viur-jinja-bytecode"
+_bytecodeCache = []  # The cache built from the configuration, once it has been requested
+
+
+_compileOptions = ["autoescape", "block_start_string", "block_end_string", "variable_start_string",
+                   "variable_end_string", "comment_start_string", "comment_end_string", "line_statement_prefix",
+                   "line_comment_prefix", "trim_blocks", "lstrip_blocks", "newline_sequence",
+                   "keep_trailing_newline", "optimized", "finalize", "is_async"]
+
+
+def _getCompileOptions(environment):
+	"""
+		Returns the options of *environment* which change the code its templates are compiled to
+		(as modules might alter them in their jinjaEnv), so they become part of the key.
+	"""
+	res = []
+	for option in _compileOptions:
+		value = getattr(environment, option, None)
+		if callable(value):  # Like select_autoescape() or a finalize function; their address differs per instance
+			closure = [cell.cell_contents for cell in getattr(value, "__closure__", None) or []]
+			value = "%s.%s%r" % (getattr(value, "__module__", None), getattr(value, "__name__", type(value).__name__), closure)
+		res.append("%s=%r" % (option, value))
+	return sha1(";".join(res)).hexdigest()
+
+
+class SourceHashBytecodeCache(BytecodeCache):
+	"""
+		Base for the caches below, keying the bytecode by the hash of the template source instead of
+		its filename.
+	"""
+
+	def get_bucket(self, environment, name, filename, source):
+		checksum = self.get_source_checksum(source)
+		if isinstance(name, unicode):
+			name = name.encode("UTF-8")
+		key = sha1("|".join([name, checksum, _getCompileOptions(environment)] + sorted(environment.extensions.keys()))).hexdigest()
+		bucket = Bucket(environment, key, checksum)
+		self.load_bytecode(bucket)
+		return bucket
+
+
+class FileSystemBytecodeCache(SourceHashBytecodeCache):
+	"""
+		Stores the bytecode of each template in a file in *directory*. Writing is skipped silently
+		if the filesystem is read-only.
+	"""
+
+	def __init__(self, directory):
+		self.directory = directory
+
+	def _getFilename(self, bucket):
+		return os.path.join(self.directory, "%s.cache" % bucket.key)
+
+	def load_bytecode(self, bucket):
+		try:
+			f = open(self._getFilename(bucket), "rb")
+		except IOError:
+			return
+		try:
+			bucket.load_bytecode(f)
+		finally:
+			f.close()
+
+	def dump_bytecode(self, bucket):
+		fn = self._getFilename(bucket)
+		try:
+			if not os.path.isdir(self.directory):
+				os.makedirs(self.directory)
+			f = open(fn + ".tmp", "wb")
+			try:
+				bucket.write_bytecode(f)
+			finally:
+				f.close()
+			os.rename(fn + ".tmp", fn)
+		except (IOError, OSError):
+			pass  # Read-only once deployed
+
+	def clear(self):
+		if not os.path.isdir(self.directory):
+			return
+		for fn in os.listdir(self.directory):
+			if fn.endswith(".cache"):
+				os.remove(os.path.join(self.directory, fn))
+
+
+class MemcacheBytecodeCache(SourceHashBytecodeCache):
+	"""
+		Stores the bytecode of each template in memcache.
+	"""
+
+	def load_bytecode(self, bucket):
+		data = memcache.get(bucket.key, namespace=__memcacheNamespace__)
+		if data:
+			bucket.bytecode_from_string(data)
+
+	def dump_bytecode(self, bucket):
+		try:
+			memcache.set(bucket.key, bucket.bytecode_to_string(), namespace=__memcacheNamespace__)
+		except Exception as e:  # Too large or memcache unavailable, this template will be compiled again
+			logging.warning("Could not store bytecode of a template in memcache: %s" % e)
+
+
+class ChainedBytecodeCache(SourceHashBytecodeCache):
+	"""
+		Loads bytecode from the first of *caches* providing it and stores new bytecode in all of them.
+	"""
+
+	def __init__(self, caches):
+		self.caches = caches
+
+	def load_bytecode(self, bucket):
+		for idx, cache in enumerate(self.caches):
+			cache.load_bytecode(bucket)
+			if bucket.code is not None:
+				for missingCache in self.caches[:idx]:  # Fill the faster caches missing it
+					missingCache.dump_bytecode(bucket)
+				return
+
+	def dump_bytecode(self, bucket):
+		for cache in self.caches:
+			cache.dump_bytecode(bucket)
+
+	def clear(self):
+		for cache in self.caches:
+			cache.clear()
+
+
+def getBytecodeCache():
+	"""
+		Returns the bytecode cache configured by conf["viur.render.html.bytecodeCache"], or None if
+		no backend has been selected.
+
+		:rtype: jinja2.bccache.BytecodeCache | None
+	"""
+	if not _bytecodeCache:
+		caches = []
+		for backend in conf["viur.render.html.bytecodeCache"] or []:
+			if backend == "filesystem":
+				caches.append(FileSystemBytecodeCache(os.path.join(os.getcwd(), conf["viur.render.html.bytecodeDir"])))
+			elif backend == "memcache":
+				caches.append(MemcacheBytecodeCache())
+			else:
+				raise ValueError("Unknown bytecode cache %s" % backend)
+		if not caches:
+			_bytecodeCache.append(None)
+		elif len(caches) == 1:
+			_bytecodeCache.append(caches[0])
+		else:
+			_bytecodeCache.append(ChainedBytecodeCache(caches))
+	return _bytecodeCache[0]
+
+
+def compileTemplates(render=None):
+	"""
+		Compiles all templates of the application and the server, so their bytecode is stored in the
+		configured caches. Files of templates which have been changed or removed since are deleted
+		from conf["viur.render.html.bytecodeDir"].
+
+		Templates are compiled using the environment of *render*; templates rendered by modules which
+		alter compile-time options of their environment (like autoescape or the delimiters, by jinjaEnv)
+		are stored under another key and compiled again on their first use.
+
+		:param render: The renderer to take the environment from (a plain html renderer by default)
+		:type render: server.render.html.default.Render
+		:returns: Number of templates compiled
+		:rtype: int
+	"""
+	if render is None:
+		from server.render.html.default import Render
+		render = Render()
+	env = render.getEnv()
+	if env.bytecode_cache is not None:
+		env.bytecode_cache.clear()
+	count = 0
+	for root in [os.path.join(os.getcwd(), getattr(render, "htmlpath", "html")),
+	             os.path.join(os.getcwd(), "server", "template")]:
+		for dirPath, dirNames, fileNames in os.walk(root, followlinks=True):
+			for fileName in fileNames:
+				if not fileName.endswith(".html"):
+					continue
+				name = os.path.relpath(os.path.join(dirPath, fileName), root).replace(os.sep, "/")
+				try:
+					env.get_template(name)
+				except Exception as e:
+					logging.error("Could not compile template %s" % name)
+					logging.exception(e)
+					continue
+				count += 1
+	return count
+
+
+@CallableTask
+class TaskCompileTemplates(CallableTaskBase):
+	"""
+		Compiles all templates ahead of time, filling the bytecode caches (see :func:`compileTemplates`).
+		Only available on the development server, where conf["viur.render.html.bytecodeDir"] is writable.
+	"""
+	key = "compileTemplates"
+	name = u"Compile templates"
+	descr = u"Compiles all templates and stores their bytecode, so it can be deployed with the application."
+
+	def canCall(self):
+		user = utils.getCurrentUser()
+		return user is not None and "root" in user["access"] and request.current.get().isDevServer
+
+	def execute(self, *args, **kwargs):
+		logging.info("Compiled %s templates" % compileTemplates())
@@ -3,14 +3,59 @@ import utils as jinjaUtils
 from wrap import ListWrapper, SkelListWrapper
 
 from server import utils, request, errors, securitykey
+from server.render.html.bytecode import getBytecodeCache
 from server.skeleton import Skeleton, BaseSkeleton, RefSkel, skeletonByKind
 from server.bones import *
 
 from collections import OrderedDict
+from itertools import izip
 from jinja2 import Environment, FileSystemLoader, ChoiceLoader
 
 import os, logging, codecs
 
+_templateListings = {} # Mapping template directory -> (set of files below it, mtimes of its directories)
+_templateNames = {} # Mapping (template, style, language, htmlpath) -> resolved template filename
+
+
+def _getTemplateListing( root ):
+	"""
+		Returns the files (relative to *root*) found below *root*, listing it once per instance.
+	"""
+	root = os.path.normpath( root )
+	listing = _templateListings.get( root )
+	if listing is None:
+		files = set()
+		dirMtimes = { root: None } # Notice the creation of a missing directory, too
+		for dirPath, dirNames, fileNames in os.walk( root, followlinks=True ):
+			dirMtimes[ dirPath ] = os.stat( dirPath ).st_mtime
+			relPath = os.path.relpath( dirPath, root )
+			for fileName in fileNames:
+				files.add( os.path.normpath( os.path.join( relPath, fileName ) ) )
+		listing = _templateListings[ root ] = ( files, dirMtimes )
+	return( listing )
+
+
+def _checkTemplateListings():
+	"""
+		Drops the cached listings and template names if a file has been added, removed or renamed in
+		one of the template directories. Only used on the development server, as deployed files never change.
+	"""
+	for root, ( files, dirMtimes ) in _templateListings.items():
+		for dirPath, mtime in dirMtimes.items():
+			try:
+				currentMtime = os.stat( dirPath ).st_mtime
+			except OSError:
+				currentMtime = None
+			if currentMtime != mtime:
+				_templateListings.clear()
+				_templateNames.clear()
+				return
+
+
+def _isTemplateFile( root, fn ):
+	return( os.path.normpath( fn ) in _getTemplateListing( root )[ 0 ] )
+
+
 class Render( object ):
 	"""
 		The core jinja2 render.
@@ -96,6 +141,10 @@ class Render( object ):
 			import env
 			Render.__haveEnvImported_ = True
 		self.parent = parent
+		self._renderPlans = {} # Mapping of skeleton class and bones -> plan, see getRenderPlan
+		# List our template directories now, so resolving template names won't touch the filesystem
+		_getTemplateListing( os.path.join( os.getcwd(), getattr( self, "htmlpath", "html" ) ) )
+		_getTemplateListing( os.path.join( os.getcwd(), "server", "template" ) )
 
 
 	def getTemplateFileName( self, template, ignoreStyle=False ):
@@ -130,6 +179,22 @@ class Render( object ):
 		else:
 			stylePostfix = ""
 		lang = request.current.get().language #session.current.getLanguage()
+		if request.current.get().isDevServer and not "viur.templatesChecked" in request.current.requestData():
+			# Templates might have been added or removed since the last request
+			request.current.requestData()[ "viur.templatesChecked" ] = True
+			_checkTemplateListings()
+		cacheKey = ( template, stylePostfix, lang, htmlpath )
+		if cacheKey not in _templateNames:
+			_templateNames[ cacheKey ] = self._resolveTemplateFileName( template, stylePostfix, lang, htmlpath )
+		return( _templateNames[ cacheKey ] )
+
+	def _resolveTemplateFileName( self, template, stylePostfix, lang, htmlpath ):
+		"""
+			Finds the template file for :func:`getTemplateFileName`, using the (cached) listings of the
+			template directories instead of testing each candidate on the filesystem.
+		"""
+		appRoot = os.path.join( os.getcwd(), htmlpath )
+		serverRoot = os.path.join( os.getcwd(), "server", "template" )
 		fnames = [ template+stylePostfix+".html", template+".html" ]
 		if lang:
 			fnames = [ 	os.path.join(  lang, template+stylePostfix+".html"),
@@ -138,15 +203,15 @@ class Render( object ):
 						template+".html" ]
 		for fn in fnames: #check subfolders
 			prefix = template.split("_")[0]
-			if os.path.isfile(os.path.join(os.getcwd(), htmlpath, prefix, fn)):
+			if _isTemplateFile( appRoot, os.path.join( prefix, fn ) ):
 				return ( "%s/%s" % (prefix, fn ) )
 		for fn in fnames: #Check the templatefolder of the application
-			if os.path.isfile( os.path.join( os.getcwd(), htmlpath, fn ) ):
-				self.checkForOldLinePrefix( os.path.join( os.getcwd(), htmlpath, fn ) )
+			if _isTemplateFile( appRoot, fn ):
+				self.checkForOldLinePrefix( os.path.join( appRoot, fn ) )
 				return( fn )
 		for fn in fnames: #Check the fallback
-			if os.path.isfile( os.path.join( os.getcwd(), "server", "template", fn ) ):
-				self.checkForOldLinePrefix( os.path.join( os.getcwd(), "server", "template", fn ) )
+			if _isTemplateFile( serverRoot, fn ):
+				self.checkForOldLinePrefix( os.path.join( serverRoot, fn ) )
 				return( fn )
 		raise errors.NotFound( "Template %s not found." % template )
 
@@ -300,84 +365,126 @@ class Render( object ):
 		:return: A dict containing the rendered attributes.
 		:rtype: dict
 		"""
+		return self.getBoneRenderer(bone)(bone, skel, key)
+
+	def getBoneRenderer(self, bone):
+		"""
+		Returns the function rendering the values of a bone, called with (bone, skel, key).
+
+		It is called once per skeleton class by :func:`getRenderPlan` and can be overridden to
+		render additional types of bones.
+
+		:param bone: The bone which values should be rendered.
+		:type bone: Any bone that inherits from :class:`server.bones.base.baseBone`.
 
-		# selectBone
+		:rtype: callable
+		"""
 		if bone.type == "select" or bone.type.startswith("select."):
-			skelValue = skel[key]
-			if isinstance(skelValue, list):
-				return [
-					Render.KeyValueWrapper(val, bone.values[val]) if val in bone.values else val
-					for val in skelValue
-				]
-			elif skelValue in bone.values:
-				return Render.KeyValueWrapper(skelValue, bone.values[skelValue])
-			return skelValue
-
-		# relationalBone
+			return self.renderSelectBoneValue
 		elif bone.type=="relational" or bone.type.startswith("relational."):
-			if isinstance(skel[key], list):
-				tmpList = []
-				for k in skel[key]:
-					refSkel = bone._refSkelCache
-					refSkel.setValuesCache(k["dest"])
-					if bone.using is None:
-						tmpList.append(self.collectSkelData(refSkel))
-					else:
-						usingSkel = bone._usingSkelCache
-						if k["rel"]:
-							usingSkel.setValuesCache(k["rel"])
-							usingData = self.collectSkelData(usingSkel)
-						else:
-							usingData = None
-						tmpList.append({
-							"dest": self.collectSkelData(refSkel),
-							"rel": usingData
-						})
-				return tmpList
-
-			elif isinstance(skel[key], dict):
+			return self.renderRelationalBoneValue
+		elif bone.type == "record" or bone.type.startswith("record."):
+			return self.renderRecordBoneValue
+		return self.renderPlainBoneValue
+
+	def renderSelectBoneValue(self, bone, skel, key):
+		skelValue = skel[key]
+		if isinstance(skelValue, list):
+			return [
+				Render.KeyValueWrapper(val, bone.values[val]) if val in bone.values else val
+				for val in skelValue
+			]
+		elif skelValue in bone.values:
+			return Render.KeyValueWrapper(skelValue, bone.values[skelValue])
+		return skelValue
+
+	def renderRelationalBoneValue(self, bone, skel, key):
+		if isinstance(skel[key], list):
+			tmpList = []
+			for k in skel[key]:
 				refSkel = bone._refSkelCache
-				refSkel.setValuesCache(skel[key]["dest"])
+				refSkel.setValuesCache(k["dest"])
 				if bone.using is None:
-					return self.collectSkelData(refSkel)
+					tmpList.append(self.collectSkelData(refSkel))
 				else:
 					usingSkel = bone._usingSkelCache
-					if skel[key]["rel"]:
-						usingSkel.setValuesCache(skel[key]["rel"])
+					if k["rel"]:
+						usingSkel.setValuesCache(k["rel"])
 						usingData = self.collectSkelData(usingSkel)
 					else:
 						usingData = None
-
-					return {
+					tmpList.append({
 						"dest": self.collectSkelData(refSkel),
 						"rel": usingData
-					}
+					})
+			return tmpList
+
+		elif isinstance(skel[key], dict):
+			refSkel = bone._refSkelCache
+			refSkel.setValuesCache(skel[key]["dest"])
+			if bone.using is None:
+				return self.collectSkelData(refSkel)
 			else:
-				return None
+				usingSkel = bone._usingSkelCache
+				if skel[key]["rel"]:
+					usingSkel.setValuesCache(skel[key]["rel"])
+					usingData = self.collectSkelData(usingSkel)
+				else:
+					usingData = None
 
-		# recordBone
-		elif bone.type == "record" or bone.type.startswith("record."):
-			usingSkel = bone._usingSkelCache
-			value = skel[key]
+				return {
+					"dest": self.collectSkelData(refSkel),
+					"rel": usingData
+				}
+		else:
+			return None
 
-			if isinstance(value, list):
-				ret = []
-				for entry in value:
-					usingSkel.setValuesCache(entry)
-					ret.append(self.collectSkelData(usingSkel))
+	def renderRecordBoneValue(self, bone, skel, key):
+		usingSkel = bone._usingSkelCache
+		value = skel[key]
 
-				return ret
+		if isinstance(value, list):
+			ret = []
+			for entry in value:
+				usingSkel.setValuesCache(entry)
+				ret.append(self.collectSkelData(usingSkel))
 
-			elif isinstance(value, dict):
-				usingSkel.setValuesCache(value)
-				return self.collectSkelData(usingSkel)
+			return ret
 
-			else:
-				return None
+		elif isinstance(value, dict):
+			usingSkel.setValuesCache(value)
+			return self.collectSkelData(usingSkel)
+
+		else:
+			return None
 
+	def renderPlainBoneValue(self, bone, skel, key):
 		# Any other bone, just return its value
 		return skel[key]
 
+	def getRenderPlan(self, skel):
+		"""
+		Returns the functions rendering the bones of *skel*, in the order of skel.items().
+
+		Plans are built once per skeleton class and set of bones; for cloned skeletons, whose bones
+		might have been replaced, the types of their bones are part of that key.
+		If :func:`renderBoneValue` has been overridden, it's called for each bone instead.
+
+		:rtype: list of callable
+		"""
+		if skel.isClonedInstance:
+			cacheKey = (type(skel), tuple([(key, bone.type) for key, bone in skel.items()]))
+		else:
+			cacheKey = (type(skel), tuple(skel.keys()))
+		plan = self._renderPlans.get(cacheKey)
+		if plan is None:
+			if type(self).renderBoneValue.__func__ is not Render.renderBoneValue.__func__:
+				plan = [self.renderBoneValue for key in skel.keys()]
+			else:
+				plan = [self.getBoneRenderer(bone) for key, bone in skel.items()]
+			self._renderPlans[cacheKey] = plan
+		return plan
+
 	def collectSkelData(self, skel):
 		"""
 			Prepares values of one :class:`server.db.skeleton.Skeleton` or a list of skeletons for output.
@@ -392,11 +499,11 @@ class Render( object ):
 		if isinstance(skel, list):
 			return [self.collectSkelData(x) for x in skel]
 		res = {}
-		for key, bone in skel.items():
-			val = self.renderBoneValue(bone, skel, key)
+		for (key, bone), renderFunc in izip(skel.items(), self.getRenderPlan(skel)):
+			val = renderFunc(bone, skel, key)
+			if isinstance(val, list):
+				val = ListWrapper(val)
 			res[key] = val
-			if isinstance(res[key], list):
-				res[key] = ListWrapper(res[key])
 		return res
 
 	def add(self, skel, tpl=None, params=None, *args, **kwargs):
@@ -916,7 +1023,8 @@ class Render( object ):
 
 		if not "env" in dir(self):
 			loaders = self.getLoaders()
-			self.env = Environment(loader=loaders, extensions=["jinja2.ext.do", "jinja2.ext.loopcontrols"])
+			self.env = Environment(loader=loaders, extensions=["jinja2.ext.do", "jinja2.ext.loopcontrols"],
+			                       bytecode_cache=getBytecodeCache())
 
 			# Translation remains global
 			self.env.globals["_"] = _
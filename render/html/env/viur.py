@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 from server import utils, request, conf, prototypes, securitykey, errors
+from server.db import decodeKey
 from server.skeleton import Skeleton, RelSkel
 from server.render.html.utils import jinjaGlobalFunction, jinjaGlobalFilter
 from server.render.html.wrap import ListWrapper, SkelListWrapper
-import urllib
+import urllib, types
 from hashlib import sha512
 from google.appengine.ext import db
 from google.appengine.api import memcache, users
@@ -96,6 +97,8 @@ def execRequest(render, path, *args, **kwargs):
 
 	try:
 		resstr = caller( *args, **kwargs )
+		if isinstance( resstr, types.GeneratorType ): # Streamed responses (see findAndCall)
+			resstr = "".join( resstr )
 	except Exception as e:
 		logging.error("Caught execption in execRequest while calling %s" % path)
 		logging.exception(e)
@@ -167,7 +170,7 @@ def getEntry(render, module, key=None, skel = "viewSkel"):
 			if isinstance(obj, prototypes.singleton.Singleton):
 				isAllowed = obj.canView()
 			elif isinstance(obj, prototypes.tree.Tree):
-				k = db.Key(key)
+				k = decodeKey(key)
 				if k.kind().endswith("_rootNode"):
 					isAllowed = obj.canView("node", skel)
 				else:
@@ -492,7 +495,7 @@ def shortKey(render, val):
 	"""
 
 	try:
-		k = db.Key(encoded = unicode(val))
+		k = decodeKey(unicode(val))
 		return k.id_or_name()
 	except:
 		return None
@@ -3,6 +3,7 @@
 from .default import DefaultRender as default
 from .user import UserRender as user
 from .file import FileRender as file
+from .default import codelist
 from server import securitykey
 import json
 
@@ -15,4 +16,5 @@ genSkey.exposed=True
 
 def _postProcessAppObj( obj ): #Register our SKey function
 	obj.skey = genSkey
+	obj.codelist = codelist
 	return obj
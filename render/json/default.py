@@ -1,15 +1,89 @@
 # -*- coding: utf-8 -*-
 import json
 from collections import OrderedDict
+from itertools import izip
 from server import errors, request, bones
+from server.bones.selectBone import getCodelist
+from server.config import conf
 from server.skeleton import RefSkel, skeletonByKind
+from hashlib import sha1
 import logging
 
+_codelistCache = {}  # Mapping (codelist id, language) -> (json, etag)
+
+def renderCodelist(codelistId):
+	"""
+		Returns the values of a codelist (see :func:`server.bones.selectBone.registerCodelist`),
+		translated into the current language, as JSON together with its ETag.
+
+		:returns: Tuple of (json, etag) or None if there is no such codelist
+		:rtype: tuple | None
+	"""
+	cacheKey = (codelistId, request.current.get().language)
+	if cacheKey not in _codelistCache:
+		values = getCodelist(codelistId)
+		if values is None:
+			return None
+		res = json.dumps([(k, _(v)) for k, v in values.items()])
+		_codelistCache[cacheKey] = (res, "\"%s\"" % sha1(res).hexdigest())
+	return _codelistCache[cacheKey]
+
+def codelist(codelistId, *args, **kwargs):
+	"""
+		Serves a codelist, answering with 304 Not Modified if the client already has it.
+	"""
+	res = renderCodelist(codelistId)
+	if res is None:
+		raise errors.NotFound()
+	data, etag = res
+	return serveWithEtag(data, etag, "public, max-age=3600")
+codelist.exposed = True
+
+def serveWithEtag(data, etag, cacheControl):
+	"""
+		Sets the ETag and Cache-Control headers of the current response and returns *data*, or answers
+		with 304 Not Modified if the client sent that ETag as If-None-Match.
+	"""
+	currReq = request.current.get()
+	currReq.response.headers["Content-Type"] = "application/json"
+	currReq.response.headers["ETag"] = etag
+	currReq.response.headers["Cache-Control"] = cacheControl
+	if currReq.request.headers.get("If-None-Match") == etag:
+		currReq.response.set_status(304)
+		return ""
+	return data
+
+_structureCache = {}  # Mapping (render class, skeleton class, bone names, language) -> (json, hash)
+
+def getModuleStructure(moduleObj, render):
+	"""
+		Returns the structures of all skeletons of a module as JSON together with its ETag, as served
+		by the getStructure function of the vi renderer.
+
+		:returns: Tuple of (json, etag) or (None, None) if the module has no skeletons
+		:rtype: tuple
+	"""
+	from server.skeleton import Skeleton
+	res = []
+	for stype in ["viewSkel","editSkel","addSkel", "viewLeafSkel", "viewNodeSkel", "editNodeSkel", "editLeafSkel", "addNodeSkel", "addLeafSkel"]: #Unknown skel type
+		if stype in dir( moduleObj ):
+			try:
+				skel = getattr( moduleObj, stype )()
+			except:
+				continue
+			if isinstance( skel, Skeleton ):
+				res.append("%s: %s" % (json.dumps(stype), render.getSkelStructure(skel)[0]))
+	if not res:
+		return None, None
+	data = "{%s}" % ", ".join(res)
+	return data, "\"%s\"" % sha1(data).hexdigest()
+
 class DefaultRender(object):
 
 	def __init__(self, parent = None, *args, **kwargs):
 		super(DefaultRender,  self).__init__(*args, **kwargs)
 		self.parent = parent
+		self._renderPlans = {} # Mapping of skeleton class and bones -> plan, see getRenderPlan
 
 	def renderBoneStructure(self, bone):
 		"""
@@ -62,10 +136,18 @@ class DefaultRender(object):
 			})
 
 		elif bone.type == "select" or bone.type.startswith("select."):
-			ret.update({
-				"values": [(k, _(v)) for k, v in bone.values.items()],
-				"multiple": bone.multiple,
-			})
+			if bone.codelist and not conf["viur.codelists.inline"] and renderCodelist(bone.codelist):
+				# Shared values are fetched once by the client using our codelist function
+				ret.update({
+					"codelist": bone.codelist,
+					"codelistEtag": renderCodelist(bone.codelist)[1],
+					"multiple": bone.multiple,
+				})
+			else:
+				ret.update({
+					"values": [(k, _(v)) for k, v in bone.values.items()],
+					"multiple": bone.multiple,
+				})
 
 		elif bone.type == "date" or bone.type.startswith("date."):
 			ret.update({
@@ -145,50 +227,95 @@ class DefaultRender(object):
 		:return: A dict containing the rendered attributes.
 		:rtype: dict
 		"""
-		if bone.type == "date" or bone.type.startswith("date."):
-			if skel[key]:
-				if bone.date and bone.time:
-					return skel[key].strftime("%d.%m.%Y %H:%M:%S")
-				elif bone.date:
-					return skel[key].strftime("%d.%m.%Y")
+		return self.getBoneRenderer(bone)(bone, skel, key)
+
+	def getBoneRenderer(self, bone):
+		"""
+		Returns the function rendering the values of a bone, called with (bone, skel, key).
+
+		It is called once per skeleton class by :func:`getRenderPlan` and can be overridden to
+		render additional types of bones.
+
+		:param bone: The bone which values should be rendered.
+		:type bone: Any bone that inherits from :class:`server.bones.base.baseBone`.
 
-				return skel[key].strftime("%H:%M:%S")
+		:rtype: callable
+		"""
+		if bone.type == "date" or bone.type.startswith("date."):
+			return self.renderDateBoneValue
 		elif isinstance(bone, bones.relationalBone):
-			if isinstance(skel[key], list):
-				refSkel = bone._refSkelCache
-				usingSkel = bone._usingSkelCache
-				tmpList = []
-				for k in skel[key]:
-					refSkel.setValuesCache(k["dest"])
-					if usingSkel:
-						usingSkel.setValuesCache(k.get("rel", {}))
-						usingData = self.renderSkelValues(usingSkel)
-					else:
-						usingData = None
-					tmpList.append({
-						"dest": self.renderSkelValues(refSkel),
-						"rel": usingData
-					})
-
-				return tmpList
-			elif isinstance(skel[key], dict):
-				refSkel = bone._refSkelCache
-				usingSkel = bone._usingSkelCache
-				refSkel.setValuesCache(skel[key]["dest"])
+			return self.renderRelationalBoneValue
+		return self.renderPlainBoneValue
+
+	def renderDateBoneValue(self, bone, skel, key):
+		if skel[key]:
+			if bone.date and bone.time:
+				return skel[key].strftime("%d.%m.%Y %H:%M:%S")
+			elif bone.date:
+				return skel[key].strftime("%d.%m.%Y")
+
+			return skel[key].strftime("%H:%M:%S")
+		return None
+
+	def renderRelationalBoneValue(self, bone, skel, key):
+		if isinstance(skel[key], list):
+			refSkel = bone._refSkelCache
+			usingSkel = bone._usingSkelCache
+			tmpList = []
+			for k in skel[key]:
+				refSkel.setValuesCache(k["dest"])
 				if usingSkel:
-					usingSkel.setValuesCache(skel[key].get("rel", {}))
+					usingSkel.setValuesCache(k.get("rel", {}))
 					usingData = self.renderSkelValues(usingSkel)
 				else:
 					usingData = None
-				return {
+				tmpList.append({
 					"dest": self.renderSkelValues(refSkel),
 					"rel": usingData
-				}
-		else:
-			return skel[key]
-
+				})
+
+			return tmpList
+		elif isinstance(skel[key], dict):
+			refSkel = bone._refSkelCache
+			usingSkel = bone._usingSkelCache
+			refSkel.setValuesCache(skel[key]["dest"])
+			if usingSkel:
+				usingSkel.setValuesCache(skel[key].get("rel", {}))
+				usingData = self.renderSkelValues(usingSkel)
+			else:
+				usingData = None
+			return {
+				"dest": self.renderSkelValues(refSkel),
+				"rel": usingData
+			}
 		return None
 
+	def renderPlainBoneValue(self, bone, skel, key):
+		return skel[key]
+
+	def getRenderPlan(self, skel):
+		"""
+		Returns the functions rendering the bones of *skel*, in the order of skel.items().
+
+		Plans are built once per skeleton class and set of bones; for cloned skeletons, whose bones
+		might have been replaced, the types of their bones are part of that key.
+		If :func:`renderBoneValue` has been overridden, it's called for each bone instead.
+
+		:rtype: list of callable
+		"""
+		if skel.isClonedInstance:
+			cacheKey = (type(skel), tuple([(key, bone.type) for key, bone in skel.items()]))
+		else:
+			cacheKey = (type(skel), tuple(skel.keys()))
+		plan = self._renderPlans.get(cacheKey)
+		if plan is None:
+			if type(self).renderBoneValue.__func__ is not DefaultRender.renderBoneValue.__func__:
+				plan = [self.renderBoneValue for key in skel.keys()]
+			else:
+				plan = [self.getBoneRenderer(bone) for key, bone in skel.items()]
+			self._renderPlans[cacheKey] = plan
+		return plan
+
 	def renderSkelValues(self, skel):
 		"""
 		Prepares values of one :class:`server.db.skeleton.Skeleton` or a list of skeletons for output.
@@ -205,28 +332,51 @@ class DefaultRender(object):
 			return skel
 
 		res = {}
-		for key, bone in skel.items():
-			res[key] = self.renderBoneValue(bone, skel, key)
+		for (key, bone), renderFunc in izip(skel.items(), self.getRenderPlan(skel)):
+			res[key] = renderFunc(bone, skel, key)
 
 		return res
 
+	def getSkelStructure(self, skel):
+		"""
+		Returns the structure of *skel* (see :func:`renderSkelStructure`) as JSON together with its hash.
+
+		Structures are cached per skeleton class, set of bones and language, except for cloned
+		skeletons (whose bones might have been modified) and skeletons holding errors.
+
+		:returns: Tuple of (json, hash)
+		:rtype: tuple
+		"""
+		if isinstance(skel, dict) or skel.isClonedInstance or skel.errors:
+			res = json.dumps(self.renderSkelStructure(skel))
+			return res, sha1(res).hexdigest()
+		cacheKey = (type(self), type(skel), tuple(skel.keys()), request.current.get().language)
+		if cacheKey not in _structureCache:
+			res = json.dumps(self.renderSkelStructure(skel))
+			_structureCache[cacheKey] = (res, sha1(res).hexdigest())
+		return _structureCache[cacheKey]
+
+	def renderStructureForClient(self, skel):
+		"""
+		Returns the JSON-encoded structure of *skel* and its hash, with the structure replaced by
+		null if the client passed that hash as structureHash parameter.
+		"""
+		structure, structureHash = self.getSkelStructure(skel)
+		if request.current.get().kwargs.get("structureHash") == structureHash:
+			structure = "null" # The client already knows it
+		return structure, structureHash
+
 	def renderEntry(self, skel, actionName, params = None):
 		if isinstance(skel, list):
 			vals = [self.renderSkelValues(x) for x in skel]
-			struct = self.renderSkelStructure(skel[0])
+			structure, structureHash = self.renderStructureForClient(skel[0])
 		else:
 			vals = self.renderSkelValues(skel)
-			struct = self.renderSkelStructure(skel)
-
-		res = {
-			"values": vals,
-			"structure": struct,
-			"action": actionName,
-			"params": params
-		}
+			structure, structureHash = self.renderStructureForClient(skel)
 
 		request.current.get().response.headers["Content-Type"] = "application/json"
-		return json.dumps(res)
+		return "{\"values\": %s, \"structureHash\": %s, \"structure\": %s, \"action\": %s, \"params\": %s}" % (
+			json.dumps(vals), json.dumps(structureHash), structure, json.dumps(actionName), json.dumps(params))
 
 	def view(self, skel, action="view", params = None, *args, **kwargs):
 		return self.renderEntry(skel, action, params)
@@ -238,25 +388,42 @@ class DefaultRender(object):
 		return self.renderEntry(skel, action, params)
 
 	def list(self, skellist, action = "list", params=None, **kwargs):
-		res = {}
-		skels = []
+		"""
+		Renders a list of skeletons.
 
-		for skel in skellist:
-			skels.append(self.renderSkelValues(skel))
+		For requests from clients, the result is returned as a generator encoding one entry at a time,
+		which avoids building the list of rendered dicts and one large string for all of them. The
+		chunks are written to webapp2's buffered response, so the encoded body (and the skellist) are
+		still held in memory as a whole. Internal requests (like execRequest) get a string.
+		Clients can pass the structureHash of a previous response as parameter; if the structure is
+		still the same, it's omitted (sent as null).
 
-		res["skellist"] = skels
+		:returns: Generator yielding the JSON-encoded response in chunks, or that response as a string
+			for internal requests
+		"""
+		currReq = request.current.get()
+		currReq.response.headers["Content-Type"] = "application/json"
+		if currReq.internalRequest:
+			return "".join(self.iterList(skellist, action, params))
+		return self.iterList(skellist, action, params)
 
+	def iterList(self, skellist, action, params):
 		if skellist:
-			res["structure"] = self.renderSkelStructure(skellist.baseSkel)
+			structure, structureHash = self.renderStructureForClient(skellist.baseSkel)
 		else:
-			res["structure"] = None
-
-		res["cursor"] = skellist.cursor
-		res["action"] = action
-		res["params"] = params
+			structure = "null"
+			structureHash = None
 
-		request.current.get().response.headers["Content-Type"] = "application/json"
-		return json.dumps(res)
+		yield "{\"action\": %s, \"params\": %s, \"cursor\": %s, \"structureHash\": %s, \"structure\": %s, \"skellist\": [" % (
+			json.dumps(action), json.dumps(params), json.dumps(skellist.cursor), json.dumps(structureHash), structure)
+		first = True
+		for skel in skellist:
+			if first:
+				first = False
+				yield json.dumps(self.renderSkelValues(skel))
+			else:
+				yield ", " + json.dumps(self.renderSkelValues(skel))
+		yield "]}"
 
 	def editItemSuccess(self, skel, params=None, **kwargs):
 		return self.renderEntry(skel, "editSuccess", params)
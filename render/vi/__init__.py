@@ -3,7 +3,7 @@
 from server.render.vi.default import DefaultRender as default
 from server.render.vi.user import UserRender as user
 from server.render.json.file import FileRender as file
-from server.skeleton import Skeleton
+from server.render.json.default import codelist, getModuleStructure, serveWithEtag
 from google.appengine.api import app_identity
 from server import conf
 from server import securitykey
@@ -30,23 +30,14 @@ def getStructure( adminTree, module ):
 	  or not getattr( adminTree, module ).adminInfo:
 		# Module not known or no adminInfo for that module
 		return( json.dumps( None ) )
-	res = {}
 	try:
 		moduleObj = getattr( adminTree, module )
 	except:
 		return( None )
-	for stype in ["viewSkel","editSkel","addSkel", "viewLeafSkel", "viewNodeSkel", "editNodeSkel", "editLeafSkel", "addNodeSkel", "addLeafSkel"]: #Unknown skel type
-		if stype in dir( moduleObj ):
-			try:
-				skel = getattr( moduleObj, stype )()
-			except:
-				continue
-			if isinstance( skel, Skeleton ):
-				res[ stype ] = default().renderSkelStructure( skel )
-	if res:
-		return( json.dumps( res ) )
-	else:
+	data, etag = getModuleStructure( moduleObj, default() )
+	if data is None:
 		return( json.dumps( None ) )
+	return( serveWithEtag( data, etag, "private, max-age=0" ) )
 
 
 def setLanguage( lang, skey):
@@ -140,5 +131,6 @@ def _postProcessAppObj( obj ):
 	obj.canAccess = canAccess
 	obj.setLanguage = setLanguage
 	obj.getVersion = getVersion
+	obj.codelist = codelist
 	obj.index = index
 	return obj
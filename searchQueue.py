@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+from server import request
+from server.config import conf
+from google.appengine.api import search
+from collections import OrderedDict
+import logging, time
+
+"""
+	Buffers the documents written to and removed from the indexes of the search API.
+
+	Documents put or removed during a request (or a task) are collected per index and sent at its end
+	(see :func:`flush`) in batches of up to __maxBatchSize__, the largest amount the search API accepts
+	at once. Documents which couldn't be indexed are retried up to conf["viur.searchQueue.retries"] times,
+	waiting conf["viur.searchQueue.retryDelay"] seconds before the first retry and twice as long before each
+	following one.
+
+	Setting conf["viur.searchQueue.localIndex"] replaces the search API by :class:`LocalIndex`, which
+	keeps the documents in memory, so indexing can be run without the API available.
+"""
+
+__maxBatchSize__ = 200  # Documents put to or deleted from an index with one call
+_localIndexes = {}  # Mapping index-name -> LocalIndex
+
+
+class LocalIndex(object):
+	"""
+		In-memory stand-in for :class:`google.appengine.api.search.Index`.
+
+		It supports put, delete, get and a simple search returning documents containing all words of
+		the query string. Transient failures can be simulated by setting *failures* (a dict of
+		document-id -> number of attempts to fail).
+	"""
+
+	def __init__(self, name):
+		self.name = name
+		self.documents = OrderedDict()
+		self.failures = {}
+		self.calls = 0  # Number of put/delete calls received
+
+	def _shouldFail(self, docId):
+		if self.failures.get(docId, 0) > 0:
+			self.failures[docId] -= 1
+			return True
+		return False
+
+	def put(self, documents):
+		self.calls += 1
+		if isinstance(documents, search.Document):
+			documents = [documents]
+		res = []
+		for doc in documents:
+			if self._shouldFail(doc.doc_id):
+				res.append(search.PutResult(code=search.OperationResult.TRANSIENT_ERROR, id=doc.doc_id))
+			else:
+				self.documents[doc.doc_id] = doc
+				res.append(search.PutResult(code=search.OperationResult.OK, id=doc.doc_id))
+		return res
+
+	def delete(self, documentIds):
+		self.calls += 1
+		if isinstance(documentIds, basestring):
+			documentIds = [documentIds]
+		res = []
+		for docId in documentIds:
+			if self._shouldFail(docId):
+				res.append(search.DeleteResult(code=search.OperationResult.TRANSIENT_ERROR, id=docId))
+			else:
+				self.documents.pop(docId, None)
+				res.append(search.DeleteResult(code=search.OperationResult.OK, id=docId))
+		return res
+
+	def get(self, docId):
+		return self.documents.get(docId)
+
+	def search(self, query):
+		if isinstance(query, search.Query):
+			limit = query.options.limit if query.options and query.options.limit else 20
+			query = query.query_string
+		else:
+			limit = 20
+		words = [x.strip(u"\"").lower() for x in query.split()]
+		res = []
+		for doc in self.documents.values():
+			text = u" ".join([unicode(field.value or u"") for field in doc.fields]).lower()
+			if all(word in text for word in words):
+				res.append(doc)
+				if len(res) >= limit:
+					break
+		return res
+
+
+def getIndex(name):
+	"""
+		Returns the search index *name*, which is a :class:`LocalIndex` if conf["viur.searchQueue.localIndex"]
+		is set.
+
+		:rtype: google.appengine.api.search.Index | LocalIndex
+	"""
+	if conf["viur.searchQueue.localIndex"]:
+		if name not in _localIndexes:
+			_localIndexes[name] = LocalIndex(name)
+		return _localIndexes[name]
+	return search.Index(name=name)
+
+
+def _getBuffer(indexName):
+	try:
+		reqData = request.current.requestData()
+	except AttributeError:  # Not inside a request, so nobody would flush our buffer
+		return None
+	buffers = reqData.setdefault("viur.searchQueue", OrderedDict())
+	if indexName not in buffers:
+		buffers[indexName] = (OrderedDict(), OrderedDict())  # Documents to put, document-ids to delete
+	return buffers[indexName]
+
+
+def putDocument(indexName, document):
+	"""
+		Queues *document* to be written to the index *indexName*.
+
+		:type indexName: str
+		:type document: google.appengine.api.search.Document
+	"""
+	buf = _getBuffer(indexName)
+	if buf is None:
+		_putDocuments(indexName, [document])
+		return
+	toPut, toDelete = buf
+	toDelete.pop(document.doc_id, None)
+	toPut[document.doc_id] = document
+
+
+def removeDocument(indexName, docId):
+	"""
+		Queues the document *docId* to be removed from the index *indexName*.
+
+		:type indexName: str
+		:type docId: str
+	"""
+	buf = _getBuffer(indexName)
+	if buf is None:
+		_deleteDocuments(indexName, [docId])
+		return
+	toPut, toDelete = buf
+	toPut.pop(docId, None)
+	toDelete[docId] = True
+
+
+def _failedIds(results):
+	return [x.id for x in results if x.code != search.OperationResult.OK]
+
+
+def _backoff(attempt):
+	"""
+		Waits before retrying a failed call, doubling the delay for each attempt.
+	"""
+	if attempt > 0 and conf["viur.searchQueue.retryDelay"] > 0:
+		time.sleep(conf["viur.searchQueue.retryDelay"] * 2 ** (attempt - 1))
+
+
+def _putDocuments(indexName, documents):
+	index = getIndex(indexName)
+	for attempt in range(conf["viur.searchQueue.retries"] + 1):
+		_backoff(attempt)
+		try:
+			failedIds = set(_failedIds(index.put(documents)))
+		except search.PutError as e:
+			failedIds = set(_failedIds(e.results)) if e.results else set(x.doc_id for x in documents)
+		except Exception as e:
+			logging.exception(e)
+			failedIds = set(x.doc_id for x in documents)
+		documents = [x for x in documents if x.doc_id in failedIds]
+		if not documents:
+			return True
+	logging.error("Could not index %s in %s" % (", ".join([x.doc_id for x in documents]), indexName))
+	return False
+
+
+def _deleteDocuments(indexName, docIds):
+	index = getIndex(indexName)
+	for attempt in range(conf["viur.searchQueue.retries"] + 1):
+		_backoff(attempt)
+		try:
+			failedIds = set(_failedIds(index.delete(docIds)))
+		except search.DeleteError as e:
+			failedIds = set(_failedIds(e.results)) if e.results else set(docIds)
+		except Exception as e:
+			logging.exception(e)
+			failedIds = set(docIds)
+		docIds = [x for x in docIds if x in failedIds]
+		if not docIds:
+			return True
+	logging.error("Could not remove %s from %s" % (", ".join(docIds), indexName))
+	return False
+
+
+def flush():
+	"""
+		Sends the documents queued during the current request to their indexes. Called once the request
+		has been handled.
+	"""
+	try:
+		buffers = request.current.requestData().pop("viur.searchQueue", None)
+	except AttributeError:
+		return
+	if not buffers:
+		return
+	for indexName, (toPut, toDelete) in buffers.items():
+		documents = toPut.values()
+		while documents:
+			_putDocuments(indexName, documents[:__maxBatchSize__])
+			documents = documents[__maxBatchSize__:]
+		docIds = toDelete.keys()
+		while docIds:
+			_deleteDocuments(indexName, docIds[:__maxBatchSize__])
+			docIds = docIds[__maxBatchSize__:]
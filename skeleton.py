@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 
-from server import db, utils, conf, errors
-from server.bones import baseBone, boneFactory, keyBone, dateBone, selectBone, relationalBone, stringBone
+from server import db, utils, conf, errors, fulltext, facets, postSave, searchQueue
+from server.bones import baseBone, boneFactory, keyBone, dateBone, selectBone, relationalBone, stringBone, numericBone
 from server.tasks import CallableTask, CallableTaskBase, callDeferred
 from collections import OrderedDict
 from threading import local
 from time import time
+from datetime import datetime, timedelta
+from hashlib import sha1
 import inspect, os, sys, logging, copy
-from google.appengine.api import search
+from google.appengine.api import search, memcache, taskqueue
 
 try:
 	import pytz
@@ -44,6 +46,42 @@ class MetaBaseSkel(type):
 		MetaBaseSkel._allSkelClasses.add(cls)
 		super(MetaBaseSkel, cls).__init__(name, bases, dct)
 
+def fetchEntities(keys):
+	"""
+		Fetches the entities for all *keys* with one batched multi-get.
+
+		:param keys: Keys of the entities to fetch
+		:type keys: iterable of str | iterable of server.db.Key
+		:returns: Mapping of string-encoded keys to their entities, None for keys that don't exist
+		:rtype: dict
+	"""
+	keys = {str(x): x for x in [(x if isinstance(x, db.Key) else db.decodeKey(x)) for x in keys]}
+	res = {x: None for x in keys.keys()}
+	if keys:
+		for entity in db.Get(keys.values()):
+			if entity is not None:
+				res[db.encodeKey(entity.key())] = entity
+	return res
+
+_refreshTakesPrefetched = {}  # Mapping bone class -> whether its refresh accepts prefetched
+
+def refreshBone(bone, valuesCache, boneName, skel, prefetched):
+	"""
+		Calls bone.refresh, passing *prefetched* only if that bone's refresh accepts it. Bones of
+		applications overriding refresh(valuesCache, boneName, skel) keep working that way.
+	"""
+	boneCls = type(bone)
+	if boneCls not in _refreshTakesPrefetched:
+		try:
+			args, varargs, varkw, defaults = inspect.getargspec(bone.refresh)
+			_refreshTakesPrefetched[boneCls] = bool(varargs or varkw or "prefetched" in args or len(args) > 4)
+		except TypeError:  # Not a python function
+			_refreshTakesPrefetched[boneCls] = False
+	if _refreshTakesPrefetched[boneCls]:
+		bone.refresh(valuesCache, boneName, skel, prefetched)
+	else:
+		bone.refresh(valuesCache, boneName, skel)
+
 def skeletonByKind(kindName):
 	if not kindName:
 		return None
@@ -106,7 +144,7 @@ class BaseSkeleton(object):
 		if item.startswith("_") or item in ["kindName","searchIndex","all","fromDB",
 						    "toDB", "items","keys","values","setValues","getValues","errors","fromClient",
 						    "preProcessBlobLocks","preProcessSerializedData","postSavedHandler",
-						    "postDeletedHandler", "delete","clone","getSearchDocumentFields","subSkels",
+						    "postDeletedHandler", "delete","clone","getSearchDocumentFields","subSkels","facetScopes",
 						    "subSkel","refresh", "valuesCache", "getValuesCache", "setValuesCache",
 						    "isClonedInstance", "setBoneValue", "unserialize", "serialize", "ensureIsCloned"]:
 			isOkay = True
@@ -313,7 +351,7 @@ class BaseSkeleton(object):
 				if bkey=="key":
 					try:
 						# Reading the value from db.Entity
-						self.valuesCache[bkey] = str( values.key() )
+						self.valuesCache[bkey] = db.encodeKey( values.key() )
 					except:
 						# Is it in the dict?
 						if "key" in values:
@@ -420,12 +458,20 @@ class BaseSkeleton(object):
 
 			This function causes a refresh of all relational bones and their associated
 			information.
+
+			The entities required by all bones are fetched with one multi-get first
+			(see :func:`server.bones.baseBone.getRefreshKeys`), then each bone applies its updates.
 		"""
+		refreshKeys = set()
+		for key, bone in self.items():
+			if isinstance(bone, baseBone):
+				refreshKeys.update(bone.getRefreshKeys(self.valuesCache, key))
+		prefetched = fetchEntities(refreshKeys)
 		for key,bone in self.items():
 			if not isinstance( bone, baseBone ):
 				continue
 			if "refresh" in dir( bone ):
-				bone.refresh( self.valuesCache, key, self )
+				refreshBone( bone, self.valuesCache, key, self, prefetched )
 
 
 class MetaSkel(MetaBaseSkel):
@@ -468,6 +514,7 @@ class Skeleton(BaseSkeleton):
 	kindName = __undefindedC__  # To which kind we save our data to
 	searchIndex = None  # If set, use this name as the index-name for the GAE search API
 	subSkels = {}  # List of pre-defined sub-skeletons of this type
+	facetScopes = []  # Names of bones (like a category) for whose values facet counts are maintained separately
 
 	# The "key" bone stores the current database key of this skeleton.
 	# Warning: Assigning to this bones value now *will* set the key
@@ -519,7 +566,7 @@ class Skeleton(BaseSkeleton):
 		"""
 		if isinstance(key, basestring):
 			try:
-				key = db.Key(key)
+				key = db.decodeKey(key)
 			except db.BadKeyError:
 				key = unicode(key)
 				if key.isdigit():
@@ -569,7 +616,7 @@ class Skeleton(BaseSkeleton):
 				dbObj = db.Entity(skel.kindName)
 				oldBlobLockObj = None
 			else:
-				k = db.Key(key)
+				k = db.decodeKey(key)
 				assert k.kind() == skel.kindName, "Cannot write to invalid kind!"
 				try:
 					dbObj = db.Get(k)
@@ -582,6 +629,9 @@ class Skeleton(BaseSkeleton):
 				except:
 					oldBlobLockObj = None
 
+			# Remember the old properties, so we can determine which bones have been changed
+			oldProperties = dict(dbObj)
+
 			# Remember old hashes for bones that must have an unique value
 			oldUniqeValues = {}
 			for boneName, boneInstance in skel.items():
@@ -635,12 +685,8 @@ class Skeleton(BaseSkeleton):
 							del dbObj["%s.uniqueIndexValue" % boneName]
 			if not skel.searchIndex:
 				# We generate the searchindex using the full skel, not this (maybe incomplete one)
-				tags = []
-				for key, _bone in skel.items():
-					if _bone.searchable:
-						tags += [tag for tag in _bone.getSearchTags(self.valuesCache, key) if
-						         (tag not in tags and len(tag) < 400)]
-				dbObj["viur_tags"] = tags
+				dbObj["viur_tags"] = list(fulltext.getSearchTerms(skel))
+			facets.updateFacets(skel, dbObj)
 			db.Put(dbObj)  # Write the core entry back
 			# Now write the blob-lock object
 			blobList = skel.preProcessBlobLocks(blobList)
@@ -703,11 +749,20 @@ class Skeleton(BaseSkeleton):
 							name=newUniqeValues[boneName])
 						newLockObj["references"] = str(dbObj.key())
 						db.Put(newLockObj)
-			return (str(dbObj.key()), dbObj, skel)
+			# Determine the bones whose serialized values have been changed by this write
+			changedBones = set()
+			for propName in set(dbObj.keys()) | set(oldProperties.keys()):
+				if propName in ["viur_delayed_update_tag", "viur_tags", "viur_facets"]:
+					continue
+				if dbObj.get(propName) != oldProperties.get(propName):
+					changedBones.add(propName.split(".")[0])
+			changedBones.intersection_update(skel.keys())
+			return (str(dbObj.key()), dbObj, skel, changedBones)
 
 		# END of txnUpdate subfunction
 
 		key = self["key"] or None
+		isAdd = key is None  # Nothing can reference an entity that is just being created
 		if not isinstance(clearUpdateTag, bool):
 			raise ValueError(
 				"Got an unsupported type %s for clearUpdateTag. toDB doesn't accept a key argument any more!" % str(
@@ -715,45 +770,19 @@ class Skeleton(BaseSkeleton):
 
 		# Allow bones to perform outstanding "magic" operations before saving to db
 		for bkey, _bone in self.items():
-			_bone.performMagic(self.valuesCache, bkey, isAdd=(key == None))
+			_bone.performMagic(self.valuesCache, bkey, isAdd=isAdd)
 
 		# Run our SaveTxn
 		if db.IsInTransaction():
-			key, dbObj, skel = txnUpdate(key, self, clearUpdateTag)
+			key, dbObj, skel, changedBones = txnUpdate(key, self, clearUpdateTag)
 		else:
-			key, dbObj, skel = db.RunInTransactionOptions(db.TransactionOptions(xg=True),
-			                                              txnUpdate, key, self, clearUpdateTag)
+			key, dbObj, skel, changedBones = db.RunInTransactionOptions(db.TransactionOptions(xg=True),
+			                                                            txnUpdate, key, self, clearUpdateTag)
 
-		# Perform post-save operations (postProcessSerializedData Hook, Searchindex, ..)
+		# Perform post-save operations (postSavedHandlers, searchindex, relations, ..)
 		self["key"] = str(key)
-		if self.searchIndex:  # Add a Document to the index if an index specified
-			fields = []
-
-			for boneName, bone in skel.items():
-				if bone.searchable:
-					fields.extend(bone.getSearchDocumentFields(self.valuesCache, boneName))
-
-			fields = skel.getSearchDocumentFields(fields)
-			if fields:
-				try:
-					doc = search.Document(doc_id="s_" + str(key), fields=fields)
-					search.Index(name=skel.searchIndex).put(doc)
-				except:
-					pass
-
-			else:  # Remove the old document (if any)
-				try:
-					search.Index(name=self.searchIndex).remove("s_" + str(key))
-				except:
-					pass
-
-		for boneName, bone in skel.items():
-			bone.postSavedHandler(self.valuesCache, boneName, skel, key, dbObj)
-
-		skel.postSavedHandler(key, dbObj)
-
-		if not clearUpdateTag:
-			updateRelations(key, time() + 1)
+		postSave.runStages(self, skel, key, dbObj, changedBones, clearUpdateTag,
+		                   skipStages=["relations"] if isAdd else None)
 
 		return (key)
 
@@ -796,7 +825,7 @@ class Skeleton(BaseSkeleton):
 		"""
 
 		def txnDelete(key, skel):
-			dbObj = db.Get(db.Key(key))  # Fetch the raw object as we might have to clear locks
+			dbObj = db.Get(db.decodeKey(key))  # Fetch the raw object as we might have to clear locks
 			for boneName, bone in skel.items():
 				# Ensure that we delete any value-lock objects remaining for this entry
 				if bone.unique:
@@ -828,7 +857,8 @@ class Skeleton(BaseSkeleton):
 					lockObj["is_stale"] = True
 					lockObj["has_old_blob_references"] = True
 					db.Put(lockObj)
-			db.Delete(db.Key(key))
+			facets.removeFacets(skel.kindName, dbObj)
+			db.Delete(db.decodeKey(key))
 
 		key = self["key"]
 		if key is None:
@@ -840,11 +870,10 @@ class Skeleton(BaseSkeleton):
 		for boneName, _bone in skel.items():
 			_bone.postDeletedHandler(skel, boneName, key)
 		skel.postDeletedHandler(key)
+		if not self.searchIndex and conf["viur.fulltext.enabled"]:
+			fulltext.updateDocument(skel.kindName, str(key))
 		if self.searchIndex:
-			try:
-				search.Index(name=self.searchIndex).remove("s_" + str(key))
-			except:
-				pass
+			searchQueue.removeDocument(self.searchIndex, "s_" + str(key))
 
 
 class RelSkel(BaseSkeleton):
@@ -915,7 +944,7 @@ class RelSkel(BaseSkeleton):
 				if bkey=="key":
 					try:
 						# Reading the value from db.Entity
-						self.valuesCache[bkey] = str( values.key() )
+						self.valuesCache[bkey] = db.encodeKey( values.key() )
 					except:
 						# Is it in the dict?
 						if "key" in values:
@@ -982,31 +1011,323 @@ class SkelList( list ):
 		self.baseSkel.setValuesCache(item)
 		return self.baseSkel
 
+class _HashBucket(list):
+	"""Values of a :class:`ColumnarSkelList` column sharing the same hash."""
+	pass
+
+class ColumnarSkelList( SkelList ):
+	"""
+		A :class:`SkelList` which stores its values per bone instead of one dict per entry.
+
+		Keys are interned and equal values within a column share the same object, which reduces the
+		memory needed for result sets with many repeating values (like languages, states or references
+		to the same entity). Dicts and lists (like the values of relational or multiple bones) are
+		compared by their contents; each entry of a list is shared on its own.
+		Iterating and *pop()* work like on :class:`SkelList`; changes made to the skeleton while
+		iterating are written back to the columns once the iteration moves on. Indexing returns a
+		freshly built values-cache (holding copies of shared dicts and lists), so changes to it are
+		lost unless it's assigned back (``skellist[i] = valuesCache``).
+	"""
+
+	def __init__( self, baseSkel ):
+		super( ColumnarSkelList, self ).__init__( baseSkel )
+		self.columns = {}  # boneName -> list of values, __undefindedC__ if not set in that row
+		self._sharedValues = {}  # boneName -> dict of hash -> value (or _HashBucket of values) already seen in that column
+		self._rowCount = 0
+
+	@staticmethod
+	def _freeze(value):
+		"""
+			Returns a hashable representation of *value*, comparing dicts and lists by their contents.
+		"""
+		if isinstance(value, dict):
+			return (dict, tuple(sorted((k, ColumnarSkelList._freeze(v)) for k, v in value.items())))
+		if isinstance(value, list):
+			return (list, tuple(ColumnarSkelList._freeze(x) for x in value))
+		return (type(value), value)
+
+	def _share(self, boneName, value):
+		if isinstance(value, list):
+			value = [self._share(boneName, x) for x in value]
+		try:
+			valueHash = hash(self._freeze(value))
+		except TypeError:  # Unhashable, can't be shared
+			return value
+		shared = self._sharedValues[boneName].get(valueHash)
+		if shared is None:
+			self._sharedValues[boneName][valueHash] = value
+			return value
+		if not isinstance(shared, _HashBucket):
+			if type(shared) is type(value) and shared == value:
+				return shared
+			shared = self._sharedValues[boneName][valueHash] = _HashBucket([shared])
+		for other in shared:
+			if type(other) is type(value) and other == value:
+				return other
+		shared.append(value)
+		return value
+
+	def _getRow(self, index):
+		res = {}
+		for boneName, column in self.columns.items():
+			value = column[index]
+			if value is __undefindedC__:
+				continue
+			if isinstance(value, (dict, list)):  # Shared with other rows, don't let changes leak into them
+				value = copy.deepcopy(value)
+			res[boneName] = value
+		return res
+
+	def _addColumns(self, valuesCache):
+		for boneName in valuesCache:
+			if boneName not in self.columns:
+				boneName = intern(str(boneName))
+				self.columns[boneName] = [__undefindedC__] * self._rowCount
+				self._sharedValues[boneName] = {}
+
+	def _setRow(self, index, valuesCache):
+		self._addColumns(valuesCache)
+		for boneName, column in self.columns.items():
+			column[index] = self._share(boneName, valuesCache.get(boneName, __undefindedC__))
+
+	def append(self, valuesCache):
+		self._addColumns(valuesCache)
+		for boneName, column in self.columns.items():
+			column.append(self._share(boneName, valuesCache.get(boneName, __undefindedC__)))
+		self._rowCount += 1
+
+	def extend(self, valuesCaches):
+		for valuesCache in valuesCaches:
+			self.append(valuesCache)
+
+	def __len__(self):
+		return self._rowCount
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self._getRow(x) for x in range(*index.indices(self._rowCount))]
+		if not -self._rowCount <= index < self._rowCount:
+			raise IndexError("ColumnarSkelList index out of range")
+		return self._getRow(index)
+
+	def __setitem__(self, index, valuesCache):
+		if not -self._rowCount <= index < self._rowCount:
+			raise IndexError("ColumnarSkelList index out of range")
+		self._setRow(index, valuesCache)
+
+	def __iter__(self):
+		for index in range(self._rowCount):
+			row = self._getRow(index)
+			self.baseSkel.setValuesCache(row)
+			try:
+				yield self.baseSkel
+			finally:
+				if index < self._rowCount:  # Write back changes made to that entry (unless it has been popped)
+					self._setRow(index, self.baseSkel.valuesCache)
+
+	def pop(self, index=-1):
+		item = self[index]
+		for column in self.columns.values():
+			column.pop(index)
+		self._rowCount -= 1
+		self.baseSkel.setValuesCache(item)
+		return self.baseSkel
+
 ### Tasks ###
 
+__relationStatsNamespace__ = "viur-relations-stats"  # Memcache namespace holding the metrics of updateRelations
+_referencedBonesCache = {}  # Mapping kindName -> set of bone names other skeletons copy via their refKeys
+
+def getReferencedBoneNames(kindName):
+	"""
+		Returns the names of all bones of *kindName* that are copied into other skeletons
+		by a relationalBone (ie. that are listed in the refKeys of such a bone).
+
+		:param kindName: The kind that's referenced
+		:type kindName: str
+		:rtype: set of str
+	"""
+	if kindName not in _referencedBonesCache:
+		res = set()
+		for skelCls in MetaBaseSkel._skelCache.values():
+			for key in dir(skelCls):
+				bone = getattr(skelCls, key)
+				if isinstance(bone, relationalBone) and bone.kind == kindName:
+					res.update(bone.refKeys)
+		_referencedBonesCache[kindName] = res
+	return _referencedBonesCache[kindName]
+
+def queueRelationUpdate(destID, changedBones=None):
+	"""
+		Schedules the propagation of changes made to *destID* into all entities referencing it.
+
+		All calls for the same entity and the same set of changed bones within
+		conf["viur.relations.updateDelay"] seconds are coalesced into one named task,
+		which runs after that time-window has been closed. Changes to bones which aren't
+		copied by any relationalBone won't schedule a task at all.
+
+		:param destID: The (string-encoded) key of the entity which has been changed
+		:type destID: str
+		:param changedBones: Names of the bones which have been changed, None if unknown.
+		:type changedBones: set of str | None
+		:returns: True if a new task has been added, False if there's nothing to do or an\
+			update for that entity is already pending.
+		:rtype: bool
+	"""
+	if changedBones is not None:
+		changedBones = set(changedBones) & getReferencedBoneNames(db.decodeKey(destID).kind())
+		if not changedBones:
+			return False  # Nobody keeps a copy of these values
+		changedBones = sorted(changedBones)
+	now = time()
+	delay = conf["viur.relations.updateDelay"]
+	if delay:
+		windowEnd = (int(now / delay) + 1) * delay
+	else:
+		windowEnd = int(now) + 1
+	bonesHash = sha1(",".join(changedBones or ["*"])).hexdigest()[:12]
+	taskName = "viur-updateRelations-%s-%s-%s" % (windowEnd, bonesHash, destID)
+	try:
+		updateRelations(destID, windowEnd + 1, changedBones=changedBones, queuedAt=now,
+		                _name=taskName, _countdown=int(windowEnd - now) + 1)
+	except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+		return False  # There's already an update pending
+	memcache.incr("queueDepth", initial_value=0, namespace=__relationStatsNamespace__)
+	return True
+
+
+def _runPostSavedHandlers(skel, mergedSkel, key, dbObj, changedBones, clearUpdateTag):
+	for boneName, bone in mergedSkel.items():
+		bone.postSavedHandler(skel.valuesCache, boneName, mergedSkel, key, dbObj)
+	mergedSkel.postSavedHandler(key, dbObj)
+
+
+def _updateSearchIndex(kindName, key, changedBones, clearUpdateTag):
+	skelCls = skeletonByKind(kindName)
+	if skelCls is None or not skelCls.searchIndex:
+		return
+	skel = skelCls()
+	if not skel.fromDB(key):
+		return  # Deleted meanwhile
+	fields = []
+	for boneName, bone in skel.items():
+		if bone.searchable:
+			fields.extend(bone.getSearchDocumentFields(skel.valuesCache, boneName))
+	fields = skel.getSearchDocumentFields(fields)
+	if fields:
+		searchQueue.putDocument(skel.searchIndex, search.Document(doc_id="s_" + str(key), fields=fields))
+	else:  # Remove the old document (if any)
+		searchQueue.removeDocument(skel.searchIndex, "s_" + str(key))
+
+
+def _queueRelationUpdate(kindName, key, changedBones, clearUpdateTag):
+	if not clearUpdateTag and changedBones:
+		queueRelationUpdate(key, changedBones)
+
+
+postSave.registerStage("postSavedHandler", _runPostSavedHandlers)
+postSave.registerStage("searchIndex", _updateSearchIndex, isAsync=True)
+postSave.registerStage("relations", _queueRelationUpdate, isAsync=True)
+
+def getRelationUpdateStats():
+	"""
+		Returns the metrics collected by :func:`updateRelations`.
+
+		- *queueDepth*: Number of updates scheduled but not finished yet
+		- *lastLag*: Seconds between the first change and the end of the last finished update
+		- *maxLag*: The largest lag seen since the stats have been reset
+		- *updated*: Number of referencing entities rewritten
+		- *skipped*: Number of referencing entities which have been already up to date
+
+		These values are kept in memcache, so they might get lost or be slightly off.
+
+		:rtype: dict
+	"""
+	keys = ["queueDepth", "lastLag", "maxLag", "updated", "skipped"]
+	res = memcache.get_multi(keys, namespace=__relationStatsNamespace__)
+	return {k: res.get(k, 0) for k in keys}
+
 @callDeferred
-def updateRelations( destID, minChangeTime, cursor=None ):
+def updateRelations(destID, minChangeTime, cursor=None, changedBones=None, queuedAt=None):
+	"""
+		Updates all entities referencing *destID* with its current values.
+
+		The relations are processed in batches of conf["viur.relations.updateBatchSize"] entries.
+		Referencing entities are fetched in one batch; only these holding values that actually
+		differ from the referenced entity are refreshed and written back.
+
+		Don't call directly, use :func:`queueRelationUpdate` instead.
+
+		:param destID: The (string-encoded) key of the entity which has been changed
+		:param minChangeTime: Only process relations which have not been updated since
+		:param cursor: Continue processing at this cursor
+		:param changedBones: If set, relations copying none of these bones are skipped
+		:param queuedAt: Timestamp the update has been scheduled, used for the lag metrics
+	"""
 	logging.debug("Starting updateRelations for %s ; minChangeTime %s", destID, minChangeTime)
+	batchSize = conf["viur.relations.updateBatchSize"]
 	updateListQuery = db.Query( "viur-relations" ).filter("dest.key =", destID ).filter("viur_delayed_update_tag <",minChangeTime)
 	if cursor:
 		updateListQuery.cursor( cursor )
-	updateList = updateListQuery.run(limit=5)
-
-	for srcRel in updateList:
-		try:
-			skel = skeletonByKind(srcRel["viur_src_kind"])()
-		except AssertionError:
-			logging.info("Deleting %s which refers to unknown kind %s" % (str(srcRel.key()), srcRel["viur_src_kind"]))
+	updateList = updateListQuery.run(limit=batchSize) or []
+	try:
+		destEntity = db.Get(db.decodeKey(destID))
+	except db.EntityNotFoundError:
+		logging.info("Not updating references to %s, it has been deleted" % destID)
+		destEntity = None
+	updated = skipped = 0
+
+	# Collect the bones of each referencing entity we have to look at
+	referencingBones = OrderedDict()  # Key of the referencing entity -> (kindName, set of boneNames)
+	for srcRel in (updateList if destEntity is not None else []):
+		if srcRel["viur_src_kind"] not in MetaBaseSkel._skelCache:
+			logging.info("Skipping %s which refers to unknown kind %s" % (str(srcRel.key()), srcRel["viur_src_kind"]))
 			continue
+		if changedBones is not None:
+			bone = getattr(skeletonByKind(srcRel["viur_src_kind"]), srcRel["viur_src_property"], None)
+			if isinstance(bone, relationalBone) and not set(bone.refKeys) & set(changedBones):
+				skipped += 1
+				continue
+		srcKey = str(srcRel.key().parent())
+		if srcKey not in referencingBones:
+			referencingBones[srcKey] = (srcRel["viur_src_kind"], set())
+		referencingBones[srcKey][1].add(srcRel["viur_src_property"])
+
+	# Fetch all referencing entities at once
+	srcEntities = fetchEntities(referencingBones.keys())
 
-		if not skel.fromDB( str(srcRel.key().parent()) ):
-			logging.warning("Cannot update stale reference to %s (referenced from %s)" % (str(srcRel.key().parent()), str(srcRel.key())))
+	for srcKey, (kindName, boneNames) in referencingBones.items():
+		if srcEntities.get(srcKey) is None:
+			logging.warning("Cannot update stale reference to %s from %s" % (destID, srcKey))
 			continue
-		for key,_bone in skel.items():
-			_bone.refresh(skel.valuesCache, key, skel)
-		skel.toDB( clearUpdateTag=True )
-	if len(updateList)==5:
-		updateRelations( destID, minChangeTime, updateListQuery.getCursor().urlsafe() )
+		skel = skeletonByKind(kindName)()
+		skel.setValues(srcEntities[srcKey])
+		isStale = False
+		for boneName in boneNames:
+			bone = getattr(skel, boneName, None)
+			if isinstance(bone, relationalBone) and bone.refNeedsUpdate(skel.valuesCache, boneName, destID, destEntity):
+				refreshBone(bone, skel.valuesCache, boneName, skel, {destID: destEntity})
+				isStale = True
+		if isStale:
+			skel.toDB(clearUpdateTag=True)
+			updated += 1
+		else:
+			skipped += 1
+
+	logging.debug("updateRelations for %s: %s entities updated, %s skipped" % (destID, updated, skipped))
+	memcache.offset_multi({"updated": updated, "skipped": skipped}, initial_value=0,
+	                      namespace=__relationStatsNamespace__)
+	if len(updateList) == batchSize:
+		updateRelations(destID, minChangeTime, updateListQuery.getCursor().urlsafe(),
+		                changedBones=changedBones, queuedAt=queuedAt)
+	elif queuedAt:
+		# This has been the last batch for this entity
+		lag = time() - queuedAt
+		logging.info("updateRelations for %s finished, lag was %.1f seconds" % (destID, lag))
+		memcache.decr("queueDepth", namespace=__relationStatsNamespace__)
+		memcache.set("lastLag", lag, namespace=__relationStatsNamespace__)
+		if lag > (memcache.get("maxLag", namespace=__relationStatsNamespace__) or 0):
+			memcache.set("maxLag", lag, namespace=__relationStatsNamespace__)
 
 
 @CallableTask
@@ -1014,6 +1335,9 @@ class TaskUpdateSearchIndex( CallableTaskBase ):
 	"""
 	This tasks loads and saves *every* entity of the given module.
 	This ensures an updated searchIndex and verifies consistency of this data.
+
+	The work is done by a rebuild job (see :func:`startRebuildJob`), which can be paused and resumed
+	using :class:`TaskControlRebuildJob`.
 	"""
 	key = "rebuildSearchIndex"
 	name = u"Rebuild search index"
@@ -1032,15 +1356,13 @@ class TaskUpdateSearchIndex( CallableTaskBase ):
 		modules = ["*"] + listKnownSkeletons()
 		skel = BaseSkeleton(cloned=True)
 		skel.module = selectBone( descr="Module", values={ x: x for x in modules}, required=True )
-		def verifyCompact(val):
-			if not val or val.lower()=="no" or val=="YES":
-				return None
-			return "Must be \"No\" or uppercase \"YES\" (very dangerous!)"
-		skel.compact = stringBone(descr="Recreate Entities", vfunc=verifyCompact, required=False, defaultValue="NO")
+		skel.concurrency = numericBone(descr="Shards processed in parallel", min=1, max=100, required=True,
+		                               defaultValue=conf["viur.rebuild.concurrency"])
+		skel.changedSince = dateBone(descr="Only entities changed since", required=False)
 		return skel
 
 
-	def execute(self, module, compact="", *args, **kwargs):
+	def execute(self, module, concurrency=None, changedSince=None, *args, **kwargs):
 		usr = utils.getCurrentUser()
 		if not usr:
 			logging.warning("Don't know who to inform after rebuilding finished")
@@ -1048,16 +1370,358 @@ class TaskUpdateSearchIndex( CallableTaskBase ):
 		else:
 			notify = usr["name"]
 		if module == "*":
-			for module in listKnownSkeletons():
-				logging.info("Rebuilding search index for module '%s'" % module)
-				processChunk(module, compact, None,  notify=notify)
+			modules = listKnownSkeletons()
+		else:
+			modules = [module]
+		jobKey = startRebuildJob(modules, concurrency=concurrency, changedSince=changedSince, notify=notify)
+		logging.info("Started rebuild job %s for %s" % (jobKey, ", ".join(modules)))
+
+
+@CallableTask
+class TaskControlRebuildJob( CallableTaskBase ):
+	"""
+	Pauses or resumes a rebuild job started by :class:`TaskUpdateSearchIndex`.
+	"""
+	key = "controlRebuildJob"
+	name = u"Pause or resume rebuild job"
+	descr = u"Pauses a running rebuild job or resumes a paused (or partly failed) one."
+
+	def canCall(self):
+		user = utils.getCurrentUser()
+		return user is not None and "root" in user["access"]
+
+	def dataSkel(self):
+		skel = BaseSkeleton(cloned=True)
+		skel.job = stringBone(descr="Job", required=True)
+		skel.action = selectBone(descr="Action", values={"pause": "Pause", "resume": "Resume"}, required=True)
+		return skel
+
+	def execute(self, job, action, *args, **kwargs):
+		if action == "pause":
+			pauseRebuildJob(job)
+		else:
+			resumeRebuildJob(job)
+
+def _splitKindIntoShards(kindName, shardCount):
+	"""
+		Splits *kindName* into up to *shardCount* key-ranges of roughly the same size.
+
+		The split points are derived from a sample of keys in __scatter__ order.
+
+		:returns: List of (rangeStart, rangeEnd) tuples, None meaning unbounded
+		:rtype: list of tuple
+	"""
+	if shardCount < 2:
+		return [(None, None)]
+	sample = db.Query(kindName).order("__scatter__").run(shardCount * 32, keysOnly=True) or []
+	sample = sorted(sample)
+	splits = []
+	for i in range(1, shardCount):
+		if not sample:
+			break
+		splitKey = sample[len(sample) * i // shardCount]
+		if not splits or splits[-1] != splitKey:
+			splits.append(splitKey)
+	bounds = [None] + splits + [None]
+	return zip(bounds[:-1], bounds[1:])
+
+def _splitTimeIntoShards(start, end, shardCount):
+	"""
+		Splits the time-range [*start*, *end*) into *shardCount* intervals of the same length.
+
+		:rtype: list of tuple
+	"""
+	step = (end - start) / max(shardCount, 1)
+	if step <= timedelta(0):
+		return [(start, end)]
+	bounds = [start + step * i for i in range(shardCount)] + [end]
+	return zip(bounds[:-1], bounds[1:])
+
+def startRebuildJob(modules, concurrency=None, changedSince=None, notify=None):
+	"""
+		Starts loading and saving all entities of the given *modules*.
+
+		Each kind is split into conf["viur.rebuild.shardsPerKind"] shards, which are processed
+		by up to *concurrency* chains of deferred tasks in parallel. Each shard keeps a checkpoint
+		of its progress, so the job can be paused and resumed at any time.
+
+		:param modules: Names of the kinds to rebuild
+		:type modules: list of str
+		:param concurrency: Maximum amount of shards processed in parallel, defaults to\
+			conf["viur.rebuild.concurrency"]
+		:type concurrency: int
+		:param changedSince: If set, only entities with a changedate since then are rebuild
+		:type changedSince: datetime
+		:param notify: Email address to inform after the job finished
+		:type notify: str
+		:returns: The (string-encoded) key of the job
+		:rtype: str
+	"""
+	concurrency = int(concurrency or conf["viur.rebuild.concurrency"])
+	shardCount = conf["viur.rebuild.shardsPerKind"]
+	now = datetime.now()
+	if changedSince and changedSince.tzinfo is not None:
+		changedSince = changedSince.replace(tzinfo=None) - changedSince.utcoffset()
+	job = db.Entity("viur-rebuild-jobs")
+	job["modules"] = modules
+	job["state"] = "running"
+	job["changedSince"] = changedSince
+	job["concurrency"] = concurrency
+	job["notify"] = notify
+	job["creationdate"] = now
+	job["shards"] = []
+	jobKey = db.Put(job)
+	shards = []
+	for kindName in modules:
+		if not skeletonByKind(kindName):
+			logging.error("startRebuildJob: Invalid module %s" % kindName)
+			continue
+		if changedSince:
+			# Entities we save get a new changedate, so the end of the range must be fixed
+			ranges = _splitTimeIntoShards(changedSince, now, shardCount)
+			rangeProperty = "changedate"
 		else:
-			processChunk(module, compact, None, notify=notify)
+			ranges = _splitKindIntoShards(kindName, shardCount)
+			rangeProperty = db.KEY_SPECIAL_PROPERTY
+		for idx, (rangeStart, rangeEnd) in enumerate(ranges):
+			shard = db.Entity("viur-rebuild-shards", name="%s_%s_%s" % (jobKey.id_or_name(), kindName, idx))
+			shard["job"] = jobKey
+			shard["kindName"] = kindName
+			shard["rangeProperty"] = rangeProperty
+			shard["rangeStart"] = rangeStart
+			shard["rangeEnd"] = rangeEnd
+			shard["cursor"] = None
+			shard["state"] = "pending"
+			shard["count"] = 0
+			shard["errors"] = 0
+			shard["lastError"] = None
+			shard["updatedAt"] = now
+			shards.append(shard)
+	shardKeys = db.Put(shards) if shards else []
+	job["shards"] = shardKeys if isinstance(shardKeys, list) else [shardKeys]
+	db.Put(job)
+	_startRebuildWorkers(jobKey, concurrency)
+	return str(jobKey)
+
+def _startRebuildWorkers(jobKey, amount):
+	"""
+		Starts up to *amount* new worker chains for the given job.
+	"""
+	for i in range(amount):
+		if not _claimRebuildShard(jobKey):
+			break
+
+def _claimRebuildShard(jobKey):
+	"""
+		Picks the next pending (or paused) shard of the job and starts processing it.
+
+		If there's nothing left to do, the job is marked as finished.
+
+		:returns: The key of the shard claimed or None
+	"""
+	job = db.Get(jobKey)
+	if job["state"] != "running":
+		return None
+
+	def txn(shardKey):
+		shard = db.Get(shardKey)
+		if shard["state"] not in ["pending", "paused"]:
+			return False
+		shard["state"] = "running"
+		db.Put(shard)
+		processRebuildShard(str(shardKey), _transactional=True)
+		return True
+
+	shards = db.Get(job.get("shards")) if job.get("shards") else []
+	for shard in shards:
+		if shard["state"] in ["pending", "paused"] and db.RunInTransaction(txn, shard.key()):
+			return shard.key()
+	if all([shard["state"] in ["done", "failed"] for shard in shards]):
+		_finishRebuildJob(jobKey, shards)
+	return None
+
+def _finishRebuildJob(jobKey, shards):
+	"""
+		Marks the job as done and informs whoever started it.
+	"""
+	def txn(jobKey):
+		job = db.Get(jobKey)
+		if job["state"] != "running":
+			return None
+		job["state"] = "done"
+		job["finishedAt"] = datetime.now()
+		db.Put(job)
+		return job
+
+	job = db.RunInTransaction(txn, jobKey)
+	if not job:
+		return  # Someone else has been faster
+	total = sum([shard["count"] for shard in shards])
+	failed = [shard for shard in shards if shard["state"] == "failed"]
+	logging.info("Rebuild job %s finished, %d records refreshed, %d shards failed" % (str(jobKey), total, len(failed)))
+	try:
+		if job["notify"]:
+			txt = ( "Subject: Rebuild search index finished for %s\n\n"+
+		                "ViUR finished to rebuild the search index for module %s.\n"+
+		                "%d records updated in total, %d shards failed.") % (", ".join(job["modules"]),
+			                                                             ", ".join(job["modules"]),
+			                                                             total, len(failed))
+			utils.sendEMail([job["notify"]], txt, None)
+	except: #OverQuota, whatever
+		pass
+
+@callDeferred
+def processRebuildShard(shardKey):
+	"""
+		Processes the next conf["viur.rebuild.batchSize"] entities of the given shard.
+
+		Calls itself again until the shard has been completed, then claims the next shard of the job.
+		Failing batches are retried; after conf["viur.rebuild.maxErrors"] errors the shard is given up.
+	"""
+	shard = db.Get(shardKey)
+	jobKey = shard["job"]
+	job = db.Get(jobKey)
+	if job["state"] != "running":
+		shard["state"] = "paused"
+		db.Put(shard)
+		if db.Get(jobKey)["state"] == "running":  # Resumed in the meantime
+			_claimRebuildShard(jobKey)
+		return
+	Skel = skeletonByKind(shard["kindName"])
+	if not Skel:
+		logging.error("processRebuildShard: Invalid module %s" % shard["kindName"])
+		shard["state"] = "failed"
+		db.Put(shard)
+		_claimRebuildShard(jobKey)
+		return
+	rangeProperty = str(shard["rangeProperty"])
+	query = db.Query(shard["kindName"])
+	if shard["rangeStart"] is not None:
+		query.filter("%s >=" % rangeProperty, shard["rangeStart"])
+	if shard["rangeEnd"] is not None:
+		query.filter("%s <" % rangeProperty, shard["rangeEnd"])
+	if rangeProperty != db.KEY_SPECIAL_PROPERTY:
+		query.order(rangeProperty)
+	if shard["cursor"]:
+		query.cursor(shard["cursor"])
+	batchSize = conf["viur.rebuild.batchSize"]
+	try:
+		keys = query.run(batchSize, keysOnly=True) or []
+		entities = fetchEntities(keys)
+		for key in keys:
+			if entities.get(str(key)) is None:
+				continue  # Deleted in the meantime
+			skel = Skel()
+			skel.setValues(entities[str(key)])
+			skel.refresh()
+			skel.toDB(clearUpdateTag=True)
+	except Exception as e:
+		logging.error("Rebuilding shard %s failed" % shardKey)
+		logging.exception(e)
+		shard["errors"] = (shard["errors"] or 0) + 1
+		shard["lastError"] = str(e)
+		shard["updatedAt"] = datetime.now()
+		if shard["errors"] < conf["viur.rebuild.maxErrors"]:
+			db.Put(shard)
+			raise  # Let the task queue retry this batch
+		shard["state"] = "failed"
+		db.Put(shard)
+		_claimRebuildShard(jobKey)
+		return
+	newCursor = query.getCursor()
+	shard["count"] += len(keys)
+	shard["updatedAt"] = datetime.now()
+	if len(keys) == batchSize and newCursor and newCursor.urlsafe() != shard["cursor"]:
+		shard["cursor"] = newCursor.urlsafe()
+		db.Put(shard)
+		processRebuildShard(shardKey)
+	else:
+		logging.info("Shard %s finished, %d records refreshed" % (shardKey, shard["count"]))
+		shard["state"] = "done"
+		db.Put(shard)
+		_claimRebuildShard(jobKey)
+
+def pauseRebuildJob(jobKey):
+	"""
+		Pauses the given job. Shards currently processed stop after their current batch.
+	"""
+	def txn(jobKey):
+		job = db.Get(jobKey)
+		if job["state"] == "running":
+			job["state"] = "paused"
+			db.Put(job)
+	db.RunInTransaction(txn, db.Key(jobKey))
+
+def resumeRebuildJob(jobKey):
+	"""
+		Resumes a paused job. Shards which failed before are retried, too.
+	"""
+	jobKey = db.Key(jobKey)
+
+	def txn(jobKey):
+		job = db.Get(jobKey)
+		if job["state"] not in ["paused", "done"]:
+			return None
+		job["state"] = "running"
+		db.Put(job)
+		return job
+
+	job = db.RunInTransaction(txn, jobKey)
+	if not job:
+		return
+	retryShards = [shard for shard in db.Get(job.get("shards") or []) if shard["state"] == "failed"]
+	for shard in retryShards:
+		shard["state"] = "pending"
+		shard["errors"] = 0
+	if retryShards:
+		db.Put(retryShards)
+	_startRebuildWorkers(jobKey, job["concurrency"])
+
+def getRebuildJobStatus(jobKey):
+	"""
+		Returns the progress of the given rebuild job.
+
+		- *state*: running, paused or done
+		- *shards*: Amount of shards per state (pending, running, paused, done, failed)
+		- *count*: Entities refreshed so far
+		- *errors*: Errors seen so far
+		- *estimated*: Number of entities in the kinds processed, according to the datastore\
+			statistics (None if unknown or in incremental mode)
+
+		:rtype: dict
+	"""
+	job = db.Get(db.Key(jobKey))
+	shards = db.Get(job.get("shards")) if job.get("shards") else []
+	res = {
+		"state": job["state"],
+		"modules": job["modules"],
+		"changedSince": job["changedSince"],
+		"shards": {x: 0 for x in ["pending", "running", "paused", "done", "failed"]},
+		"count": 0,
+		"errors": 0,
+		"estimated": None
+	}
+	for shard in shards:
+		res["shards"][shard["state"]] += 1
+		res["count"] += shard["count"]
+		res["errors"] += shard["errors"] or 0
+	if not job["changedSince"]:
+		try:
+			res["estimated"] = 0
+			for kindName in job["modules"]:
+				stat = db.Query("__Stat_Kind__").filter("kind_name =", kindName).get()
+				res["estimated"] += stat["count"] if stat else 0
+		except Exception as e:  # Statistics aren't available (yet)
+			logging.debug("Cannot read datastore statistics: %s" % e)
+			res["estimated"] = None
+	return res
 
 @callDeferred
 def processChunk(module, compact, cursor, allCount=0, notify=None):
 	"""
 		Processes 100 Entries and calls the next batch
+
+		Superseded by :func:`processRebuildShard`, kept for tasks which are still queued.
 	"""
 	Skel = skeletonByKind( module )
 	if not Skel:
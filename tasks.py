@@ -153,6 +153,7 @@ class TaskHandler:
 		elif cmd=="unb":
 			if not funcPath in _deferedTasks:
 				logging.error("Ive missed a defered task! %s(%s,%s)" % (funcPath,str(args), str(kwargs)))
+			request.current.get().DEFERED_TASK_CALLED = True #Defer any further calls to deferred functions
 			try:
 				_deferedTasks[ funcPath](*args, **kwargs)
 			except PermanentTaskFailure:
@@ -272,6 +273,8 @@ def callDeferred( func ):
 			req = None
 		if req is not None and "HTTP_X_APPENGINE_TASKRETRYCOUNT".lower() in [x.lower() for x in os.environ.keys()] and not "DEFERED_TASK_CALLED" in dir( req ): #This is the deferred call
 			req.DEFERED_TASK_CALLED = True #Defer recursive calls to an deferred function again.
+			for x in ("countdown", "eta", "name", "target", "retry_options", "transactional"):
+				kwargs.pop("_%s" % x, None) #These are options for the task queue, not for the function itself
 			if self is __undefinedFlag_:
 				return func(*args, **kwargs)
 			else: